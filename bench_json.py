@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+JSON micro-benchmark for the FAST_JSON path
+Times body decoding, model validation and response encoding for a large
+/populate_google_sheet payload with the standard library and with orjson, then
+measures bridge CPU per request end to end with FAST_JSON off and on.
+
+    python bench_json.py --rows 20000 --cols 10
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def make_payload(rows: int, cols: int) -> dict:
+    values = [[f"r{r}c{c}" if c % 2 else r * cols + c + 0.5 for c in range(cols)] for r in range(rows)]
+    return {"sheet_id": "bench-sheet", "values": values, "range": "A1"}
+
+
+def best_of(repeat: int, fn) -> float:
+    """Fastest of `repeat` runs, in milliseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def component_timings(payload: dict, repeat: int) -> dict:
+    import orjson
+    from fastapi.responses import JSONResponse
+    from main import PopulateSheetRequest
+
+    body = json.dumps(payload).encode("utf-8")
+    data = json.loads(body)
+    return {
+        "body_bytes": len(body),
+        "decode_stdlib_ms": best_of(repeat, lambda: json.loads(body)),
+        "decode_orjson_ms": best_of(repeat, lambda: orjson.loads(body)),
+        "validate_ms": best_of(repeat, lambda: PopulateSheetRequest(**data)),
+        "encode_stdlib_ms": best_of(repeat, lambda: JSONResponse(data)),
+        "encode_orjson_ms": best_of(repeat, lambda: orjson.dumps(data)),
+    }
+
+
+async def google_sink(scope, receive, send):
+    """Stands in for Google: drains the request and answers {} so only bridge work is measured"""
+    more_body = True
+    while more_body:
+        more_body = (await receive()).get("more_body", False)
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+async def request_cpu(payload: dict, requests: int) -> float:
+    """Bridge CPU milliseconds per POST /populate_google_sheet"""
+    import benchmark
+
+    async with contextlib.AsyncExitStack() as stack:
+        _, bridge = await benchmark.start_bridge(google_sink, stack)
+        stack.push_async_callback(bridge.aclose)
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"content-type": "application/json"}
+        await bridge.post("/populate_google_sheet", content=body, headers=headers)  # warm up
+
+        started = time.process_time()
+        for _ in range(requests):
+            response = await bridge.post("/populate_google_sheet", content=body, headers=headers)
+            response.raise_for_status()
+        return (time.process_time() - started) / requests * 1000
+
+
+def run_child(args):
+    import benchmark
+
+    benchmark.configure_environment(tempfile.mkdtemp(prefix="bridge-json-bench-"), respect_quotas=False)
+    payload = make_payload(args.rows, args.cols)
+    print(json.dumps({"cpu_ms_per_request": asyncio.run(request_cpu(payload, args.requests))}))
+
+
+def end_to_end(args, fast: bool) -> float:
+    env = dict(os.environ, FAST_JSON="1" if fast else "0")
+    output = subprocess.check_output(
+        [sys.executable, __file__, "--child", "--rows", str(args.rows), "--cols", str(args.cols),
+         "--requests", str(args.requests)],
+        env=env, text=True,
+    )
+    return json.loads(output.strip().splitlines()[-1])["cpu_ms_per_request"]
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--cols", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5, help="runs per component timing (best is reported)")
+    parser.add_argument("--requests", type=int, default=10, help="requests per end-to-end measurement")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    # Importing main opens its SQLite stores; keep them out of the working tree
+    workdir = tempfile.mkdtemp(prefix="bridge-json-bench-")
+    os.environ.setdefault("JOB_DB", os.path.join(workdir, "jobs.db"))
+    os.environ.setdefault("SHEET_SYNC_DB", os.path.join(workdir, "sheet_sync.db"))
+    os.environ.setdefault("DRIVE_CHANGES_DB", os.path.join(workdir, "drive_changes.db"))
+    payload = make_payload(args.rows, args.cols)
+    timings = component_timings(payload, args.repeat)
+    print(f"Payload: {args.rows} rows x {args.cols} cols, {timings['body_bytes'] / 1e6:.1f} MB")
+    print(f"  decode    stdlib {timings['decode_stdlib_ms']:8.1f} ms   orjson {timings['decode_orjson_ms']:8.1f} ms")
+    print(f"  validate         {timings['validate_ms']:8.1f} ms   (same on both paths)")
+    print(f"  encode    stdlib {timings['encode_stdlib_ms']:8.1f} ms   orjson {timings['encode_orjson_ms']:8.1f} ms")
+
+    slow, fast = end_to_end(args, fast=False), end_to_end(args, fast=True)
+    print(f"\nBridge CPU per request: FAST_JSON=0 {slow:.1f} ms, FAST_JSON=1 {fast:.1f} ms "
+          f"({(1 - fast / slow) * 100 if slow else 0:.0f}% less)")
+
+
+if __name__ == "__main__":
+    main_cli()
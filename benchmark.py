@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Load-test benchmark for the bridge
+Drives main.app in-process against the fake Google server at fixed concurrency
+levels and reports throughput and p50/p95/p99 latency per endpoint. Results are
+saved as JSON so runs can be compared between commits.
+
+    python benchmark.py --concurrency 1 8 32 --requests 200
+    python benchmark.py --compare bench_results/<old-commit>.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_HOST = "http://fake-google"
+
+
+def configure_environment(workdir: str, respect_quotas: bool):
+    """Must run before main is imported: these are read at import time"""
+    os.environ["GOOGLE_API_BASE_URL"] = BENCH_HOST
+    os.environ["TOKEN_STORE"] = f"sqlite:{os.path.join(workdir, 'tokens.db')}"
+    os.environ["JOB_DB"] = os.path.join(workdir, "jobs.db")
+    os.environ["SHEET_SYNC_DB"] = os.path.join(workdir, "sheet_sync.db")
+    os.environ["DRIVE_CHANGES_DB"] = os.path.join(workdir, "drive_changes.db")
+    if not respect_quotas:
+        unlimited = {f"{api}.{kind}.{scope}": 10 ** 9
+                     for api in ("docs", "sheets", "drive")
+                     for kind in ("read", "write")
+                     for scope in ("project", "user")}
+        os.environ["GOOGLE_QUOTA_OVERRIDES"] = json.dumps(unlimited)
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def start_bridge(fake_app, stack: contextlib.AsyncExitStack):
+    import httpx
+    from google.oauth2.credentials import Credentials
+
+    import main
+    from credential_store import DEFAULT_TENANT
+    from google_client import open_http_client
+
+    # Runs the app's startup handlers now and its shutdown handlers when the stack closes
+    await stack.enter_async_context(main.app.router.lifespan_context(main.app))
+    # Route the bridge's Google traffic into the fake instead of the network
+    await main.app.state.http.aclose()
+    main.app.state.http = open_http_client(transport=httpx.ASGITransport(app=fake_app))
+    main.credential_store.save(DEFAULT_TENANT, Credentials(
+        token="bench-token", refresh_token="bench-refresh", client_id="bench", client_secret="bench",
+        expiry=datetime.datetime.utcnow() + datetime.timedelta(days=1),
+    ))
+    bridge = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bridge",
+                               timeout=120)
+    return main, bridge
+
+
+async def run_level(bridge, endpoint: str, payload_for, concurrency: int, total: int) -> dict:
+    latencies, errors = [], 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            response = await bridge.post(endpoint, json=payload_for(i))
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400 or response.json().get("status") == "error":
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(total / wall, 2) if wall else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def run(args) -> dict:
+    import fake_google
+
+    fake_google.fake.config.update({
+        "latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms,
+        "error_rate": args.error_rate, "quota_per_minute": args.quota_per_minute,
+    })
+    async with contextlib.AsyncExitStack() as stack:
+        main, bridge = await start_bridge(fake_google.app, stack)
+        stack.push_async_callback(bridge.aclose)
+        return await run_scenarios(args, fake_google, bridge)
+
+
+async def run_scenarios(args, fake_google, bridge) -> dict:
+    doc_id = (await bridge.post("/create_doc_chat", json={"name": "Bench doc"})).json()["doc_id"]
+    sheet_id = (await bridge.post("/create_sheet_chat", json={"name": "Bench sheet"})).json()["sheet_id"]
+    block = [[f"r{r}c{c}" for c in range(args.cols)] for r in range(args.rows)]
+    scenarios = {
+        "/create_doc_chat": lambda i: {"name": f"Bench doc {i}"},
+        "/append_text_doc": lambda i: {"doc_id": doc_id, "text": f"Line {i}"},
+        "/create_sheet_chat": lambda i: {"name": f"Bench sheet {i}"},
+        "/populate_google_sheet": lambda i: {"sheet_id": sheet_id, "values": block,
+                                             "range": f"A{i * args.rows + 1}"},
+    }
+    results = []
+    for endpoint in args.endpoints or list(scenarios):
+        for concurrency in args.concurrency:
+            result = await run_level(bridge, endpoint, scenarios[endpoint], concurrency, args.requests)
+            results.append(result)
+            print(f"{endpoint:<26} c={concurrency:<4} {result['throughput_rps']:>9.1f} req/s  "
+                  f"p50 {result['p50_ms']:>8.1f}ms  p95 {result['p95_ms']:>8.1f}ms  "
+                  f"p99 {result['p99_ms']:>8.1f}ms  errors {result['errors']}")
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "python": sys.version.split()[0],
+        "fake_google": fake_google.fake.config.to_dict(),
+        "settings": {"requests": args.requests, "rows": args.rows, "cols": args.cols},
+        "results": results,
+        "fake_calls": dict(fake_google.fake.calls),
+    }
+
+
+def compare(current: dict, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {(r["endpoint"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\nvs {baseline.get('commit')} ({baseline_path})")
+    for result in current["results"]:
+        old = before.get((result["endpoint"], result["concurrency"]))
+        if old is None:
+            continue
+        rps = (result["throughput_rps"] / old["throughput_rps"] - 1) * 100 if old["throughput_rps"] else 0
+        p99 = (result["p99_ms"] / old["p99_ms"] - 1) * 100 if old["p99_ms"] else 0
+        print(f"{result['endpoint']:<26} c={result['concurrency']:<4} throughput {rps:+7.1f}%  p99 {p99:+7.1f}%")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and level")
+    parser.add_argument("--endpoints", nargs="*", help="subset of endpoints to run")
+    parser.add_argument("--rows", type=int, default=100, help="rows per populate_google_sheet call")
+    parser.add_argument("--cols", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--quota-per-minute", type=int, default=0, help="fake server quota; 0 disables")
+    parser.add_argument("--respect-quotas", action="store_true",
+                        help="keep the bridge's own Google quota limits instead of lifting them")
+    parser.add_argument("--output", help="JSON output path (default bench_results/<commit>.json)")
+    parser.add_argument("--compare", help="previous results JSON to diff against")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bridge-bench-")
+    configure_environment(workdir, args.respect_quotas)
+    report = asyncio.run(run(args))
+
+    output = args.output or os.path.join("bench_results", f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📄 Results saved to {output}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,191 @@
+"""
+Shared HTTP client for talking to the bridge
+Used by both middlewares and the test scripts: one keep-alive connection pool
+(HTTP/2 when the h2 package is installed), connect and read timeouts, gzip
+responses decoded transparently, large JSON bodies compressed before upload,
+and retries for calls that are safe to repeat. Creates get an Idempotency-Key
+so a retried POST never makes a second file.
+"""
+
+import asyncio
+import gzip
+import importlib.util
+import json
+import os
+import random
+import time
+import uuid
+
+import httpx
+
+BRIDGE_URL = os.environ.get("BRIDGE_URL", "https://my-google-bridge-1b5a7ab10d6b.herokuapp.com")
+# Sent as X-API-Key to pick the bridge tenant; unset uses the default tenant
+BRIDGE_API_KEY = os.environ.get("BRIDGE_API_KEY")
+BRIDGE_MAX_CONNECTIONS = int(os.environ.get("BRIDGE_MAX_CONNECTIONS", "20"))
+BRIDGE_MAX_KEEPALIVE = int(os.environ.get("BRIDGE_MAX_KEEPALIVE", "20"))
+BRIDGE_KEEPALIVE_EXPIRY = float(os.environ.get("BRIDGE_KEEPALIVE_EXPIRY", "60"))
+BRIDGE_CONNECT_TIMEOUT = float(os.environ.get("BRIDGE_CONNECT_TIMEOUT", "10"))
+BRIDGE_READ_TIMEOUT = float(os.environ.get("BRIDGE_READ_TIMEOUT", "60"))
+BRIDGE_RETRIES = int(os.environ.get("BRIDGE_RETRIES", "3"))
+# auto: HTTP/2 if h2 is installed; 1 / 0 force it on or off
+BRIDGE_HTTP2 = os.environ.get("BRIDGE_HTTP2", "auto").lower()
+# gzip | zstd (needs zstandard on both ends) | off, for JSON bodies of at least BRIDGE_COMPRESS_MIN_BYTES
+BRIDGE_COMPRESSION = os.environ.get("BRIDGE_COMPRESSION", "gzip").lower()
+BRIDGE_COMPRESS_MIN_BYTES = int(os.environ.get("BRIDGE_COMPRESS_MIN_BYTES", "16384"))
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRY_STATUSES = {429, 502, 503, 504}
+# Endpoints that honor Idempotency-Key
+CREATE_ENDPOINTS = {"create_doc_chat", "create_sheet_chat", "jobs"}
+MAX_RETRY_DELAY = 10.0
+
+
+def use_http2() -> bool:
+    if BRIDGE_HTTP2 == "auto":
+        return importlib.util.find_spec("h2") is not None
+    return BRIDGE_HTTP2 in ("1", "true", "yes")
+
+
+def client_options(transport_cls, base_url: str = BRIDGE_URL, api_key: str = BRIDGE_API_KEY) -> dict:
+    """Keyword arguments for httpx.Client / AsyncClient with the matching transport class"""
+    limits = httpx.Limits(max_connections=BRIDGE_MAX_CONNECTIONS, max_keepalive_connections=BRIDGE_MAX_KEEPALIVE,
+                          keepalive_expiry=BRIDGE_KEEPALIVE_EXPIRY)
+    return {
+        "base_url": base_url,
+        "headers": {"X-API-Key": api_key} if api_key else {},
+        "follow_redirects": True,
+        "timeout": httpx.Timeout(BRIDGE_READ_TIMEOUT, connect=BRIDGE_CONNECT_TIMEOUT),
+        # retries=1 reconnects once when a pooled connection turns out to be dead
+        "transport": transport_cls(http2=use_http2(), limits=limits, retries=1),
+    }
+
+
+def encode_body(kwargs: dict) -> dict:
+    """Serialize a json= body once, compressing it when it is large, so retries resend the same bytes"""
+    if "json" not in kwargs:
+        return kwargs
+    kwargs = dict(kwargs)
+    body = json.dumps(kwargs.pop("json"), separators=(",", ":")).encode("utf-8")
+    headers = {**(kwargs.get("headers") or {}), "Content-Type": "application/json"}
+    if BRIDGE_COMPRESSION != "off" and len(body) >= BRIDGE_COMPRESS_MIN_BYTES:
+        if BRIDGE_COMPRESSION == "zstd":
+            import zstandard
+            body = zstandard.ZstdCompressor(level=3).compress(body)
+        else:
+            body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = BRIDGE_COMPRESSION
+    kwargs["content"] = body
+    kwargs["headers"] = headers
+    return kwargs
+
+
+def call_kwargs(endpoint: str, payload: dict) -> dict:
+    kwargs = {"json": payload}
+    if endpoint.strip("/") in CREATE_ENDPOINTS:
+        kwargs["headers"] = {"Idempotency-Key": uuid.uuid4().hex}
+    return kwargs
+
+
+def retryable(method: str, headers: dict, error: Exception = None, response: httpx.Response = None) -> bool:
+    """Whether repeating the request cannot apply it twice"""
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return True  # never reached the bridge
+    safe = method in IDEMPOTENT_METHODS or "Idempotency-Key" in (headers or {})
+    if not safe:
+        return False
+    if error is not None:
+        return isinstance(error, httpx.TransportError)
+    return response.status_code in RETRY_STATUSES
+
+
+def retry_delay(attempt: int, response: httpx.Response = None) -> float:
+    if response is not None:
+        try:
+            return min(float(response.headers.get("retry-after", "")), MAX_RETRY_DELAY)
+        except ValueError:
+            pass
+    return random.uniform(0, min(MAX_RETRY_DELAY, 0.25 * 2 ** attempt))
+
+
+class BridgeClient:
+    """Blocking client; call(endpoint, payload) POSTs JSON and returns the decoded body"""
+
+    def __init__(self, base_url: str = BRIDGE_URL, api_key: str = BRIDGE_API_KEY, retries: int = BRIDGE_RETRIES):
+        self.http = httpx.Client(**client_options(httpx.HTTPTransport, base_url, api_key))
+        self.retries = retries
+
+    def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        method = method.upper()
+        kwargs = encode_body(kwargs)
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.http.request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                if attempt == self.retries or not retryable(method, kwargs.get("headers"), error=e):
+                    raise
+                time.sleep(retry_delay(attempt))
+                continue
+            if attempt == self.retries or not retryable(method, kwargs.get("headers"), response=response):
+                return response
+            response.close()
+            time.sleep(retry_delay(attempt, response))
+
+    def get(self, path: str, **kwargs) -> httpx.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> httpx.Response:
+        return self.request("POST", path, **kwargs)
+
+    def call(self, endpoint: str, payload: dict) -> dict:
+        return self.post(f"/{endpoint.lstrip('/')}", **call_kwargs(endpoint, payload)).json()
+
+    def close(self):
+        self.http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncBridgeClient:
+    """asyncio counterpart of BridgeClient; use it with `async with`"""
+
+    def __init__(self, base_url: str = BRIDGE_URL, api_key: str = BRIDGE_API_KEY, retries: int = BRIDGE_RETRIES):
+        self.http = httpx.AsyncClient(**client_options(httpx.AsyncHTTPTransport, base_url, api_key))
+        self.retries = retries
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        method = method.upper()
+        kwargs = encode_body(kwargs)
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self.http.request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                if attempt == self.retries or not retryable(method, kwargs.get("headers"), error=e):
+                    raise
+                await asyncio.sleep(retry_delay(attempt))
+                continue
+            if attempt == self.retries or not retryable(method, kwargs.get("headers"), response=response):
+                return response
+            await response.aclose()
+            await asyncio.sleep(retry_delay(attempt, response))
+
+    async def get(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, **kwargs)
+
+    async def call(self, endpoint: str, payload: dict) -> dict:
+        return (await self.post(f"/{endpoint.lstrip('/')}", **call_kwargs(endpoint, payload))).json()
+
+    async def aclose(self):
+        await self.http.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
@@ -0,0 +1,261 @@
+"""
+Streaming bulk loader for Google Sheets
+Parses NDJSON or CSV request bodies incrementally and writes size-bounded chunks
+to consecutive A1 ranges with a bounded number of writes in flight
+"""
+
+import asyncio
+import csv
+import json
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+
+from outbound import deadline_var, start_request_deadline
+
+MAX_CHUNK_ROWS = int(os.environ.get("SHEETS_CHUNK_ROWS", "1000"))
+# Rough cap on the JSON size of one values().update body
+MAX_CHUNK_BYTES = int(os.environ.get("SHEETS_CHUNK_BYTES", str(2 * 1024 * 1024)))
+MAX_IN_FLIGHT = int(os.environ.get("SHEETS_MAX_IN_FLIGHT", "4"))
+
+_A1_CELL = re.compile(r"^(?:(?P<sheet>.+)!)?(?P<col>[A-Za-z]+)(?P<row>[0-9]+)$")
+
+
+# ----------------------------
+# A1 helpers
+# ----------------------------
+def column_letter(index: int) -> str:
+    """0 → A, 25 → Z, 26 → AA"""
+    letters = ""
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def column_index(letters: str) -> int:
+    index = 0
+    for ch in letters.upper():
+        index = index * 26 + (ord(ch) - 64)
+    return index - 1
+
+
+def parse_a1(cell: str):
+    """'Sheet1!B5' → ('Sheet1', 4, 1); rows and columns are zero-based"""
+    match = _A1_CELL.match(cell.strip())
+    if not match:
+        raise ValueError(f"Expected a single A1 cell such as 'A1' or 'Sheet1!B5', got {cell!r}")
+    sheet = match.group("sheet")
+    if sheet and sheet.startswith("'") and sheet.endswith("'"):
+        sheet = sheet[1:-1].replace("''", "'")
+    return sheet, int(match.group("row")) - 1, column_index(match.group("col"))
+
+
+def a1_cell(row: int, col: int = 0, sheet: str = None) -> str:
+    """Zero-based row/col → 'B5' or \"'My Sheet'!B5\""""
+    cell = f"{column_letter(col)}{row + 1}"
+    if sheet:
+        return "'" + sheet.replace("'", "''") + "'!" + cell
+    return cell
+
+
+def a1_range(row: int, col: int, rows: int, cols: int, sheet: str = None) -> str:
+    """Zero-based top-left plus size → 'A1:C10'"""
+    end = f"{column_letter(col + max(cols, 1) - 1)}{row + max(rows, 1)}"
+    return f"{a1_cell(row, col, sheet)}:{end}"
+
+
+# ----------------------------
+# Incremental parsers
+# ----------------------------
+async def iter_lines(chunks):
+    """Split an async stream of bytes into decoded lines without buffering the whole body"""
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r").decode("utf-8")
+    if pending:
+        yield pending.rstrip(b"\r").decode("utf-8")
+
+
+async def iter_ndjson_rows(chunks):
+    """One JSON array per line"""
+    async for line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        if not isinstance(row, list):
+            raise ValueError("Each NDJSON line must be a JSON array of cell values")
+        yield row
+
+
+async def iter_csv_rows(chunks):
+    """RFC 4180 CSV; quoted fields may span lines"""
+    record = ""
+    async for line in iter_lines(chunks):
+        record = f"{record}\n{line}" if record else line
+        # An odd number of quotes means a quoted field continues on the next line
+        if record.count('"') % 2:
+            continue
+        yield next(csv.reader([record]))
+        record = ""
+    if record:
+        yield next(csv.reader([record]))
+
+
+# ----------------------------
+# Progress
+# ----------------------------
+class UploadProgress:
+    __slots__ = ("upload_id", "sheet_id", "state", "rows_received", "rows_written",
+                 "rows_committed", "chunks_written", "error", "started_at", "finished_at")
+
+    def __init__(self, upload_id: str, sheet_id: str):
+        self.upload_id = upload_id
+        self.sheet_id = sheet_id
+        self.state = "running"
+        self.rows_received = 0
+        self.rows_written = 0
+        # Rows from the start that are all written; a safe point to resume from
+        self.rows_committed = 0
+        self.chunks_written = 0
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class UploadRegistry:
+    """
+    Most recent uploads, so clients can poll progress of a long import. Kept
+    per tenant: upload ids may be chosen by the client.
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._uploads = OrderedDict()  # (tenant, upload_id) -> UploadProgress
+
+    def start(self, tenant: str, sheet_id: str, upload_id: str = None) -> UploadProgress:
+        progress = UploadProgress(upload_id or uuid.uuid4().hex, sheet_id)
+        self._uploads[(tenant, progress.upload_id)] = progress
+        self._uploads.move_to_end((tenant, progress.upload_id))
+        while len(self._uploads) > self.max_entries:
+            self._uploads.popitem(last=False)
+        return progress
+
+    def get(self, tenant: str, upload_id: str):
+        return self._uploads.get((tenant, upload_id))
+
+
+uploads = UploadRegistry()
+
+
+# ----------------------------
+# Loader
+# ----------------------------
+def _estimate_size(row) -> int:
+    return 2 + sum(len(str(cell)) + 3 for cell in row)
+
+
+async def iter_rows(rows):
+    """Adapt an in-memory list of rows to the async row stream the loader consumes"""
+    for row in rows:
+        yield row
+
+
+async def chunk_rows(rows, max_rows: int = MAX_CHUNK_ROWS, max_bytes: int = MAX_CHUNK_BYTES):
+    """Group an async stream of rows into lists bounded by row count and approximate JSON size"""
+    chunk, size = [], 0
+    async for row in rows:
+        row_size = _estimate_size(row)
+        if chunk and (len(chunk) >= max_rows or size + row_size > max_bytes):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(row)
+        size += row_size
+    if chunk:
+        yield chunk
+
+
+class SheetLoader:
+    """
+    Writes chunks to consecutive ranges starting at `start`.
+
+    At most max_in_flight writes run at once; while they are all busy the loader
+    stops pulling rows, which in turn stops reading the request body.
+    """
+
+    def __init__(self, client, sheet_id: str, start: str = "A1",
+                 max_in_flight: int = MAX_IN_FLIGHT, progress: UploadProgress = None,
+                 on_progress=None):
+        self.client = client
+        self.sheet_id = sheet_id
+        self.sheet, self.row, self.col = parse_a1(start)
+        self.max_in_flight = max(1, max_in_flight)
+        self.progress = progress or UploadProgress(uuid.uuid4().hex, sheet_id)
+        self.on_progress = on_progress
+
+    async def write_chunk(self, row: int, values):
+        await self.client.call(
+            "sheets", "spreadsheets.values.update",
+            spreadsheetId=self.sheet_id,
+            range=a1_cell(row, self.col, self.sheet),
+            valueInputOption="RAW",
+            body={"values": values},
+        )
+
+    async def load(self, chunks) -> UploadProgress:
+        """Consume an async iterator of row lists"""
+        progress = self.progress
+        slots = asyncio.Semaphore(self.max_in_flight)
+        pending = set()
+        next_row = self.row
+        finished = {}
+
+        async def write(row, values):
+            try:
+                # A bulk import outlasts one request's deadline; each chunk gets a
+                # fresh one instead (jobs run without a deadline and keep none)
+                if deadline_var.get() is not None:
+                    start_request_deadline()
+                await self.write_chunk(row, values)
+                progress.rows_written += len(values)
+                progress.chunks_written += 1
+                # Chunks finish out of order; only advance over a contiguous prefix
+                finished[row] = len(values)
+                while self.row + progress.rows_committed in finished:
+                    progress.rows_committed += finished.pop(self.row + progress.rows_committed)
+                if self.on_progress is not None:
+                    self.on_progress(progress)
+            finally:
+                slots.release()
+
+        try:
+            async for values in chunks:
+                progress.rows_received += len(values)
+                await slots.acquire()
+                # Surface a failed write before sending more
+                for task in [t for t in pending if t.done()]:
+                    pending.discard(task)
+                    task.result()
+                pending.add(asyncio.create_task(write(next_row, values)))
+                next_row += len(values)
+            if pending:
+                await asyncio.gather(*pending)
+            progress.state = "done"
+        except BaseException as e:
+            for task in pending:
+                task.cancel()
+            progress.state = "failed"
+            progress.error = str(e)
+            raise
+        finally:
+            progress.finished_at = time.time()
+        return progress
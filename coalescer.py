@@ -0,0 +1,159 @@
+"""
+Write coalescer
+Writes to the same document or spreadsheet that arrive within a short window
+are merged into one documents.batchUpdate / values.batchUpdate call
+"""
+
+import asyncio
+import os
+
+from doc_index import doc_index_cache, is_revision_mismatch
+from google_client import GoogleAPIError
+
+COALESCE_WINDOW = float(os.environ.get("COALESCE_WINDOW_MS", "20")) / 1000
+MAX_BATCH_OPS = int(os.environ.get("COALESCE_MAX_OPS", "100"))
+
+
+class _Batch:
+    __slots__ = ("client", "ops", "timer")
+
+    def __init__(self, client):
+        self.client = client
+        self.ops = []
+        self.timer = None
+
+
+class WriteCoalescer:
+    """
+    Ops are grouped by key: ("docs", tenant, doc_id) ops carry {"requests": [...], "delta": n}
+    where delta is the change in body length (None if unknown),
+    ("sheets", tenant, sheet_id, value_input_option) ops carry {"range": ..., "values": ...}.
+    Every submitter gets back its own slice of the combined response.
+    """
+
+    def __init__(self, window: float = COALESCE_WINDOW, max_ops: int = MAX_BATCH_OPS):
+        self.window = window
+        self.max_ops = max_ops
+        self._pending = {}
+        self._flushing = set()
+        self.calls = 0
+        self.ops = 0
+
+    async def submit(self, key: tuple, client, op: dict):
+        loop = asyncio.get_running_loop()
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = _Batch(client)
+            batch.timer = loop.call_later(self.window, self._flush_soon, key, batch)
+        future = loop.create_future()
+        batch.ops.append((op, future))
+        if len(batch.ops) >= self.max_ops:
+            batch.timer.cancel()
+            self._flush_soon(key, batch)
+        return await future
+
+    def _flush_soon(self, key, batch):
+        if self._pending.get(key) is batch:
+            del self._pending[key]
+            task = asyncio.ensure_future(self._flush(key, batch))
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+
+    async def _flush(self, key, batch):
+        ops = [op for op, _ in batch.ops]
+        futures = [future for _, future in batch.ops]
+        try:
+            results = await self._execute(key, batch.client, ops)
+        except GoogleAPIError as e:
+            if len(ops) > 1 and e.status == 400:
+                # One bad op rejects the whole batch; retry singly, in order, so only it fails
+                results = []
+                for op in ops:
+                    try:
+                        results.append((await self._execute(key, batch.client, [op]))[0])
+                    except Exception as single_error:
+                        results.append(single_error)
+            else:
+                results = [e] * len(ops)
+        except BaseException as e:
+            results = [e] * len(ops)
+
+        for future, result in zip(futures, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _execute(self, key, client, ops) -> list:
+        self.calls += 1
+        self.ops += len(ops)
+        if key[0] == "docs":
+            response = await self._execute_docs(key, client, ops)
+            replies = response.get("replies", [])
+            results, offset = [], 0
+            for op in ops:
+                count = len(op["requests"])
+                results.append({
+                    "replies": replies[offset:offset + count],
+                    "writeControl": response.get("writeControl", {}),
+                })
+                offset += count
+            return results
+
+        response = await client.call(
+            "sheets", "spreadsheets.values.batchUpdate",
+            spreadsheetId=key[2],
+            body={
+                "valueInputOption": key[3],
+                "data": [{"range": op["range"], "values": op["values"]} for op in ops],
+            },
+        )
+        responses = response.get("responses", [])
+        return [responses[i] if i < len(responses) else {} for i in range(len(ops))]
+
+    async def _execute_docs(self, key, client, ops) -> dict:
+        cache_key = key[1:]
+        body = {"requests": [r for op in ops for r in op["requests"]]}
+        cached = doc_index_cache.get(cache_key)
+        if cached is not None:
+            # Only apply on top of the revision the cached end index belongs to
+            body["writeControl"] = {"requiredRevisionId": cached.revision_id}
+        try:
+            response = await client.call("docs", "documents.batchUpdate", documentId=key[2], body=body)
+        except GoogleAPIError as e:
+            if cached is None or not is_revision_mismatch(e):
+                raise
+            # Edited elsewhere since we cached it
+            doc_index_cache.invalidate(cache_key)
+            cached = None
+            del body["writeControl"]
+            response = await client.call("docs", "documents.batchUpdate", documentId=key[2], body=body)
+
+        revision_id = response.get("writeControl", {}).get("requiredRevisionId")
+        deltas = [op.get("delta") for op in ops]
+        if cached is not None and revision_id and None not in deltas:
+            doc_index_cache.set(cache_key, cached.end_index + sum(deltas), revision_id)
+        else:
+            doc_index_cache.invalidate(cache_key)
+        return response
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "ops": self.ops, "pending_keys": len(self._pending)}
+
+
+coalescer = WriteCoalescer()
+
+
+async def submit_doc_requests(client, tenant: str, doc_id: str, requests: list, delta: int = None):
+    return await coalescer.submit(
+        ("docs", tenant, doc_id), client, {"requests": requests, "delta": delta}
+    )
+
+
+async def submit_values(client, tenant: str, sheet_id: str, range_: str, values: list,
+                        value_input_option: str = "RAW"):
+    return await coalescer.submit(
+        ("sheets", tenant, sheet_id, value_input_option), client, {"range": range_, "values": values}
+    )
@@ -0,0 +1,201 @@
+"""
+Columnar ingestion for large numeric tables
+Typed column JSON (value lists or base64 little-endian buffers) or Arrow IPC is
+decoded into NumPy columns and written column-major chunk by chunk; orjson
+serializes the array slices directly, so no Python object is built per cell.
+orjson and pyarrow are optional: without orjson the standard json module
+encodes per-cell lists instead (slower, same bodies), and Arrow uploads need
+pyarrow.
+"""
+
+import base64
+import json
+import math
+
+import numpy as np
+
+from bulk_loader import MAX_CHUNK_BYTES, MAX_CHUNK_ROWS, SheetLoader, a1_cell
+
+try:
+    import orjson
+except ImportError:  # stdlib json, cell by cell
+    orjson = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:  # Arrow uploads are rejected with a 400
+    pyarrow = None
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+ARROW_FILE = "application/vnd.apache.arrow.file"
+NUMERIC_DTYPES = {
+    "float64", "float32", "int64", "int32", "int16", "int8",
+    "uint64", "uint32", "uint16", "uint8", "bool",
+}
+# Rough JSON size of one non-string cell, for sizing chunks
+NUMERIC_CELL_BYTES = 24
+
+
+class ColumnTable:
+    """Equal-length columns: NumPy arrays for numbers, lists or Arrow arrays for text"""
+
+    def __init__(self, names: list, columns: list):
+        lengths = {len(column) for column in columns}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns must all have the same length, got {sorted(lengths)}")
+        self.names = names
+        self.columns = columns
+        self.rows = lengths.pop() if lengths else 0
+
+    def row_bytes(self) -> int:
+        size = 2
+        for column in self.columns:
+            if isinstance(column, np.ndarray):
+                size += NUMERIC_CELL_BYTES
+            else:
+                sample = column[:100] if isinstance(column, list) else column.slice(0, 100).to_pylist()
+                size += 3 + (sum(len(str(v)) for v in sample) // len(sample) if sample else 0)
+        return size
+
+
+# ----------------------------
+# Decoding
+# ----------------------------
+def decode_column(spec: dict):
+    if not isinstance(spec, dict):
+        raise ValueError(f"Each column must be an object, got {type(spec).__name__}")
+    dtype = spec.get("dtype", "string")
+    if dtype == "string":
+        values = spec.get("values")
+        if not isinstance(values, list):
+            raise ValueError("string columns need a 'values' list")
+        return values
+    if dtype not in NUMERIC_DTYPES:
+        raise ValueError(f"Unsupported dtype {dtype!r}; use string or one of {sorted(NUMERIC_DTYPES)}")
+    if "data" in spec:
+        if not isinstance(spec["data"], str):
+            raise ValueError(f"{dtype} column 'data' must be a base64 string")
+        buffer = base64.b64decode(spec["data"], validate=True)
+        np_dtype = np.dtype(dtype).newbyteorder("<")
+        if len(buffer) % np_dtype.itemsize:
+            raise ValueError(f"{dtype} buffer length {len(buffer)} is not a multiple of {np_dtype.itemsize}")
+        # A view over the decoded bytes, not a copy
+        return np.frombuffer(buffer, dtype=np_dtype)
+    values = spec.get("values")
+    if not isinstance(values, list):
+        raise ValueError(f"{dtype} column needs a 'values' list or base64 'data'")
+    try:
+        column = np.asarray(values, dtype=dtype)
+    except TypeError as e:
+        raise ValueError(f"{dtype} column values must be numbers: {e}")
+    if column.ndim != 1:
+        raise ValueError(f"{dtype} column values must be a flat list of numbers")
+    return column
+
+
+def decode_column_json(body: bytes) -> ColumnTable:
+    """{"columns": [{"name": "price", "dtype": "float64", "values": [...] | "data": "<base64>"}, ...]}"""
+    doc = orjson.loads(body) if orjson is not None else json.loads(body)
+    specs = doc.get("columns") if isinstance(doc, dict) else None
+    if not specs or not isinstance(specs, list):
+        raise ValueError("Body must be an object with a non-empty 'columns' list")
+    columns = [decode_column(spec) for spec in specs]
+    names = [str(spec.get("name", f"column_{i + 1}")) for i, spec in enumerate(specs)]
+    return ColumnTable(names, columns)
+
+
+def decode_arrow(body: bytes, file_format: bool = False) -> ColumnTable:
+    if pyarrow is None:
+        raise ValueError("Arrow uploads need pyarrow installed on the bridge")
+    try:
+        if file_format:
+            table = pyarrow.ipc.open_file(pyarrow.BufferReader(body)).read_all()
+        else:
+            table = pyarrow.ipc.open_stream(body).read_all()
+    except pyarrow.ArrowInvalid as e:
+        raise ValueError(f"Invalid Arrow IPC body: {e}")
+
+    columns = []
+    for column in table.columns:
+        kind = column.type
+        if pyarrow.types.is_integer(kind) or pyarrow.types.is_floating(kind):
+            # Nulls come back as NaN, which is written as a blank cell
+            columns.append(column.to_numpy())
+        elif pyarrow.types.is_boolean(kind) and column.null_count == 0:
+            columns.append(column.to_numpy())
+        else:
+            # Text, dates and nullable booleans stay in Arrow until their chunk is written
+            columns.append(column.combine_chunks().cast(pyarrow.string()))
+    return ColumnTable(table.column_names, columns)
+
+
+def decode_columns(body: bytes, content_type: str) -> ColumnTable:
+    if ARROW_STREAM in content_type:
+        return decode_arrow(body)
+    if ARROW_FILE in content_type:
+        return decode_arrow(body, file_format=True)
+    return decode_column_json(body)
+
+
+# ----------------------------
+# Chunked writes
+# ----------------------------
+class ColumnChunk:
+    __slots__ = ("columns", "rows")
+
+    def __init__(self, columns: list, rows: int):
+        self.columns = columns
+        self.rows = rows
+
+    def __len__(self):
+        return self.rows
+
+
+def _slice(column, start: int, stop: int):
+    if isinstance(column, (np.ndarray, list)):
+        return column[start:stop]
+    return column.slice(start, stop - start).to_pylist()
+
+
+async def iter_column_chunks(table: ColumnTable, max_rows: int = MAX_CHUNK_ROWS,
+                             max_bytes: int = MAX_CHUNK_BYTES):
+    rows_per_chunk = max(1, min(max_rows, max_bytes // table.row_bytes()))
+    for start in range(0, table.rows, rows_per_chunk):
+        stop = min(start + rows_per_chunk, table.rows)
+        yield ColumnChunk([_slice(column, start, stop) for column in table.columns], stop - start)
+
+
+def _json_column(column):
+    if not isinstance(column, np.ndarray):
+        return column
+    if column.dtype.kind == "f":
+        # As orjson does: NaN and infinities become null
+        return [value if math.isfinite(value) else None for value in column.tolist()]
+    return column.tolist()
+
+
+def encode_chunk(chunk: ColumnChunk) -> bytes:
+    """values.update body with one list per column; NaN becomes null, which Sheets leaves blank"""
+    if orjson is None:
+        body = {"majorDimension": "COLUMNS", "values": [_json_column(column) for column in chunk.columns]}
+        return json.dumps(body, separators=(",", ":")).encode("utf-8")
+    return orjson.dumps({"majorDimension": "COLUMNS", "values": chunk.columns},
+                        option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+class ColumnLoader(SheetLoader):
+    async def write_chunk(self, row: int, chunk: ColumnChunk):
+        await self.client.call(
+            "sheets", "spreadsheets.values.update",
+            spreadsheetId=self.sheet_id,
+            range=a1_cell(row, self.col, self.sheet),
+            valueInputOption="RAW",
+            body=encode_chunk(chunk),
+        )
+
+    async def load_table(self, table: ColumnTable, header: bool = True):
+        if header:
+            await super().write_chunk(self.row, [table.names])
+            self.row += 1
+        return await self.load(iter_column_chunks(table))
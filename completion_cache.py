@@ -0,0 +1,176 @@
+"""
+Cache for OpenAI chat completions used by the middleware scripts
+An in-memory LRU sits in front of a SQLite store, keyed on a hash of the model,
+messages, function/tool schemas and sampling parameters, so a repeated prompt
+is answered without calling OpenAI
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+COMPLETION_CACHE_DB = os.environ.get("COMPLETION_CACHE_DB", "completions.db")
+COMPLETION_CACHE_TTL = float(os.environ.get("COMPLETION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+COMPLETION_CACHE_MAX_ENTRIES = int(os.environ.get("COMPLETION_CACHE_MAX_ENTRIES", "1000"))
+# deterministic: only temperature=0 requests; all: every completion, replaying sampled answers; off: never
+COMPLETION_CACHE_MODE = os.environ.get("COMPLETION_CACHE_MODE", "deterministic")
+
+
+def completion_key(kind: str, params: dict) -> str:
+    payload = json.dumps({"kind": kind, **params}, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SQLiteCompletionStore:
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, expires_at REAL NOT NULL, body TEXT NOT NULL)"
+        )
+        self.conn.execute("DELETE FROM completions WHERE expires_at <= ?", (time.time(),))
+        self.conn.commit()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT expires_at, body FROM completions WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def put(self, key: str, expires_at: float, body):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO completions (key, expires_at, body) VALUES (?, ?, ?)",
+                (key, expires_at, json.dumps(body)),
+            )
+
+
+class CompletionCache:
+    def __init__(self, store: SQLiteCompletionStore = None, ttl: float = COMPLETION_CACHE_TTL,
+                 max_entries: int = COMPLETION_CACHE_MAX_ENTRIES, mode: str = COMPLETION_CACHE_MODE):
+        self.store = store
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.mode = mode
+        self._entries = OrderedDict()  # key -> (expires_at, body)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def key_for(self, kind: str, params: dict):
+        """None when this request must not be served from the cache"""
+        if self.mode == "off" or (self.mode == "deterministic" and params.get("temperature") != 0):
+            self.bypassed += 1
+            return None
+        return completion_key(kind, params)
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.time():
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[1]
+                del self._entries[key]
+        entry = self.store.get(key) if self.store is not None else None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        self._remember(key, *entry)
+        return entry[1]
+
+    def put(self, key: str, body):
+        expires_at = time.time() + self.ttl
+        self._remember(key, expires_at, body)
+        if self.store is not None:
+            self.store.put(key, expires_at, body)
+
+    def _remember(self, key: str, expires_at: float, body):
+        with self._lock:
+            self._entries[key] = (expires_at, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "mode": self.mode,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "size": len(self._entries),
+        }
+
+
+completion_cache = CompletionCache(
+    store=SQLiteCompletionStore(COMPLETION_CACHE_DB) if COMPLETION_CACHE_DB else None
+)
+
+
+# ----------------------------
+# OpenAI client wrappers
+# ----------------------------
+def _to_completion(body: dict):
+    from openai.types.chat import ChatCompletion
+    return ChatCompletion.model_validate(body)
+
+
+async def cached_create(client, cache: CompletionCache = completion_cache, **params):
+    """client.chat.completions.create for AsyncOpenAI, served from the cache when possible"""
+    key = cache.key_for("completion", params)
+    body = cache.get(key) if key else None
+    if body is not None:
+        return _to_completion(body)
+    completion = await client.chat.completions.create(**params)
+    if key:
+        cache.put(key, completion.model_dump(mode="json"))
+    return completion
+
+
+def cached_create_sync(client, cache: CompletionCache = completion_cache, **params):
+    """Same as cached_create for the blocking OpenAI client"""
+    key = cache.key_for("completion", params)
+    body = cache.get(key) if key else None
+    if body is not None:
+        return _to_completion(body)
+    completion = client.chat.completions.create(**params)
+    if key:
+        cache.put(key, completion.model_dump(mode="json"))
+    return completion
+
+
+async def cached_stream_text(client, cache: CompletionCache = completion_cache, **params):
+    """
+    Yield the text deltas of a streamed completion. A cached answer is yielded
+    as one piece; a fresh one is stored only once the stream finished normally.
+    """
+    key = cache.key_for("stream_text", params)
+    text = cache.get(key) if key else None
+    if text is not None:
+        yield text
+        return
+    parts = []
+    stream = await client.chat.completions.create(stream=True, **params)
+    async for chunk in stream:
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            continue
+        parts.append(chunk.choices[0].delta.content)
+        yield parts[-1]
+    if key:
+        cache.put(key, "".join(parts))
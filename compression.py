@@ -0,0 +1,215 @@
+"""
+HTTP compression in both directions
+Request bodies sent with Content-Encoding gzip, deflate or zstd are decompressed
+chunk by chunk as the handler reads them, so streaming uploads stay streaming.
+Responses of at least COMPRESS_MIN_BYTES are compressed with zstd or gzip,
+whichever the client accepts. zstd needs the optional zstandard package.
+"""
+
+import json
+import os
+import time
+import zlib
+
+# FastAPI passes its own HTTPException through body parsing; others become a bare 400
+from fastapi import HTTPException
+
+from metrics import record_phase
+
+try:
+    import zstandard
+except ImportError:  # gzip and deflate only
+    zstandard = None
+
+DECOMPRESS_ERRORS = (zlib.error,) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+# Largest decompressed request body; protects against compression bombs
+MAX_DECOMPRESSED_BYTES = int(os.environ.get("MAX_DECOMPRESSED_BYTES", str(256 * 1024 * 1024)))
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
+ZSTD_LEVEL = int(os.environ.get("ZSTD_LEVEL", "3"))
+# Already compressed or streamed to the client as produced
+SKIP_CONTENT_TYPES = ("image/", "video/", "audio/", "application/zip", "application/gzip",
+                      "text/event-stream", "application/x-ndjson")
+
+
+def request_encodings() -> list:
+    return ["gzip", "deflate"] + (["zstd"] if zstandard is not None else [])
+
+
+def decompressor(encoding: str):
+    """Object with decompress(chunk) for one Content-Encoding, or None if unsupported"""
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return zlib.decompressobj()
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj()
+    return None
+
+
+class StreamCompressor:
+    """Compresses a body message by message; every chunk is flushed so the client can decode it at once"""
+
+    def __init__(self, encoding: str):
+        if encoding == "zstd":
+            self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+            self._sync = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._sync = zlib.Z_SYNC_FLUSH
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        out = self._compressor.compress(data)
+        return out + (self._compressor.flush() if final else self._compressor.flush(self._sync))
+
+
+def accepted_encoding(accept_encoding: str):
+    """zstd if the client takes it and we can produce it, else gzip, else None"""
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip())
+    if "zstd" in accepted and zstandard is not None:
+        return "zstd"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def _header(headers: list, name: bytes):
+    for key, value in headers:
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return None
+
+
+class CompressionMiddleware:
+    """Pure ASGI, like MetricsMiddleware; neither direction buffers a streaming body"""
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES, max_body: int = MAX_DECOMPRESSED_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.max_body = max_body
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = scope["headers"]
+        content_encoding = (_header(headers, b"content-encoding") or "identity").strip().lower()
+        if content_encoding != "identity":
+            decoder = decompressor(content_encoding)
+            if decoder is None:
+                await self._reject(send, 415, f"Unsupported Content-Encoding {content_encoding!r}; "
+                                              f"use one of {', '.join(request_encodings())}")
+                return
+            # The handler sees a plain body of unknown length
+            scope = dict(scope, headers=[(k, v) for k, v in headers
+                                         if k.lower() not in (b"content-encoding", b"content-length")])
+            receive = self._decompressing(receive, decoder)
+
+        encoding = accepted_encoding(_header(headers, b"accept-encoding") or "")
+        if encoding is not None:
+            send = self._compressing(send, encoding)
+        await self.app(scope, receive, send)
+
+    def _decompressing(self, receive, decoder):
+        total = [0]
+
+        async def receive_plain():
+            message = await receive()
+            if message["type"] != "http.request":
+                return message
+            try:
+                body = decoder.decompress(message.get("body", b""))
+                if not message.get("more_body", False) and hasattr(decoder, "flush"):
+                    body += decoder.flush()
+            except DECOMPRESS_ERRORS as e:
+                raise HTTPException(400, f"Could not decompress request body: {e}")
+            if not message.get("more_body", False) and getattr(decoder, "eof", True) is False:
+                raise HTTPException(400, "Compressed request body is truncated")
+            total[0] += len(body)
+            if total[0] > self.max_body:
+                raise HTTPException(413, f"Decompressed request body exceeds {self.max_body} bytes")
+            return dict(message, body=body)
+
+        return receive_plain
+
+    def _compressing(self, send, encoding: str):
+        state = {"start": None, "buffer": [], "size": 0, "compressor": None, "passthrough": False}
+
+        async def begin(compress: bool, length: int = None):
+            """Send the held-back response start, with compression headers if compressing"""
+            response_start = state["start"]
+            if not compress:
+                state["passthrough"] = True
+                await send(response_start)
+                return
+            headers = [(k, v) for k, v in response_start.get("headers", [])
+                       if k.lower() not in (b"content-length", b"vary")]
+            vary = _header(response_start.get("headers", []), b"vary")
+            headers += [(b"content-encoding", encoding.encode("latin-1")),
+                        (b"vary", (f"{vary}, Accept-Encoding" if vary else "Accept-Encoding").encode("latin-1"))]
+            if length is not None:
+                headers.append((b"content-length", str(length).encode("latin-1")))
+            await send(dict(response_start, headers=headers))
+
+        def squeeze(body: bytes, final: bool) -> bytes:
+            started = time.perf_counter()
+            out = state["compressor"].compress(body, final)
+            record_phase("compress", time.perf_counter() - started)
+            return out
+
+        async def send_compressed(message):
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", [])
+                content_type = _header(headers, b"content-type") or ""
+                state["start"] = message
+                if _header(headers, b"content-encoding") is not None or content_type.startswith(SKIP_CONTENT_TYPES):
+                    await begin(False)
+                # Otherwise held back until enough of the body shows whether compressing pays
+                return
+            if message["type"] != "http.response.body" or state["passthrough"]:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if state["compressor"] is not None:
+                await send(dict(message, body=squeeze(body, not more_body)))
+                return
+
+            state["buffer"].append(body)
+            state["size"] += len(body)
+            if more_body and state["size"] < self.minimum_size:
+                return
+            body = b"".join(state["buffer"])
+            state["buffer"] = []
+            if state["size"] < self.minimum_size:
+                await begin(False)
+                await send(dict(message, body=body))
+                return
+            state["compressor"] = StreamCompressor(encoding)
+            if more_body:
+                # A streamed body: compress as it goes, length unknown
+                body = squeeze(body, False)
+                await begin(True)
+                await send(dict(message, body=body))
+            else:
+                compressed = squeeze(body, True)
+                await begin(True, len(compressed))
+                await send(dict(message, body=compressed))
+
+        return send_compressed
+
+    @staticmethod
+    async def _reject(send, status: int, message: str):
+        body = json.dumps({"status": "error", "message": message}).encode("utf-8")
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode("latin-1"))]})
+        await send({"type": "http.response.body", "body": body})
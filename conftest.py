@@ -0,0 +1,86 @@
+"""
+pytest setup for the tests that run against the in-process fake Google server
+The bridge modules read their configuration at import time, so the environment
+is pointed at the fake before any test module imports them.
+"""
+
+import contextlib
+import os
+import tempfile
+
+import pytest
+
+import benchmark
+
+# Scripts that exercise a live deployment; run them directly
+collect_ignore = [
+    "test_authenticated.py",
+    "test_chatgpt_endpoints.py",
+    "test_chatgpt_function.py",
+    "test_heroku_endpoints.py",
+    "test_middleware.py",
+]
+
+workdir = tempfile.mkdtemp(prefix="bridge-tests-")
+benchmark.configure_environment(workdir, respect_quotas=False)
+os.environ["COMPLETION_CACHE_DB"] = os.path.join(workdir, "completions.db")
+os.environ["FAKE_GOOGLE_LATENCY_MS"] = "0"
+os.environ["FAKE_GOOGLE_JITTER_MS"] = "0"
+os.environ["GOOGLE_BACKOFF_BASE"] = "0.01"
+os.environ["GOOGLE_BACKOFF_CAP"] = "0.05"
+
+import httpx  # noqa: E402
+from google.oauth2.credentials import Credentials  # noqa: E402
+
+import fake_google  # noqa: E402
+import google_client  # noqa: E402
+from outbound import OutboundScheduler  # noqa: E402
+from shared_state import MemoryState  # noqa: E402
+
+
+@pytest.fixture
+def fake():
+    """The fake Google server, emptied and answering without latency"""
+    fake_google.fake.reset()
+    return fake_google.fake
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    """A fresh outbound scheduler, so quota buckets and counters start at zero"""
+    fresh = OutboundScheduler(MemoryState())
+    monkeypatch.setattr(google_client, "scheduler", fresh)
+    return fresh
+
+
+@pytest.fixture
+def google(fake, scheduler, request):
+    """
+    open_client() is an async context manager yielding a GoogleClient that talks
+    to the fake; the tenant is the test's name, so cache keys never collide
+    """
+    tenant = request.node.name
+
+    @contextlib.asynccontextmanager
+    async def open_client():
+        http = google_client.open_http_client(transport=httpx.ASGITransport(app=fake_google.app))
+        try:
+            yield google_client.AsyncGoogleClient(Credentials(token="test-token"), http, user=tenant)
+        finally:
+            await http.aclose()
+
+    return open_client
+
+
+@pytest.fixture
+def bridge(fake, scheduler):
+    """
+    open_bridge() is an async context manager yielding the started app module
+    and an httpx client for it, with the default tenant signed in to the fake
+    """
+    @contextlib.asynccontextmanager
+    async def open_bridge():
+        async with contextlib.AsyncExitStack() as stack:
+            yield await benchmark.start_bridge(fake_google.app, stack)
+
+    return open_bridge
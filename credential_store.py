@@ -0,0 +1,455 @@
+"""
+Per-tenant OAuth credential store
+Decoded credentials live in a bounded LRU in front of a pluggable token backend;
+refreshes are single-flight per tenant, across worker processes too, and writes
+are atomic
+"""
+
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows: file tokens are only locked within one process
+    fcntl = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import Request as GoogleRequest
+from google.oauth2.credentials import Credentials
+
+from shared_state import SHARED_STATE
+
+DEFAULT_TENANT = "default"
+
+# Refresh this many seconds before the access token actually expires
+REFRESH_MARGIN = int(os.environ.get("TOKEN_REFRESH_MARGIN", "300"))
+# How often a cached entry is checked against the backend for out-of-band changes
+RECHECK_INTERVAL = float(os.environ.get("TOKEN_RECHECK_SECONDS", "5"))
+# Longest one worker holds a tenant's refresh lock before others stop waiting for it
+REFRESH_LOCK_SECONDS = 30
+
+
+def seconds_until_expiry(creds: Credentials) -> float:
+    if not creds.expiry:
+        return float("inf")
+    return (creds.expiry - datetime.datetime.utcnow()).total_seconds()
+
+
+def atomic_write(path: str, data: str):
+    """Write to a temp file in the same directory and rename it over the target"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".token-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# ----------------------------
+# Token backends
+# ----------------------------
+class TokenStore(ABC):
+    """
+    Persistence for serialized tokens, keyed by tenant.
+
+    version() must be cheap: the credential cache calls it to detect changes
+    made by other processes without re-reading the token itself.
+    """
+
+    @abstractmethod
+    def load(self, tenant: str):
+        """Return (token_json, version) or (None, None)"""
+
+    @abstractmethod
+    def version(self, tenant: str):
+        """A value that changes whenever the tenant's token does, or None if there is none"""
+
+    @abstractmethod
+    def save(self, tenant: str, token_json: str):
+        """Persist the token and return its new version"""
+
+    @abstractmethod
+    def delete(self, tenant: str):
+        """Forget the tenant's token"""
+
+    def _try_lock(self, tenant: str, owner: str) -> bool:
+        return True
+
+    def _unlock(self, tenant: str, owner: str):
+        pass
+
+    @contextlib.contextmanager
+    def refresh_lock(self, tenant: str):
+        """
+        Held around a token refresh so only one worker process refreshes a tenant
+        at a time; the rest then load the token it saved. Gives up waiting after
+        REFRESH_LOCK_SECONDS in case the holder died.
+        """
+        owner = uuid.uuid4().hex
+        give_up = time.monotonic() + REFRESH_LOCK_SECONDS
+        locked = self._try_lock(tenant, owner)
+        while not locked and time.monotonic() < give_up:
+            time.sleep(0.05)
+            locked = self._try_lock(tenant, owner)
+        try:
+            yield
+        finally:
+            if locked:
+                self._unlock(tenant, owner)
+
+
+class FileTokenStore(TokenStore):
+    """token.json for the default tenant, token-<tenant>.json for the rest"""
+
+    def __init__(self, path: str = "token.json"):
+        self.path = path
+
+    def _path(self, tenant: str) -> str:
+        if tenant == DEFAULT_TENANT:
+            return self.path
+        root, ext = os.path.splitext(self.path)
+        return f"{root}-{tenant}{ext}"
+
+    def version(self, tenant: str):
+        try:
+            return os.stat(self._path(tenant)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def load(self, tenant: str):
+        path = self._path(tenant)
+        try:
+            version = os.stat(path).st_mtime_ns
+            with open(path) as f:
+                return f.read(), version
+        except FileNotFoundError:
+            return None, None
+
+    def save(self, tenant: str, token_json: str):
+        path = self._path(tenant)
+        atomic_write(path, token_json)
+        return os.stat(path).st_mtime_ns
+
+    def delete(self, tenant: str):
+        try:
+            os.remove(self._path(tenant))
+        except FileNotFoundError:
+            pass
+
+    @contextlib.contextmanager
+    def refresh_lock(self, tenant: str):
+        if fcntl is None:
+            yield
+            return
+        with open(self._path(tenant) + ".lock", "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class SQLiteTokenStore(TokenStore):
+    """Tokens for many tenants in one SQLite database in WAL mode"""
+
+    _LOAD = "SELECT token_json, version FROM tokens WHERE tenant = ?"
+    _VERSION = "SELECT version FROM tokens WHERE tenant = ?"
+    _SAVE = (
+        "INSERT INTO tokens (tenant, token_json, version) VALUES (?, ?, 1) "
+        "ON CONFLICT(tenant) DO UPDATE SET token_json = excluded.token_json, version = tokens.version + 1 "
+        "RETURNING version"
+    )
+    _DELETE = "DELETE FROM tokens WHERE tenant = ?"
+    _LOCK = (
+        "INSERT INTO token_locks (tenant, owner, expires_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(tenant) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+        "WHERE token_locks.expires_at <= ?"
+    )
+    _UNLOCK = "DELETE FROM token_locks WHERE tenant = ? AND owner = ?"
+
+    def __init__(self, path: str = "tokens.db"):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS tokens ("
+            "tenant TEXT PRIMARY KEY, token_json TEXT NOT NULL, version INTEGER NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS token_locks ("
+            "tenant TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread; sqlite3 keeps the prepared statements for
+        # the constant queries above in each connection's statement cache
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, cached_statements=32)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, tenant: str):
+        row = self._conn().execute(self._LOAD, (tenant,)).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    def version(self, tenant: str):
+        row = self._conn().execute(self._VERSION, (tenant,)).fetchone()
+        return row[0] if row else None
+
+    def save(self, tenant: str, token_json: str):
+        conn = self._conn()
+        with conn:
+            return conn.execute(self._SAVE, (tenant, token_json)).fetchone()[0]
+
+    def delete(self, tenant: str):
+        conn = self._conn()
+        with conn:
+            conn.execute(self._DELETE, (tenant,))
+
+    def _try_lock(self, tenant: str, owner: str) -> bool:
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            return conn.execute(self._LOCK, (tenant, owner, now + REFRESH_LOCK_SECONDS, now)).rowcount == 1
+
+    def _unlock(self, tenant: str, owner: str):
+        conn = self._conn()
+        with conn:
+            conn.execute(self._UNLOCK, (tenant, owner))
+
+
+class RedisTokenStore(TokenStore):
+    """Tokens in a Redis-compatible server, for workers spread over several hosts"""
+
+    _UNLOCK = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+      return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, url: str, prefix: str = "bridge:token:"):
+        if redis is None:
+            raise RuntimeError("A redis:// token store needs the redis package: pip install redis")
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self._unlock_script = self.client.register_script(self._UNLOCK)
+
+    def load(self, tenant: str):
+        token_json, version = self.client.hmget(self.prefix + tenant, "token_json", "version")
+        return (token_json, int(version)) if token_json is not None else (None, None)
+
+    def version(self, tenant: str):
+        version = self.client.hget(self.prefix + tenant, "version")
+        return int(version) if version is not None else None
+
+    def save(self, tenant: str, token_json: str):
+        pipe = self.client.pipeline()
+        pipe.hset(self.prefix + tenant, "token_json", token_json)
+        pipe.hincrby(self.prefix + tenant, "version", 1)
+        return pipe.execute()[1]
+
+    def delete(self, tenant: str):
+        self.client.delete(self.prefix + tenant)
+
+    def _try_lock(self, tenant: str, owner: str) -> bool:
+        return bool(self.client.set(f"{self.prefix}{tenant}:lock", owner, nx=True,
+                                    px=int(REFRESH_LOCK_SECONDS * 1000)))
+
+    def _unlock(self, tenant: str, owner: str):
+        self._unlock_script(keys=[f"{self.prefix}{tenant}:lock"], args=[owner])
+
+
+def token_store_from_env(default_path: str = "token.json") -> TokenStore:
+    """
+    TOKEN_STORE=file, sqlite:<path> or redis://...; unset follows SHARED_STATE
+    (as resolved for WEB_CONCURRENCY) when that is sqlite or redis, so every
+    worker sees the same tokens
+    """
+    spec = os.environ.get("TOKEN_STORE") or SHARED_STATE
+    if spec.startswith("sqlite:"):
+        return SQLiteTokenStore(spec[len("sqlite:"):] or "tokens.db")
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisTokenStore(spec)
+    return FileTokenStore(default_path)
+
+
+# ----------------------------
+# Credential cache
+# ----------------------------
+class _Entry:
+    __slots__ = ("creds", "version", "checked_at")
+
+    def __init__(self, creds, version):
+        self.creds = creds
+        self.version = version
+        self.checked_at = time.monotonic()
+
+
+class CredentialStore:
+    """Bounded LRU of decoded Credentials per tenant in front of a TokenStore"""
+
+    def __init__(self, backend: TokenStore, scopes: list, max_cached: int = 1024):
+        self.backend = backend
+        self.scopes = scopes
+        self.max_cached = max_cached
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._refresh_locks = {}
+        self.refreshes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, tenant: str = DEFAULT_TENANT):
+        """Current credentials, refreshed if already expired; None if not authorized"""
+        creds = self._load(tenant)
+        if creds and creds.expired and creds.refresh_token:
+            creds = self.refresh(tenant, creds)
+        return creds
+
+    def peek(self, tenant: str = DEFAULT_TENANT):
+        """Cached credentials if they are usable right now, without any I/O"""
+        with self._lock:
+            entry = self._entries.get(tenant)
+            if entry is None or time.monotonic() - entry.checked_at > RECHECK_INTERVAL:
+                return None
+            if not entry.creds.valid:
+                return None
+            self._entries.move_to_end(tenant)
+            self.hits += 1
+            return entry.creds
+
+    def save(self, tenant: str, creds: Credentials):
+        version = self.backend.save(tenant, creds.to_json())
+        self._remember(tenant, creds, version)
+
+    def clear(self, tenant: str = DEFAULT_TENANT):
+        self.backend.delete(tenant)
+        with self._lock:
+            self._entries.pop(tenant, None)
+
+    def tenants(self) -> list:
+        with self._lock:
+            return list(self._entries)
+
+    def refresh(self, tenant: str = DEFAULT_TENANT, stale: Credentials = None):
+        """
+        Refresh the tenant's access token. Concurrent callers queue on one lock
+        per tenant and the first one through does the refresh; the rest reuse
+        its result.
+        """
+        with self._refresh_lock(tenant), self.backend.refresh_lock(tenant):
+            # Straight from the backend: another worker may have refreshed already
+            creds = self._load(tenant, recheck=True)
+            if creds is None:
+                return None
+            # Someone else refreshed while we were waiting on the lock
+            if stale is not None and creds.valid:
+                return creds
+            if stale is None and seconds_until_expiry(creds) > REFRESH_MARGIN:
+                return creds
+            try:
+                creds.refresh(GoogleRequest())
+            except RefreshError as e:
+                # Revoked or scope mismatch → reset so /auth can start over
+                self.clear(tenant)
+                print(f"⚠️ Token refresh rejected for tenant {tenant}, deleted token: {str(e)}")
+                return None
+            self.refreshes += 1
+            self.save(tenant, creds)
+            return creds
+
+    def _refresh_lock(self, tenant: str) -> threading.Lock:
+        with self._lock:
+            lock = self._refresh_locks.get(tenant)
+            if lock is None:
+                lock = self._refresh_locks[tenant] = threading.Lock()
+            return lock
+
+    def _remember(self, tenant: str, creds, version):
+        with self._lock:
+            self._entries[tenant] = _Entry(creds, version)
+            self._entries.move_to_end(tenant)
+            while len(self._entries) > self.max_cached:
+                evicted, _ = self._entries.popitem(last=False)
+                self._refresh_locks.pop(evicted, None)
+
+    def _load(self, tenant: str, recheck: bool = False):
+        with self._lock:
+            entry = self._entries.get(tenant)
+            if entry is not None:
+                self._entries.move_to_end(tenant)
+                if not recheck and time.monotonic() - entry.checked_at <= RECHECK_INTERVAL:
+                    self.hits += 1
+                    return entry.creds
+
+        # Only ask the backend whether the token changed, not for the token itself
+        version = self.backend.version(tenant)
+        if entry is not None and version is not None and version == entry.version:
+            with self._lock:
+                entry.checked_at = time.monotonic()
+                self.hits += 1
+            return entry.creds
+
+        self.misses += 1
+        token_json, version = self.backend.load(tenant)
+        if token_json is None:
+            with self._lock:
+                self._entries.pop(tenant, None)
+            return None
+        try:
+            creds = Credentials.from_authorized_user_info(json.loads(token_json), self.scopes)
+        except Exception as e:
+            # Scope mismatch or invalid token → reset
+            self.clear(tenant)
+            print(f"⚠️ Token invalid or scope mismatch for tenant {tenant}, deleted token: {str(e)}")
+            return None
+        self._remember(tenant, creds, version)
+        return creds
+
+    async def refresh_forever(self, idle_interval: float = 60):
+        """Background task: refresh cached tenants shortly before expiry so requests never wait on it"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                delay = idle_interval
+                for tenant in self.tenants():
+                    creds = await loop.run_in_executor(None, self._load, tenant)
+                    if creds is None or not creds.refresh_token:
+                        continue
+                    remaining = seconds_until_expiry(creds) - REFRESH_MARGIN
+                    if remaining <= 0:
+                        await loop.run_in_executor(None, self.refresh, tenant)
+                    else:
+                        delay = min(delay, remaining)
+                await asyncio.sleep(max(delay, 5))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Background token refresh failed: {str(e)}")
+                await asyncio.sleep(idle_interval)
@@ -0,0 +1,318 @@
+"""
+Structured document builder
+Markdown or a JSON block tree is compiled into one documents.batchUpdate: the
+text and tables are inserted front to back at indices computed locally in one
+pass, then paragraph styles, bullets and inline text styles are applied to the
+final ranges. Blocks:
+
+    {"type": "heading", "level": 1-6, "text": "..."}
+    {"type": "paragraph", "text": "..."}
+    {"type": "list", "ordered": false, "items": ["...", ...]}
+    {"type": "table", "rows": [["...", ...], ...], "header": true}
+"""
+
+import re
+
+from doc_index import NEW_DOC_END_INDEX, doc_index_cache, get_doc_end, is_revision_mismatch, utf16_len
+from google_client import GoogleAPIError
+
+MAX_HEADING_LEVEL = 6
+BULLET_PRESET = "BULLET_DISC_CIRCLE_SQUARE"
+NUMBERED_PRESET = "NUMBERED_DECIMAL_ALPHA_ROMAN"
+CODE_FONT = "Courier New"
+
+_INLINE = re.compile(
+    r"\*\*(?P<bold>.+?)\*\*"
+    r"|`(?P<code>[^`]+)`"
+    r"|\[(?P<label>[^\]]+)\]\((?P<url>[^)\s]+)\)"
+    r"|\*(?P<italic>[^*\s](?:[^*]*[^*\s])?)\*"
+)
+
+
+def parse_inline(text: str):
+    """Markdown **bold**, *italic*, `code` and [links](url) → plain text and (start, end, style) spans"""
+    parts, spans, offset, last = [], [], 0, 0
+    for match in _INLINE.finditer(text):
+        before = text[last:match.start()]
+        parts.append(before)
+        offset += utf16_len(before)
+        if match.group("bold") is not None:
+            inner, style = match.group("bold"), {"bold": True}
+        elif match.group("code") is not None:
+            inner, style = match.group("code"), {"weightedFontFamily": {"fontFamily": CODE_FONT}}
+        elif match.group("label") is not None:
+            inner, style = match.group("label"), {"link": {"url": match.group("url")}}
+        else:
+            inner, style = match.group("italic"), {"italic": True}
+        parts.append(inner)
+        length = utf16_len(inner)
+        spans.append((offset, offset + length, style))
+        offset += length
+        last = match.end()
+    parts.append(text[last:])
+    return "".join(parts), spans
+
+
+# ----------------------------
+# Markdown
+# ----------------------------
+_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_BULLET = re.compile(r"^\s*[-*+]\s+(.*)$")
+_NUMBERED = re.compile(r"^\s*\d+[.)]\s+(.*)$")
+_TABLE_RULE = re.compile(r"^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$")
+
+
+def _table_cells(line: str) -> list:
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|"):
+        line = line[:-1]
+    return [cell.strip() for cell in line.split("|")]
+
+
+def parse_markdown(text: str) -> list:
+    """The Markdown subset reports use: ATX headings, paragraphs, flat lists and pipe tables"""
+    blocks, paragraph = [], []
+
+    def end_paragraph():
+        if paragraph:
+            blocks.append({"type": "paragraph", "text": " ".join(paragraph)})
+            paragraph.clear()
+
+    lines = text.splitlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+        heading = _HEADING.match(stripped)
+        bullet = _BULLET.match(line)
+        numbered = _NUMBERED.match(line)
+        if not stripped:
+            end_paragraph()
+        elif heading:
+            end_paragraph()
+            blocks.append({"type": "heading", "level": len(heading.group(1)), "text": heading.group(2)})
+        elif bullet or numbered:
+            end_paragraph()
+            ordered = numbered is not None
+            item = (numbered or bullet).group(1)
+            previous = blocks[-1] if blocks else None
+            if previous and previous["type"] == "list" and previous["ordered"] == ordered:
+                previous["items"].append(item)
+            else:
+                blocks.append({"type": "list", "ordered": ordered, "items": [item]})
+        elif stripped.startswith("|"):
+            end_paragraph()
+            rows, header = [], False
+            while i < len(lines) and lines[i].strip().startswith("|"):
+                if _TABLE_RULE.match(lines[i]):
+                    header = len(rows) == 1
+                else:
+                    rows.append(_table_cells(lines[i]))
+                i += 1
+            blocks.append({"type": "table", "rows": rows, "header": header})
+            continue
+        else:
+            paragraph.append(stripped)
+        i += 1
+    end_paragraph()
+    return blocks
+
+
+def validate_blocks(blocks: list) -> list:
+    for number, block in enumerate(blocks):
+        kind = block.get("type") if isinstance(block, dict) else None
+        if kind in ("heading", "paragraph"):
+            if not isinstance(block.get("text"), str):
+                raise ValueError(f"Block {number}: {kind} needs a 'text' string")
+            if kind == "heading" and block.get("level", 1) not in range(1, MAX_HEADING_LEVEL + 1):
+                raise ValueError(f"Block {number}: heading level must be 1-{MAX_HEADING_LEVEL}")
+        elif kind == "list":
+            items = block.get("items")
+            if not isinstance(items, list) or not items or not all(isinstance(item, str) for item in items):
+                raise ValueError(f"Block {number}: list needs a non-empty 'items' list of strings")
+        elif kind == "table":
+            rows = block.get("rows")
+            # A Markdown table of separator rows only parses to no rows at all
+            if not isinstance(rows, list) or not all(isinstance(row, list) for row in rows) or not any(rows):
+                raise ValueError(f"Block {number}: table needs a non-empty 'rows' list of lists")
+            for r, row in enumerate(rows):
+                for c, cell in enumerate(row):
+                    # Anything else would be written as its Python repr
+                    if isinstance(cell, (dict, list)):
+                        raise ValueError(f"Block {number}: table cell [{r}][{c}] must be text, a number or null, "
+                                         f"got {type(cell).__name__}")
+        else:
+            raise ValueError(f"Block {number}: unknown type {kind!r}; use heading, paragraph, list or table")
+    return blocks
+
+
+# ----------------------------
+# Compiling
+# ----------------------------
+class CompiledDoc:
+    __slots__ = ("requests", "length")
+
+    def __init__(self, requests: list, length: int):
+        self.requests = requests
+        self.length = length  # UTF-16 units added to the body
+
+
+class _Builder:
+    def __init__(self, index: int, empty: bool, inline: bool):
+        self.pos = index  # where the next insert goes; always the end of what is there
+        self.inline = inline
+        self.needs_break = not empty  # the next paragraph must start a new line first
+        self.inserts = []
+        self.paragraph_styles = []  # [start, end, namedStyleType]
+        self.bullets = []
+        self.text_styles = []
+        self._pending = []
+        self._pending_at = index
+
+    def _text(self, text: str):
+        self._pending.append(text)
+        self.pos += utf16_len(text)
+
+    def flush(self):
+        if self._pending:
+            self.inserts.append({"insertText": {"location": {"index": self._pending_at},
+                                                "text": "".join(self._pending)}})
+            self._pending = []
+        self._pending_at = self.pos
+
+    def _styled(self, text: str, at: int) -> str:
+        if not self.inline:
+            return text
+        plain, spans = parse_inline(text)
+        self.text_styles.extend((at + start, at + end, style) for start, end, style in spans)
+        return plain
+
+    def paragraph(self, text: str, named_style: str = "NORMAL_TEXT") -> tuple:
+        # Each paragraph is preceded by a line break rather than followed by one,
+        # so the last one takes over the document's final newline
+        if self.needs_break:
+            self._text("\n")
+        self.needs_break = True
+        start = self.pos
+        text = self._styled(text.replace("\n", " "), start)
+        self._text(text)
+        if named_style != "NORMAL_TEXT":
+            self.paragraph_styles.append([start, max(self.pos, start + 1), named_style])
+        return start, self.pos
+
+    def table(self, rows: list, header: bool):
+        cols = max(len(row) for row in rows)
+        self.flush()
+        # insertTable adds a newline at the location and the table right after it:
+        # table start, then per row a row marker and per cell a cell marker and an empty paragraph
+        location = self.pos
+        self.inserts.append({"insertTable": {"rows": len(rows), "columns": cols, "location": {"index": location}}})
+        table_start = location + 1
+
+        cells, added = [], 0
+        for r, row in enumerate(rows):
+            for c in range(cols):
+                value = row[c] if c < len(row) else ""
+                text = "" if value is None else str(value)
+                empty_index = table_start + 1 + r * (1 + 2 * cols) + 1 + 2 * c + 1
+                final_index = empty_index + added
+                text = self._styled(text, final_index)
+                if header and r == 0 and text:
+                    self.text_styles.append((final_index, final_index + utf16_len(text), {"bold": True}))
+                if text:
+                    cells.append((empty_index, text))
+                added += utf16_len(text)
+        # Last cell first, so the indices of the earlier ones stay valid
+        for index, text in reversed(cells):
+            self.inserts.append({"insertText": {"location": {"index": index}, "text": text}})
+
+        self.pos = location + 2 + len(rows) * (1 + 2 * cols) + added
+        self._pending_at = self.pos
+        # The paragraph after a table is already empty and can be written into directly
+        self.needs_break = False
+
+    def requests(self, content_start: int, reset: bool) -> list:
+        self.flush()
+        styles = []
+        if reset and self.pos > content_start:
+            # Appended text inherits the style of the paragraph it lands in
+            whole = {"startIndex": content_start, "endIndex": self.pos}
+            styles.append({"updateParagraphStyle": {"range": whole, "paragraphStyle": {"namedStyleType": "NORMAL_TEXT"},
+                                                    "fields": "namedStyleType"}})
+            styles.append({"deleteParagraphBullets": {"range": whole}})
+            styles.append({"updateTextStyle": {"range": whole, "textStyle": {},
+                                               "fields": "bold,italic,link,weightedFontFamily"}})
+        merged = []
+        for start, end, named_style in self.paragraph_styles:
+            # Neighbouring paragraphs with the same style share one request
+            if merged and merged[-1][2] == named_style and merged[-1][1] + 1 >= start:
+                merged[-1][1] = end
+            else:
+                merged.append([start, end, named_style])
+        for start, end, named_style in merged:
+            styles.append({"updateParagraphStyle": {
+                "range": {"startIndex": start, "endIndex": end},
+                "paragraphStyle": {"namedStyleType": named_style}, "fields": "namedStyleType",
+            }})
+        for start, end, preset in self.bullets:
+            styles.append({"createParagraphBullets": {"range": {"startIndex": start, "endIndex": end},
+                                                      "bulletPreset": preset}})
+        for start, end, style in self.text_styles:
+            if end > start:
+                styles.append({"updateTextStyle": {"range": {"startIndex": start, "endIndex": end},
+                                                   "textStyle": style, "fields": ",".join(style)}})
+        return self.inserts + styles
+
+
+def compile_blocks(blocks: list, end_index: int = NEW_DOC_END_INDEX, inline: bool = False) -> CompiledDoc:
+    """
+    Requests that append blocks to a body ending at end_index. With inline=True,
+    text may use Markdown inline markup.
+    """
+    empty = end_index <= NEW_DOC_END_INDEX
+    builder = _Builder(end_index - 1, empty, inline)
+    content_start = end_index - 1 + (0 if empty else 1)
+    for block in blocks:
+        kind = block["type"]
+        if kind == "heading":
+            builder.paragraph(block["text"], f"HEADING_{block.get('level', 1)}")
+        elif kind == "paragraph":
+            builder.paragraph(block["text"])
+        elif kind == "list":
+            first = None
+            for item in block["items"]:
+                start, end = builder.paragraph(item.lstrip("\t"))
+                first = start if first is None else first
+            preset = NUMBERED_PRESET if block.get("ordered") else BULLET_PRESET
+            builder.bullets.append((first, max(end, start + 1), preset))
+        elif kind == "table":
+            builder.table(block["rows"], bool(block.get("header")))
+    requests = builder.requests(content_start, reset=not empty)
+    return CompiledDoc(requests, builder.pos - (end_index - 1))
+
+
+async def write_blocks(client, tenant: str, doc_id: str, blocks: list, inline: bool = False) -> CompiledDoc:
+    """Append blocks in one batchUpdate, pinned to the revision the end index was read at"""
+    key = (tenant, doc_id)
+    for attempt in range(2):
+        end = await get_doc_end(client, tenant, doc_id)
+        compiled = compile_blocks(blocks, end.end_index, inline)
+        body = {"requests": compiled.requests}
+        if end.revision_id:
+            body["writeControl"] = {"requiredRevisionId": end.revision_id}
+        try:
+            response = await client.call("docs", "documents.batchUpdate", documentId=doc_id, body=body)
+        except GoogleAPIError as e:
+            doc_index_cache.invalidate(key)
+            if attempt or not is_revision_mismatch(e):
+                raise
+            # Edited since the end index was cached; recompile against the current one
+            continue
+        revision_id = response.get("writeControl", {}).get("requiredRevisionId")
+        if revision_id:
+            doc_index_cache.set(key, end.end_index + compiled.length, revision_id)
+        else:
+            doc_index_cache.invalidate(key)
+        return compiled
@@ -0,0 +1,88 @@
+"""
+Per-document end-index cache
+Tracks where each Google Doc's body ends so writes that need an explicit index
+never have to re-read the document. Entries are tied to the revision they were
+computed for and advanced locally from the length of each write.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+MAX_DOCS = int(os.environ.get("DOC_INDEX_CACHE_SIZE", "10000"))
+
+# A freshly created document: section break [0, 1) then an empty paragraph [1, 2)
+NEW_DOC_END_INDEX = 2
+
+
+def utf16_len(text: str) -> int:
+    """Docs indices count UTF-16 code units, not Python characters"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+class DocEnd:
+    __slots__ = ("end_index", "revision_id")
+
+    def __init__(self, end_index: int, revision_id: str):
+        self.end_index = end_index
+        self.revision_id = revision_id
+
+
+class DocEndIndexCache:
+    def __init__(self, max_docs: int = MAX_DOCS):
+        self.max_docs = max_docs
+        self._docs = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._docs.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._docs.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, end_index: int, revision_id: str):
+        with self._lock:
+            self._docs[key] = DocEnd(end_index, revision_id)
+            self._docs.move_to_end(key)
+            while len(self._docs) > self.max_docs:
+                self._docs.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._docs.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._docs)}
+
+
+doc_index_cache = DocEndIndexCache()
+
+
+def is_revision_mismatch(error) -> bool:
+    return error.status == 400 and "revision" in (error.message or "").lower()
+
+
+async def fetch_doc_end(client, doc_id: str) -> DocEnd:
+    """One documents.get restricted to the revision and element end indices"""
+    doc = await client.call(
+        "docs", "documents.get", documentId=doc_id, fields="revisionId,body.content(endIndex)"
+    )
+    content = doc.get("body", {}).get("content", [])
+    end_index = content[-1]["endIndex"] if content else NEW_DOC_END_INDEX
+    return DocEnd(end_index, doc.get("revisionId"))
+
+
+async def get_doc_end(client, tenant: str, doc_id: str) -> DocEnd:
+    key = (tenant, doc_id)
+    entry = doc_index_cache.get(key)
+    if entry is None:
+        entry = await fetch_doc_end(client, doc_id)
+        doc_index_cache.set(key, entry.end_index, entry.revision_id)
+    return entry
@@ -0,0 +1,130 @@
+"""
+Bulk document generation from one template
+Each record costs two Google calls: a Drive files.copy of the template and one
+documents.batchUpdate carrying a replaceAllText per placeholder. Records are
+rendered in parallel; the outbound scheduler keeps the calls within quota.
+"""
+
+import asyncio
+import json
+import os
+
+from bulk_loader import iter_lines
+from google_client import GoogleAPIError
+from outbound import DeadlineExceeded, start_request_deadline
+
+DOC_RENDER_CONCURRENCY = int(os.environ.get("DOC_RENDER_CONCURRENCY", "8"))
+# Largest request body; every record is read before the first is rendered
+DOC_RENDER_MAX_BYTES = int(os.environ.get("DOC_RENDER_MAX_BYTES", str(16 * 1024 * 1024)))
+# A record {"name": "Ada"} replaces every {{name}} in the template
+PLACEHOLDER = "{{%s}}"
+
+
+def placeholder_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    return json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+
+
+def render_title(title: str, record: dict) -> str:
+    for key, value in record.items():
+        title = title.replace(PLACEHOLDER % key, placeholder_text(value))
+    return title
+
+
+def replace_requests(record: dict) -> list:
+    return [{
+        "replaceAllText": {
+            "containsText": {"text": PLACEHOLDER % key, "matchCase": True},
+            "replaceText": placeholder_text(value),
+        }
+    } for key, value in record.items()]
+
+
+class BodyTooLarge(ValueError):
+    """The request body passed DOC_RENDER_MAX_BYTES"""
+
+
+async def capped(chunks, max_bytes: int):
+    """Pass chunks through until more than max_bytes arrived"""
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > max_bytes:
+            raise BodyTooLarge(f"Body exceeds {max_bytes} bytes")
+        yield chunk
+
+
+async def read_ndjson_records(chunks) -> list:
+    """One JSON object per line, parsed as the lines arrive"""
+    records = []
+    number = 0
+    async for line in iter_lines(chunks):
+        number += 1
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"Line {number} is not valid JSON: {e}")
+        if not isinstance(record, dict):
+            raise ValueError(f"Line {number} must be a JSON object")
+        records.append(record)
+    return records
+
+
+async def render_one(client, template_id: str, record: dict, title: str = None, folder_id: str = None) -> dict:
+    # The stream can outlast one request's deadline, so each record gets its own
+    start_request_deadline()
+    body = {}
+    if title:
+        body["name"] = render_title(title, record)
+    if folder_id:
+        body["parents"] = [folder_id]
+    copy = await client.call("drive", "files.copy", fileId=template_id, body=body,
+                             fields="id,name", supportsAllDrives=True)
+    doc_id = copy["id"]
+    occurrences = 0
+    requests = replace_requests(record)
+    if requests:
+        try:
+            result = await client.call("docs", "documents.batchUpdate", documentId=doc_id,
+                                       body={"requests": requests})
+        except (GoogleAPIError, DeadlineExceeded) as e:
+            # The copy exists; report it so the caller can retry the fill or delete it
+            e.doc_id = doc_id
+            raise
+        occurrences = sum(reply.get("replaceAllText", {}).get("occurrencesChanged", 0)
+                          for reply in result.get("replies", []))
+    return {"doc_id": doc_id, "name": copy.get("name"), "link": f"https://docs.google.com/document/d/{doc_id}",
+            "occurrences_changed": occurrences}
+
+
+async def render_all(client, template_id: str, records: list, title: str = None, folder_id: str = None,
+                     concurrency: int = DOC_RENDER_CONCURRENCY):
+    """Yield one result per record, in completion order, each tagged with the record's index"""
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run(index: int, record: dict) -> dict:
+        async with slots:
+            try:
+                return {"index": index, "status": "success",
+                        **await render_one(client, template_id, record, title, folder_id)}
+            except (GoogleAPIError, DeadlineExceeded) as e:
+                result = {"index": index, "status": "error", "message": e.message,
+                          "google_status": e.status}
+                if getattr(e, "doc_id", None):
+                    result["doc_id"] = e.doc_id
+                return result
+
+    tasks = [asyncio.create_task(run(index, record)) for index, record in enumerate(records)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Client went away: stop starting new copies
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,263 @@
+"""
+Drive changes feed watcher
+One changes.list call per tenant and interval replaces per-file polling: the page
+token is kept in SQLite so a restart resumes where it stopped, and every change is
+handed to the listeners (cache invalidation) and to subscribed SSE clients.
+The feed marks the tenant's own edits modified_by_me, whether the bridge or the
+owner in the Docs or Sheets UI made them; those leaving a file at a version the
+bridge recorded for one of its writes are also marked by_bridge.
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from shared_state import MemoryState, SharedState
+
+DRIVE_CHANGES_DB = os.environ.get("DRIVE_CHANGES_DB", "drive_changes.db")
+DRIVE_CHANGES_POLL_SECONDS = float(os.environ.get("DRIVE_CHANGES_POLL_SECONDS", "15"))
+CHANGE_FIELDS = (
+    "nextPageToken,newStartPageToken,"
+    "changes(changeType,fileId,removed,time,file(name,mimeType,version,trashed,lastModifyingUser(me)))"
+)
+# How long the version a bridge write left a file at stays recorded; a restart
+# resumes the feed from its saved token and may replay changes that old
+OWN_WRITE_TTL = float(os.environ.get("OWN_WRITE_TTL", "86400"))
+
+
+class ChangeTokenStore:
+    """Last changes.list page token per tenant"""
+
+    def __init__(self, path: str = DRIVE_CHANGES_DB):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS change_tokens ("
+            "tenant TEXT PRIMARY KEY, page_token TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, tenant: str):
+        row = self._conn().execute(
+            "SELECT page_token FROM change_tokens WHERE tenant = ?", (tenant,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def save(self, tenant: str, page_token: str):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO change_tokens (tenant, page_token, updated_at) VALUES (?, ?, ?)",
+                (tenant, page_token, time.time()),
+            )
+
+    def delete(self, tenant: str):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM change_tokens WHERE tenant = ?", (tenant,))
+
+    def tenants(self) -> list:
+        return [row[0] for row in self._conn().execute("SELECT tenant FROM change_tokens")]
+
+
+def change_event(change: dict) -> dict:
+    file = change.get("file") or {}
+    return {
+        "file_id": change.get("fileId"),
+        "removed": bool(change.get("removed") or file.get("trashed")),
+        "time": change.get("time"),
+        "name": file.get("name"),
+        "mime_type": file.get("mimeType"),
+        "version": file.get("version"),
+        # True when the tenant's own account made the edit: the bridge, or its owner in the UI
+        "modified_by_me": bool(file.get("lastModifyingUser", {}).get("me")),
+    }
+
+
+class ChangeFeed:
+    """
+    get_client(tenant) returns a GoogleClient or None; listeners are
+    `async def listener(tenant, event)` and run for every change before
+    subscribers see it. Versions passed to record_own_write are kept in
+    state, so every worker recognises them.
+    """
+
+    def __init__(self, store: ChangeTokenStore, get_client, poll_seconds: float = DRIVE_CHANGES_POLL_SECONDS,
+                 state: SharedState = None):
+        self.store = store
+        self.get_client = get_client
+        self.poll_seconds = poll_seconds
+        self.state = state if state is not None else MemoryState()
+        self.listeners = []
+        self._watchers = {}  # tenant -> polling task
+        self._since = {}  # tenant -> monotonic time the feed has been complete from
+        # This process's own position; with several workers each one reads the whole feed
+        self._tokens = {}
+        self._locks = {}
+        self._subscribers = {}  # tenant -> queues
+        self.polls = 0
+        self.changes = 0
+        self.by_bridge = 0
+        self.errors = 0
+
+    async def start(self):
+        # Resume every tenant that was being watched before the restart
+        for tenant in await run_in_threadpool(self.store.tenants):
+            self.watch(tenant)
+
+    async def stop(self):
+        tasks = list(self._watchers.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._watchers.clear()
+        self._since.clear()
+        self._tokens.clear()
+        # Bound to the loop that is shutting down
+        self._locks.clear()
+
+    def watch(self, tenant: str):
+        task = self._watchers.get(tenant)
+        if task is None or task.done():
+            self._watchers[tenant] = asyncio.create_task(self._watch_loop(tenant))
+
+    async def unwatch(self, tenant: str):
+        task = self._watchers.pop(tenant, None)
+        self._since.pop(tenant, None)
+        self._tokens.pop(tenant, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await run_in_threadpool(self.store.delete, tenant)
+
+    def watching(self, tenant: str) -> bool:
+        task = self._watchers.get(tenant)
+        return task is not None and not task.done()
+
+    def trusted_since(self, tenant: str):
+        """
+        Monotonic time from which every change for the tenant reaches the listeners
+        (up to one poll interval late), or None while the feed is not healthy
+        """
+        return self._since.get(tenant)
+
+    async def record_own_write(self, tenant: str, file_id: str, version: str):
+        """
+        Note the Drive version a bridge write left a file at; the change that
+        reaches it is reported by_bridge. An outside edit landing between the
+        write and reading the version is taken for the bridge's.
+        """
+        if version:
+            await self.state.set(f"own_write:{tenant}:{file_id}", version, OWN_WRITE_TTL)
+
+    async def _made_by_bridge(self, tenant: str, event: dict) -> bool:
+        version = await self.state.get(f"own_write:{tenant}:{event['file_id']}")
+        return version is not None and version == event["version"]
+
+    def _lock(self, tenant: str) -> asyncio.Lock:
+        lock = self._locks.get(tenant)
+        if lock is None:
+            lock = self._locks[tenant] = asyncio.Lock()
+        return lock
+
+    async def poll(self, tenant: str) -> list:
+        """One incremental pass over the feed; returns the changes seen"""
+        async with self._lock(tenant):
+            client = await self.get_client(tenant)
+            if client is None:
+                raise PermissionError(f"No Google credentials for tenant {tenant!r}")
+            started = time.monotonic()
+            # The stored token may have been advanced by another worker, whose
+            # listeners saw those changes and ours did not
+            token = self._tokens.get(tenant) or await run_in_threadpool(self.store.load, tenant)
+            if token is None:
+                # First watch: changes from now on, nothing before
+                start = await client.call("drive", "changes.getStartPageToken", supportsAllDrives=True)
+                self._tokens[tenant] = start["startPageToken"]
+                await run_in_threadpool(self.store.save, tenant, start["startPageToken"])
+                self._since.setdefault(tenant, started)
+                return []
+
+            events = []
+            while True:
+                page = await client.call(
+                    "drive", "changes.list", pageToken=token, pageSize=1000, fields=CHANGE_FIELDS,
+                    includeItemsFromAllDrives=True, supportsAllDrives=True,
+                )
+                for change in page.get("changes", []):
+                    if change.get("changeType", "file") == "file" and change.get("fileId"):
+                        events.append(change_event(change))
+                token = page.get("nextPageToken") or page.get("newStartPageToken")
+                if not page.get("nextPageToken"):
+                    break
+
+            for event in events:
+                # Only the tenant's own account can have made the bridge's writes
+                event["by_bridge"] = event["modified_by_me"] and await self._made_by_bridge(tenant, event)
+                self.by_bridge += event["by_bridge"]
+                for listener in self.listeners:
+                    await listener(tenant, event)
+                for queue in self._subscribers.get(tenant, ()):
+                    queue.put_nowait(event)
+            # Save only after dispatch, so a crash replays changes instead of losing them
+            self._tokens[tenant] = token
+            await run_in_threadpool(self.store.save, tenant, token)
+            self._since.setdefault(tenant, started)
+            self.polls += 1
+            self.changes += len(events)
+            return events
+
+    async def _watch_loop(self, tenant: str):
+        while True:
+            try:
+                await self.poll(tenant)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Until a poll succeeds again, caches must not rely on the feed
+                self._since.pop(tenant, None)
+                self.errors += 1
+                print(f"⚠️ Drive changes poll failed for {tenant}: {e}")
+            await asyncio.sleep(self.poll_seconds)
+
+    async def events(self, tenant: str, file_ids=None, keepalive: float = 15):
+        """Yield change events for the tenant (optionally only some files); None is a keepalive tick"""
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(tenant, set()).add(queue)
+        self.watch(tenant)
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if not file_ids or event["file_id"] in file_ids:
+                    yield event
+        finally:
+            subscribers = self._subscribers.get(tenant)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[tenant]
+
+    def stats(self) -> dict:
+        return {
+            "watching": sorted(t for t in self._watchers if self.watching(t)),
+            "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+            "polls": self.polls, "changes": self.changes, "by_bridge": self.by_bridge, "errors": self.errors,
+        }
@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+In-process fake of the Google Docs v1, Sheets v4 and Drive v3 endpoints the bridge uses
+Latency, error rate and per-minute quotas are configurable so the bridge can be
+exercised and benchmarked offline. Every write is recorded in a Drive changes
+log; a write sent with another Authorization header stands in for an edit made
+outside the bridge. Point the bridge at it with
+GOOGLE_API_BASE_URL, or mount it on an httpx.ASGITransport.
+"""
+
+import asyncio
+import itertools
+import os
+import random
+import re
+import time
+from collections import defaultdict
+from urllib.parse import unquote
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+class FakeConfig:
+    def __init__(self):
+        self.latency_ms = float(os.environ.get("FAKE_GOOGLE_LATENCY_MS", "50"))
+        self.jitter_ms = float(os.environ.get("FAKE_GOOGLE_JITTER_MS", "10"))
+        self.error_rate = float(os.environ.get("FAKE_GOOGLE_ERROR_RATE", "0"))
+        # Requests per minute per (api, read|write, token); 0 disables
+        self.quota_per_minute = int(os.environ.get("FAKE_GOOGLE_QUOTA_PER_MINUTE", "0"))
+
+    def update(self, values: dict):
+        for name in ("latency_ms", "jitter_ms", "error_rate", "quota_per_minute"):
+            if name in values:
+                setattr(self, name, type(getattr(self, name))(values[name]))
+
+    def to_dict(self) -> dict:
+        return {"latency_ms": self.latency_ms, "jitter_ms": self.jitter_ms,
+                "error_rate": self.error_rate, "quota_per_minute": self.quota_per_minute}
+
+
+# ----------------------------
+# State
+# ----------------------------
+# Tables are kept inline in the text as private-use marker characters so
+# indices line up with the real API's structural elements
+TABLE_START, ROW_START, CELL_START = "\ue000", "\ue001", "\ue002"
+
+
+class FakeDoc:
+    def __init__(self, doc_id: str, title: str):
+        self.doc_id = doc_id
+        self.title = title
+        self.text = "\n"  # body text; index 1 is text[0]
+        self.revision = 1
+        self.modified_by = ""  # Authorization header of the last writer
+
+    @property
+    def revision_id(self) -> str:
+        return f"{self.doc_id}-r{self.revision}"
+
+    def end_index(self) -> int:
+        return len(self.text) + 1
+
+    def to_dict(self) -> dict:
+        paragraphs, start = [], 1
+        for line in self.text.split("\n")[:-1]:
+            end = start + len(line) + 1
+            paragraphs.append({
+                "startIndex": start,
+                "endIndex": end,
+                "paragraph": {"elements": [{"startIndex": start, "endIndex": end,
+                                            "textRun": {"content": line + "\n"}}]},
+            })
+            start = end
+        return {
+            "documentId": self.doc_id,
+            "title": self.title,
+            "revisionId": self.revision_id,
+            "body": {"content": [{"endIndex": 1, "sectionBreak": {}}] + paragraphs},
+        }
+
+
+class FakeSheet:
+    def __init__(self, sheet_id: str, title: str):
+        self.sheet_id = sheet_id
+        self.title = title
+        self.cells = {}  # (tab, row, col) -> value, zero-based
+        self.version = 1  # Drive file version, bumped on every write
+        self.modified_by = ""
+
+    def to_dict(self) -> dict:
+        return {
+            "spreadsheetId": self.sheet_id,
+            "properties": {"title": self.title},
+            "sheets": [{"properties": {"sheetId": 0, "title": "Sheet1", "index": 0}}],
+        }
+
+
+_CELL = re.compile(r"^([A-Za-z]*)([0-9]*)$")
+
+
+def parse_range(a1: str):
+    """'Sheet1'!B2:D5 → (tab, row, col, end_row, end_col); ends are None when open"""
+    tab = "Sheet1"
+    if "!" in a1:
+        tab, a1 = a1.rsplit("!", 1)
+        tab = tab.strip("'").replace("''", "'")
+    start, _, end = a1.partition(":")
+
+    def cell(ref):
+        match = _CELL.match(ref)
+        if match is None:
+            raise ValueError(f"Unable to parse range: {a1}")
+        letters, digits = match.groups()
+        col = None
+        if letters:
+            col = 0
+            for ch in letters.upper():
+                col = col * 26 + ord(ch) - 64
+            col -= 1
+        return (int(digits) - 1 if digits else None), col
+
+    row, col = cell(start or "A1")
+    end_row, end_col = cell(end) if end else (None, None)
+    return tab, row or 0, col or 0, end_row, end_col
+
+
+# Shared by every reset, so a long-lived bridge never sees the same file id twice
+_file_ids = itertools.count(1)
+
+
+class FakeGoogle:
+    def __init__(self):
+        self.config = FakeConfig()
+        self.docs = {}
+        self.sheets = {}
+        self.calls = defaultdict(int)
+        self._windows = {}
+        self.changes = []  # Drive changes log; page tokens are 1-based positions in it
+
+    def record_change(self, file_id: str, request: Request):
+        file = self.docs.get(file_id) or self.sheets.get(file_id)
+        file.modified_by = request.headers.get("authorization", "")
+        self.changes.append({"fileId": file_id,
+                             "time": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())})
+
+    def drive_file(self, file_id: str, token: str):
+        doc = self.docs.get(file_id)
+        if doc is not None:
+            name, mime_type, version = doc.title, "application/vnd.google-apps.document", doc.revision
+            modified_by = doc.modified_by
+        else:
+            sheet = self.sheets.get(file_id)
+            if sheet is None:
+                return None
+            name, mime_type, version = sheet.title, "application/vnd.google-apps.spreadsheet", sheet.version
+            modified_by = sheet.modified_by
+        return {"id": file_id, "name": name, "mimeType": mime_type, "version": str(version),
+                "trashed": False, "lastModifyingUser": {"me": modified_by == token}}
+
+    def new_id(self, prefix: str) -> str:
+        return f"{prefix}{next(_file_ids):06d}"
+
+    def reset(self):
+        self.__init__()
+
+    def check_quota(self, api: str, kind: str, token: str):
+        """Fixed one-minute windows; returns seconds until reset when exhausted"""
+        limit = self.config.quota_per_minute
+        if not limit:
+            return None
+        window = int(time.time() // 60)
+        key = (api, kind, token)
+        start, count = self._windows.get(key, (window, 0))
+        if start != window:
+            start, count = window, 0
+        if count >= limit:
+            return (start + 1) * 60 - time.time()
+        self._windows[key] = (start, count + 1)
+        return None
+
+
+fake = FakeGoogle()
+app = FastAPI()
+
+
+def error(status: int, message: str, headers: dict = None):
+    return JSONResponse(status_code=status, headers=headers,
+                        content={"error": {"code": status, "message": message}})
+
+
+@app.middleware("http")
+async def simulate(request: Request, call_next):
+    path = request.url.path
+    if path.startswith("/_fake"):
+        return await call_next(request)
+
+    api = "docs" if path.startswith("/v1/") else "sheets" if path.startswith("/v4/") else "drive"
+    kind = "read" if request.method == "GET" else "write"
+    fake.calls[f"{request.method} {api}"] += 1
+
+    config = fake.config
+    delay = max(0.0, config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)) / 1000
+    if delay:
+        await asyncio.sleep(delay)
+
+    token = request.headers.get("authorization", "")
+    retry_after = fake.check_quota(api, kind, token)
+    if retry_after is not None:
+        fake.calls["429"] += 1
+        return error(429, "Quota exceeded", {"Retry-After": str(max(1, int(retry_after)))})
+    if config.error_rate and random.random() < config.error_rate:
+        fake.calls["503"] += 1
+        return error(503, "The service is currently unavailable.")
+    return await call_next(request)
+
+
+# ----------------------------
+# Control
+# ----------------------------
+@app.get("/_fake/stats")
+async def fake_stats():
+    return {"config": fake.config.to_dict(), "calls": dict(fake.calls),
+            "docs": len(fake.docs), "sheets": len(fake.sheets)}
+
+@app.post("/_fake/config")
+async def fake_config(request: Request):
+    fake.config.update(await request.json())
+    return fake.config.to_dict()
+
+@app.post("/_fake/reset")
+async def fake_reset():
+    fake.reset()
+    return {"status": "ok"}
+
+
+# ----------------------------
+# Docs v1
+# ----------------------------
+@app.post("/v1/documents")
+async def docs_create(request: Request):
+    body = await request.json()
+    doc = FakeDoc(fake.new_id("doc"), body.get("title", "Untitled document"))
+    fake.docs[doc.doc_id] = doc
+    fake.record_change(doc.doc_id, request)
+    return doc.to_dict()
+
+@app.get("/v1/documents/{document_id}")
+async def docs_get(document_id: str):
+    doc = fake.docs.get(document_id)
+    if doc is None:
+        return error(404, f"Requested entity was not found: {document_id}")
+    return doc.to_dict()
+
+@app.post("/v1/documents/{document_id}:batchUpdate")
+async def docs_batch_update(document_id: str, request: Request):
+    doc = fake.docs.get(document_id)
+    if doc is None:
+        return error(404, f"Requested entity was not found: {document_id}")
+    body = await request.json()
+    required = body.get("writeControl", {}).get("requiredRevisionId")
+    if required and required != doc.revision_id:
+        return error(400, f"The required revision ID {required} does not match the latest revision.")
+
+    # Applied to a copy: like the real API, a rejected batch changes nothing
+    text = doc.text
+    replies = []
+    for req in body.get("requests", []):
+        if "insertText" in req:
+            op = req["insertText"]
+            end_index = len(text) + 1
+            if "endOfSegmentLocation" in op:
+                index = end_index - 1
+            else:
+                index = op["location"]["index"]
+            if not 1 <= index < end_index:
+                return error(400, f"Index {index} must be less than the end index of the referenced segment, {end_index}.")
+            text = text[:index - 1] + op["text"] + text[index - 1:]
+            replies.append({})
+        elif "insertTable" in req:
+            op = req["insertTable"]
+            index, end_index = op["location"]["index"], len(text) + 1
+            if not 1 <= index < end_index:
+                return error(400, f"Index {index} must be less than the end index of the referenced segment, {end_index}.")
+            # A newline, then one character per table, row and cell marker plus an empty paragraph per cell
+            table = "\n" + TABLE_START + (ROW_START + (CELL_START + "\n") * op["columns"]) * op["rows"]
+            text = text[:index - 1] + table + text[index - 1:]
+            replies.append({})
+        elif "replaceAllText" in req:
+            op = req["replaceAllText"]
+            find = op["containsText"]["text"]
+            flags = 0 if op["containsText"].get("matchCase") else re.IGNORECASE
+            text, count = re.subn(re.escape(find), lambda _: op.get("replaceText", ""), text, flags=flags)
+            replies.append({"replaceAllText": {"occurrencesChanged": count} if count else {}})
+        else:
+            # Styling and other structural requests are accepted but not modelled
+            replies.append({})
+    doc.text = text
+    doc.revision += 1
+    fake.record_change(document_id, request)
+    return {"documentId": document_id, "replies": replies,
+            "writeControl": {"requiredRevisionId": doc.revision_id}}
+
+
+# ----------------------------
+# Sheets v4
+# ----------------------------
+def write_values(sheet: FakeSheet, a1: str, values: list, major_dimension: str = "ROWS") -> dict:
+    tab, row, col, _, _ = parse_range(a1)
+    if major_dimension == "COLUMNS":
+        height = max((len(column) for column in values), default=0)
+        values = [[column[r] if r < len(column) else None for column in values] for r in range(height)]
+    width = 0
+    for r, cells in enumerate(values):
+        width = max(width, len(cells))
+        for c, value in enumerate(cells):
+            # null leaves the cell as it was
+            if value is not None:
+                sheet.cells[(tab, row + r, col + c)] = value
+    sheet.version += 1
+    return {"spreadsheetId": sheet.sheet_id, "updatedRange": a1, "updatedRows": len(values),
+            "updatedColumns": width, "updatedCells": sum(len(cells) for cells in values)}
+
+@app.post("/v4/spreadsheets")
+async def sheets_create(request: Request):
+    body = await request.json()
+    sheet = FakeSheet(fake.new_id("sheet"), body.get("properties", {}).get("title", "Untitled spreadsheet"))
+    fake.sheets[sheet.sheet_id] = sheet
+    fake.record_change(sheet.sheet_id, request)
+    return sheet.to_dict()
+
+@app.get("/v4/spreadsheets/{spreadsheet_id}")
+async def sheets_get(spreadsheet_id: str):
+    sheet = fake.sheets.get(spreadsheet_id)
+    if sheet is None:
+        return error(404, f"Requested entity was not found: {spreadsheet_id}")
+    return sheet.to_dict()
+
+@app.post("/v4/spreadsheets/{spreadsheet_id}:batchUpdate")
+async def sheets_batch_update(spreadsheet_id: str, request: Request):
+    sheet = fake.sheets.get(spreadsheet_id)
+    if sheet is None:
+        return error(404, f"Requested entity was not found: {spreadsheet_id}")
+    body = await request.json()
+    replies = []
+    for req in body.get("requests", []):
+        if "deleteDimension" in req:
+            rng = req["deleteDimension"]["range"]
+            if rng.get("sheetId", 0) != 0:
+                return error(400, f"No grid with id: {rng.get('sheetId')}")
+            start, end = rng["startIndex"], rng["endIndex"]
+            axis = 1 if rng["dimension"] == "ROWS" else 2
+            moved = {}
+            for key, value in sheet.cells.items():
+                if key[0] != "Sheet1":
+                    moved[key] = value
+                    continue
+                if start <= key[axis] < end:
+                    continue
+                if key[axis] >= end:
+                    key = list(key)
+                    key[axis] -= end - start
+                    key = tuple(key)
+                moved[key] = value
+            sheet.cells = moved
+            sheet.version += 1
+        # Formatting and other structural requests are accepted but not modelled
+        replies.append({})
+    fake.record_change(spreadsheet_id, request)
+    return {"spreadsheetId": spreadsheet_id, "replies": replies}
+
+@app.post("/v4/spreadsheets/{spreadsheet_id}/values:batchUpdate")
+async def sheets_values_batch_update(spreadsheet_id: str, request: Request):
+    sheet = fake.sheets.get(spreadsheet_id)
+    if sheet is None:
+        return error(404, f"Requested entity was not found: {spreadsheet_id}")
+    body = await request.json()
+    data = body.get("data", [])
+    # Every range is checked before anything is written
+    for d in data:
+        try:
+            parse_range(d["range"])
+        except ValueError as e:
+            return error(400, str(e))
+    responses = [write_values(sheet, d["range"], d.get("values", []), d.get("majorDimension", "ROWS"))
+                 for d in data]
+    fake.record_change(spreadsheet_id, request)
+    return {"spreadsheetId": spreadsheet_id, "responses": responses,
+            "totalUpdatedCells": sum(r["updatedCells"] for r in responses)}
+
+@app.post("/v4/spreadsheets/{spreadsheet_id}/values:batchClear")
+async def sheets_values_batch_clear(spreadsheet_id: str, request: Request):
+    sheet = fake.sheets.get(spreadsheet_id)
+    if sheet is None:
+        return error(404, f"Requested entity was not found: {spreadsheet_id}")
+    body = await request.json()
+    for a1 in body.get("ranges", []):
+        tab, row, col, end_row, end_col = parse_range(a1)
+        sheet.cells = {(t, r, c): v for (t, r, c), v in sheet.cells.items()
+                       if not (t == tab and r >= row and c >= col
+                               and (end_row is None or r <= end_row) and (end_col is None or c <= end_col))}
+    sheet.version += 1
+    fake.record_change(spreadsheet_id, request)
+    return {"spreadsheetId": spreadsheet_id, "clearedRanges": body.get("ranges", [])}
+
+@app.put("/v4/spreadsheets/{spreadsheet_id}/values/{a1}")
+async def sheets_values_update(spreadsheet_id: str, a1: str, request: Request):
+    sheet = fake.sheets.get(spreadsheet_id)
+    if sheet is None:
+        return error(404, f"Requested entity was not found: {spreadsheet_id}")
+    body = await request.json()
+    result = write_values(sheet, unquote(a1), body.get("values", []), body.get("majorDimension", "ROWS"))
+    fake.record_change(spreadsheet_id, request)
+    return result
+
+@app.get("/v4/spreadsheets/{spreadsheet_id}/values/{a1}")
+async def sheets_values_get(spreadsheet_id: str, a1: str):
+    sheet = fake.sheets.get(spreadsheet_id)
+    if sheet is None:
+        return error(404, f"Requested entity was not found: {spreadsheet_id}")
+    a1 = unquote(a1)
+    tab, row, col, end_row, end_col = parse_range(a1)
+    cells = [(r, c, v) for (t, r, c), v in sheet.cells.items() if t == tab and r >= row and c >= col
+             and (end_row is None or r <= end_row) and (end_col is None or c <= end_col)]
+    if not cells:
+        return {"range": a1, "majorDimension": "ROWS"}
+    rows = max(r for r, _, _ in cells) - row + 1
+    cols = max(c for _, c, _ in cells) - col + 1
+    grid = [[""] * cols for _ in range(rows)]
+    for r, c, v in cells:
+        grid[r - row][c - col] = v
+    # Sheets omits trailing empty cells
+    values = []
+    for line in grid:
+        while line and line[-1] == "":
+            line.pop()
+        values.append(line)
+    return {"range": a1, "majorDimension": "ROWS", "values": values}
+
+
+
+# ----------------------------
+# Drive v3
+# ----------------------------
+@app.get("/drive/v3/files/{file_id}")
+async def drive_files_get(file_id: str, request: Request):
+    file = fake.drive_file(file_id, request.headers.get("authorization", ""))
+    if file is None:
+        return error(404, f"File not found: {file_id}")
+    return file
+
+@app.post("/drive/v3/files/{file_id}/copy")
+async def drive_files_copy(file_id: str, request: Request):
+    body = await request.json()
+    doc = fake.docs.get(file_id)
+    if doc is not None:
+        copy = FakeDoc(fake.new_id("doc"), body.get("name") or f"Copy of {doc.title}")
+        copy.text = doc.text
+        fake.docs[copy.doc_id] = copy
+        new_id = copy.doc_id
+    else:
+        sheet = fake.sheets.get(file_id)
+        if sheet is None:
+            return error(404, f"File not found: {file_id}")
+        copy = FakeSheet(fake.new_id("sheet"), body.get("name") or f"Copy of {sheet.title}")
+        copy.cells = dict(sheet.cells)
+        fake.sheets[copy.sheet_id] = copy
+        new_id = copy.sheet_id
+    fake.record_change(new_id, request)
+    file = fake.drive_file(new_id, request.headers.get("authorization", ""))
+    file["parents"] = body.get("parents", ["root"])
+    return file
+
+@app.get("/drive/v3/changes/startPageToken")
+async def drive_changes_start_page_token():
+    return {"kind": "drive#startPageToken", "startPageToken": str(len(fake.changes) + 1)}
+
+@app.get("/drive/v3/changes")
+async def drive_changes_list(request: Request, pageToken: str, pageSize: int = 100):
+    try:
+        start = int(pageToken) - 1
+    except ValueError:
+        return error(400, f"Invalid value for pageToken: {pageToken}")
+    if not 0 <= start <= len(fake.changes):
+        return error(400, f"Invalid value for pageToken: {pageToken}")
+    token = request.headers.get("authorization", "")
+    end = min(start + max(1, min(pageSize, 1000)), len(fake.changes))
+    changes = [{"kind": "drive#change", "changeType": "file", "removed": False,
+                "file": fake.drive_file(c["fileId"], token), **c} for c in fake.changes[start:end]]
+    page = {"kind": "drive#changeList", "changes": changes}
+    if end < len(fake.changes):
+        page["nextPageToken"] = str(end + 1)
+    else:
+        page["newStartPageToken"] = str(end + 1)
+    return page
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=int(os.environ.get("PORT", "8765")))
@@ -0,0 +1,43 @@
+"""
+Opt-in orjson fast path for request and response bodies
+With FAST_JSON=1 (and orjson installed) request bodies are parsed with
+orjson.loads and responses are rendered with orjson.dumps instead of the
+standard-library json module; bench_json.py measures the difference
+"""
+
+import os
+
+from fastapi import Request
+from fastapi.routing import APIRoute
+
+try:
+    import orjson
+except ImportError:  # stdlib json only
+    orjson = None
+
+FAST_JSON = orjson is not None and os.environ.get("FAST_JSON", "0").lower() in ("1", "true", "yes")
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONRequest(Request):
+    async def json(self):
+        if not hasattr(self, "_json"):
+            # orjson.JSONDecodeError subclasses json.JSONDecodeError, so FastAPI
+            # still answers malformed bodies with a 422
+            self._json = orjson.loads(await self.body())
+        return self._json
+
+
+class FastJSONRoute(APIRoute):
+    """Route class whose handlers see a FastJSONRequest"""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def fast_json_handler(request: Request):
+            return await handler(FastJSONRequest(request.scope, request.receive))
+
+        return fast_json_handler
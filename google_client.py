@@ -0,0 +1,248 @@
+"""
+Google Docs/Sheets/Drive REST clients used by the bridge endpoints
+AsyncGoogleClient issues calls over one shared pooled httpx client;
+ThreadedGoogleClient runs the discovery-based googleapiclient calls in the threadpool
+"""
+
+import json
+import os
+import re
+import time
+from abc import ABC, abstractmethod
+from urllib.parse import quote
+
+from starlette.concurrency import run_in_threadpool
+from googleapiclient.errors import HttpError
+
+from fast_json import FAST_JSON, dumps as fast_dumps, orjson
+from metrics import google_seconds, phase, record_phase
+from outbound import scheduler
+from service_cache import APIS, get_discovery_doc, service_cache
+
+try:
+    import httpx
+except ImportError:  # threaded fallback only
+    httpx = None
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+API_VERSIONS = dict(APIS)
+
+# Point every API at another host, e.g. a local fake server
+GOOGLE_API_BASE_URL = os.environ.get("GOOGLE_API_BASE_URL")
+
+# Called with the file id after every write attempt, e.g. to drop cached reads
+write_listeners = []
+FILE_ID_PARAMS = ("documentId", "spreadsheetId", "fileId")
+
+
+class GoogleAPIError(Exception):
+    def __init__(self, status: int, message: str, retry_after: float = None, payload=None):
+        super().__init__(f"Google API error {status}: {message}")
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+        self.payload = payload
+
+
+class GoogleTransportError(GoogleAPIError):
+    """Connection-level failure; sent=False means the request never reached Google"""
+
+    def __init__(self, message: str, sent: bool = True):
+        super().__init__(503, message)
+        self.sent = sent
+
+
+def _retry_after(value):
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+# ----------------------------
+# Discovery-driven URL building
+# ----------------------------
+_PATH_PARAM = re.compile(r"\{(\+?)([A-Za-z0-9_]+)\}")
+_method_specs = {}
+
+
+def method_spec(api: str, method: str) -> dict:
+    """HTTP verb, URL template and parameter locations for e.g. ("sheets", "spreadsheets.values.update")"""
+    key = (api, method)
+    spec = _method_specs.get(key)
+    if spec is not None:
+        return spec
+
+    doc = json.loads(get_discovery_doc(api, API_VERSIONS[api]))
+    *resources, name = method.split(".")
+    node = doc
+    for resource in resources:
+        node = node["resources"][resource]
+    m = node["methods"][name]
+
+    root = GOOGLE_API_BASE_URL.rstrip("/") + "/" if GOOGLE_API_BASE_URL else doc["rootUrl"]
+    spec = {
+        "http_method": m["httpMethod"],
+        "url": root + doc["servicePath"] + m["path"],
+        "path_params": {p for p, d in m.get("parameters", {}).items() if d.get("location") == "path"},
+    }
+    _method_specs[key] = spec
+    return spec
+
+
+def build_url(spec: dict, params: dict) -> str:
+    def expand(match):
+        reserved, name = match.groups()
+        return quote(str(params[name]), safe="/" if reserved else "")
+    return _PATH_PARAM.sub(expand, spec["url"])
+
+
+def _query_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value
+
+
+# ----------------------------
+# Clients
+# ----------------------------
+class GoogleClient(ABC):
+    """
+    call(api, method, body=None, **params) mirrors the discovery method names,
+    e.g. call("docs", "documents.batchUpdate", documentId=..., body=...).
+    body may also be JSON that is already serialized to bytes.
+    Every call goes through the outbound scheduler for rate limiting and retries.
+    """
+
+    def __init__(self, creds, user: str = "default"):
+        self.creds = creds
+        self.user = user
+
+    async def call(self, api: str, method: str, body=None, **params) -> dict:
+        spec = method_spec(api, method)
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await scheduler.run(
+                api, method, spec["http_method"], self.user,
+                lambda timeout: self._send(spec, api, method, body, params, timeout),
+            )
+        except Exception as e:
+            outcome = str(getattr(e, "status", None) or type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            google_seconds.observe(elapsed, api, method, outcome)
+            record_phase("google", elapsed)
+            # A failed write may still have been applied, so notify either way
+            if spec["http_method"] != "GET" and write_listeners:
+                for name in FILE_ID_PARAMS:
+                    if params.get(name):
+                        for listener in write_listeners:
+                            listener(params[name])
+
+    @abstractmethod
+    async def _send(self, spec, api, method, body, params, timeout) -> dict:
+        """Make one attempt at the request; the scheduler decides whether to retry"""
+
+
+class AsyncGoogleClient(GoogleClient):
+    def __init__(self, creds, http: "httpx.AsyncClient", user: str = "default"):
+        super().__init__(creds, user)
+        self.http = http
+
+    async def _send(self, spec, api, method, body, params, timeout) -> dict:
+        url = build_url(spec, params)
+        query = {k: _query_value(v) for k, v in params.items() if k not in spec["path_params"]}
+        headers = {"Authorization": f"Bearer {self.creds.token}"}
+        if FAST_JSON and body is not None and not isinstance(body, (bytes, bytearray)):
+            body = fast_dumps(body)
+        if isinstance(body, (bytes, bytearray)):
+            content, body = body, None
+            headers["Content-Type"] = "application/json"
+        else:
+            content = None
+        try:
+            response = await self.http.request(
+                spec["http_method"],
+                url,
+                params=query,
+                json=body,
+                content=content,
+                headers=headers,
+                timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+            )
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+            raise GoogleTransportError(f"{type(e).__name__}: {e}", sent=False)
+        except httpx.TransportError as e:
+            raise GoogleTransportError(f"{type(e).__name__}: {e}")
+        if response.status_code >= 400:
+            try:
+                payload = response.json()
+                message = payload.get("error", {}).get("message", response.text)
+            except ValueError:
+                payload, message = None, response.text
+            raise GoogleAPIError(
+                response.status_code, message,
+                retry_after=_retry_after(response.headers.get("retry-after")),
+                payload=payload,
+            )
+        if not response.content:
+            return {}
+        return orjson.loads(response.content) if FAST_JSON else response.json()
+
+
+class ThreadedGoogleClient(GoogleClient):
+    """Fallback that runs the blocking googleapiclient request in Starlette's threadpool"""
+
+    async def _send(self, spec, api, method, body, params, timeout) -> dict:
+        return await run_in_threadpool(self._execute, api, method, body, params)
+
+    def _execute(self, api, method, body, params):
+        with phase("build"):
+            node = service_cache.get(api, API_VERSIONS[api], self.creds)
+        *resources, name = method.split(".")
+        for resource in resources:
+            node = getattr(node, resource)()
+        if isinstance(body, (bytes, bytearray)):
+            body = json.loads(body)
+        if body is not None:
+            params = dict(params, body=body)
+        try:
+            return getattr(node, name)(**params).execute()
+        except HttpError as e:
+            try:
+                payload = json.loads(e.content)
+                message = payload.get("error", {}).get("message", str(e))
+            except ValueError:
+                payload, message = None, str(e)
+            raise GoogleAPIError(
+                int(e.resp.status), message,
+                retry_after=_retry_after(e.resp.get("retry-after")),
+                payload=payload,
+            )
+        except OSError as e:
+            raise GoogleTransportError(f"{type(e).__name__}: {e}")
+
+
+def use_async_backend() -> bool:
+    """GOOGLE_HTTP_BACKEND=threaded forces the googleapiclient fallback"""
+    return httpx is not None and os.environ.get("GOOGLE_HTTP_BACKEND", "async") != "threaded"
+
+
+def open_http_client(transport=None) -> "httpx.AsyncClient":
+    """One keep-alive pool shared by every request for the app's lifetime"""
+    return httpx.AsyncClient(
+        http2=HTTP2_AVAILABLE and transport is None,
+        transport=transport,
+        limits=httpx.Limits(
+            max_connections=int(os.environ.get("GOOGLE_HTTP_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.environ.get("GOOGLE_HTTP_MAX_KEEPALIVE", "20")),
+        ),
+        timeout=httpx.Timeout(60.0, connect=10.0),
+    )
@@ -0,0 +1,107 @@
+"""
+Idempotency-Key support for create endpoints
+The first successful response for each key is kept in shared_state for
+IDEMPOTENCY_TTL_SECONDS, so a retry is replayed whichever worker it reaches;
+concurrent duplicates wait on the in-flight request instead of creating a
+second file
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+
+from shared_state import SharedState, shared_state
+
+IDEMPOTENCY_TTL = float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+# How long a worker's claim on a key lasts while it produces the response
+IDEMPOTENCY_CLAIM_SECONDS = float(os.environ.get("IDEMPOTENCY_CLAIM_SECONDS", "60"))
+# How often a duplicate checks whether another worker has finished
+IDEMPOTENCY_POLL_SECONDS = 0.1
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used with a different request body"""
+
+
+def request_fingerprint(payload) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class IdempotencyCache:
+    def __init__(self, state: SharedState, ttl: float = IDEMPOTENCY_TTL,
+                 claim_seconds: float = IDEMPOTENCY_CLAIM_SECONDS):
+        self.state = state
+        self.ttl = ttl
+        self.claim_seconds = claim_seconds
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.joined = 0
+
+    async def run(self, key: str, fingerprint: str, produce, cacheable=lambda body: True):
+        """
+        Return (body, replayed). produce() is awaited at most once per key while
+        its result is cached; failures and non-cacheable bodies are not stored so
+        the client can retry them.
+        """
+        # Duplicates within this worker share one future without touching the backend
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            if inflight[0] != fingerprint:
+                raise IdempotencyConflict(key)
+            self.joined += 1
+            return await asyncio.shield(inflight[1]), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (fingerprint, future)
+        try:
+            body, replayed = await self._run_once(key, fingerprint, produce, cacheable)
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody may be waiting; don't log "exception was never retrieved"
+            future.exception()
+            raise
+        else:
+            future.set_result(body)
+            return body, replayed
+        finally:
+            del self._inflight[key]
+
+    async def _run_once(self, key: str, fingerprint: str, produce, cacheable):
+        claim = json.dumps({"fingerprint": fingerprint, "pending": True})
+        waited = False
+        while not await self.state.add(key, claim, self.claim_seconds):
+            stored = await self.state.get(key)
+            if stored is None:
+                continue  # expired or released between the two calls
+            entry = json.loads(stored)
+            if entry["fingerprint"] != fingerprint:
+                raise IdempotencyConflict(key)
+            if not entry.get("pending"):
+                self.hits += 1
+                return entry["body"], True
+            # Another worker is producing it; a failure there releases the claim
+            if not waited:
+                self.joined += 1
+                waited = True
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+        self.misses += 1
+        try:
+            body = await produce()
+        except BaseException:
+            await self.state.delete(key, claim)
+            raise
+        if cacheable(body):
+            await self.state.set(key, json.dumps({"fingerprint": fingerprint, "body": body}), self.ttl)
+        else:
+            await self.state.delete(key, claim)
+        return body, False
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "joined": self.joined,
+                "in_flight": len(self._inflight), "backend": self.state.name}
+
+
+idempotency_cache = IdempotencyCache(shared_state)
@@ -0,0 +1,250 @@
+"""
+Background jobs for long-running Google work
+Jobs are persisted in SQLite, run by a pool of asyncio workers with global and
+per-tenant concurrency limits, and resumed from their last checkpoint after a restart.
+A lease in shared_state keeps two worker processes from running the same job.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from shared_state import MemoryState, SharedState
+
+JOB_DB = os.environ.get("JOB_DB", "jobs.db")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_TENANT_CONCURRENCY = int(os.environ.get("JOB_TENANT_CONCURRENCY", "2"))
+# How often an event stream rereads a job that another worker is running
+JOB_EVENTS_POLL_SECONDS = 1.0
+# A running job's lease is renewed every third of this; a dead worker's job is picked up after it lapses
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "60"))
+
+TERMINAL_STATES = ("done", "failed")
+
+
+class Job:
+    __slots__ = ("id", "tenant", "kind", "params", "state", "progress", "result", "error",
+                 "created_at", "updated_at")
+
+    def __init__(self, id, tenant, kind, params, state="queued", progress=None, result=None,
+                 error=None, created_at=None, updated_at=None):
+        self.id = id
+        self.tenant = tenant
+        self.kind = kind
+        self.params = params
+        self.state = state
+        self.progress = progress or {}
+        self.result = result
+        self.error = error
+        self.created_at = created_at or time.time()
+        self.updated_at = updated_at or self.created_at
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class JobStore:
+    _COLUMNS = "id, tenant, kind, params, state, progress, result, error, created_at, updated_at"
+
+    def __init__(self, path: str = JOB_DB):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, tenant TEXT NOT NULL, kind TEXT NOT NULL, params TEXT NOT NULL, "
+            "state TEXT NOT NULL, progress TEXT NOT NULL, result TEXT, error TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _row_to_job(self, row) -> Job:
+        return Job(
+            row[0], row[1], row[2], json.loads(row[3]), row[4], json.loads(row[5]),
+            json.loads(row[6]) if row[6] is not None else None, row[7], row[8], row[9],
+        )
+
+    def insert(self, job: Job):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                f"INSERT INTO jobs ({self._COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.tenant, job.kind, json.dumps(job.params), job.state,
+                 json.dumps(job.progress), None, None, job.created_at, job.updated_at),
+            )
+
+    def save(self, job: Job):
+        job.updated_at = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, progress = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                (job.state, json.dumps(job.progress),
+                 json.dumps(job.result) if job.result is not None else None,
+                 job.error, job.updated_at, job.id),
+            )
+
+    def get(self, job_id: str):
+        row = self._conn().execute(f"SELECT {self._COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def unfinished(self) -> list:
+        rows = self._conn().execute(
+            f"SELECT {self._COLUMNS} FROM jobs WHERE state IN ('queued', 'running') ORDER BY created_at"
+        ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+
+class JobRunner:
+    """
+    handlers maps a job kind to `async def handler(job, report)`; report(**progress)
+    checkpoints progress so a restarted job can pick up where it left off.
+    """
+
+    def __init__(self, store: JobStore, handlers: dict, workers: int = JOB_WORKERS,
+                 tenant_concurrency: int = JOB_TENANT_CONCURRENCY, state: SharedState = None):
+        self.store = store
+        self.state = state if state is not None else MemoryState()
+        self.owner = uuid.uuid4().hex
+        self.handlers = handlers
+        self.workers = workers
+        self.tenant_concurrency = tenant_concurrency
+        self._queue = None
+        self._tasks = []
+        self._tenant_slots = {}
+        self._subscribers = {}
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        for job in self.store.unfinished():
+            self._queue.put_nowait(job.id)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def submit(self, tenant: str, kind: str, params: dict) -> Job:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job = Job(uuid.uuid4().hex, tenant, kind, params)
+        self.store.insert(job)
+        self._queue.put_nowait(job.id)
+        return job
+
+    def get(self, job_id: str):
+        return self.store.get(job_id)
+
+    async def events(self, job_id: str):
+        """Yield job snapshots as they change until the job finishes"""
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        try:
+            job = self.store.get(job_id)
+            while job is not None:
+                yield job.to_dict()
+                if job.state in TERMINAL_STATES:
+                    return
+                seen = job.updated_at
+                while True:
+                    try:
+                        job = await asyncio.wait_for(queue.get(), JOB_EVENTS_POLL_SECONDS)
+                        break
+                    except asyncio.TimeoutError:
+                        # Run by another worker process: only the store sees its progress
+                        job = self.store.get(job_id)
+                        if job is None or job.updated_at != seen:
+                            break
+        finally:
+            subscribers = self._subscribers.get(job_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[job_id]
+
+    def _publish(self, job: Job):
+        self.store.save(job)
+        for queue in self._subscribers.get(job.id, ()):
+            queue.put_nowait(job)
+
+    def _slots(self, tenant: str) -> asyncio.Semaphore:
+        slots = self._tenant_slots.get(tenant)
+        if slots is None:
+            slots = self._tenant_slots[tenant] = asyncio.Semaphore(self.tenant_concurrency)
+        return slots
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self.store.get(job_id)
+            if job is None or job.state in TERMINAL_STATES:
+                continue
+            slots = self._slots(job.tenant)
+            if slots.locked():
+                # Tenant is at its limit; let other tenants' jobs go first
+                self._queue.put_nowait(job_id)
+                await asyncio.sleep(0.1)
+                continue
+            lease = f"job:{job_id}"
+            if not await self.state.add(lease, self.owner, JOB_LEASE_SECONDS):
+                # Another worker process has it; look again once its lease could have lapsed
+                asyncio.get_running_loop().call_later(JOB_LEASE_SECONDS, self._queue.put_nowait, job_id)
+                continue
+            renew = asyncio.create_task(self._renew(lease))
+            try:
+                async with slots:
+                    job = self.store.get(job_id)
+                    if job is not None and job.state not in TERMINAL_STATES:
+                        await self._run(job)
+            finally:
+                renew.cancel()
+                await self.state.delete(lease, self.owner)
+
+    async def _renew(self, lease: str):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            await self.state.set(lease, self.owner, JOB_LEASE_SECONDS)
+
+    async def _run(self, job: Job):
+        job.state = "running"
+        job.error = None
+        self._publish(job)
+
+        def report(**progress):
+            job.progress.update(progress)
+            self._publish(job)
+
+        try:
+            job.result = await self.handlers[job.kind](job, report)
+            job.state = "done"
+        except asyncio.CancelledError:
+            # Shutting down: leave it "running" so the next start resumes it
+            raise
+        except Exception as e:
+            job.state = "failed"
+            job.error = str(e)
+        self._publish(job)
@@ -4,16 +4,60 @@ Complete Google Drive Bridge - Full API service with OAuth
 Handles Google Drive integration directly without external dependencies
 """
 
-from fastapi import FastAPI, Request
-from pydantic import BaseModel
+from fastapi import FastAPI, Request, Response, Depends, Header, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError
+from typing import List, Optional
+import anyio
+import asyncio
+import base64
+import contextlib
+import hashlib
+import hmac
+import json
 import os
+import time
 
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request as GoogleRequest
 
-app = FastAPI()
+from bulk_loader import (
+    SheetLoader, a1_cell, chunk_rows, iter_csv_rows, iter_ndjson_rows, iter_rows, parse_a1, uploads
+)
+from coalescer import coalescer, submit_doc_requests, submit_values
+from columnar import ColumnLoader, decode_columns
+from compression import CompressionMiddleware
+from doc_builder import parse_markdown, validate_blocks, write_blocks
+from doc_index import NEW_DOC_END_INDEX, doc_index_cache, utf16_len
+from doc_render import DOC_RENDER_MAX_BYTES, BodyTooLarge, capped, read_ndjson_records, render_all
+from drive_changes import ChangeFeed, ChangeTokenStore
+from fast_json import FAST_JSON, FastJSONRoute, dumps as fast_dumps
+from credential_store import CredentialStore, DEFAULT_TENANT, token_store_from_env
+from google_client import (
+    AsyncGoogleClient, ThreadedGoogleClient, GoogleAPIError, open_http_client, use_async_backend,
+    write_listeners
+)
+from idempotency import IdempotencyConflict, idempotency_cache, request_fingerprint
+from jobs import JobRunner, JobStore
+from metrics import MetricsMiddleware, phase, registry
+from read_cache import document_text, drive_version, etag_matches, make_etag, read_cache
+from outbound import DeadlineExceeded, scheduler, start_request_deadline, deadline_var
+from service_cache import service_cache, load_discovery_docs
+from shared_state import shared_state
+from sheet_sync import SheetSyncer, SyncStore
+
+class TimedJSONResponse(JSONResponse):
+    """Default response class; times body serialization for Server-Timing"""
+
+    def render(self, content) -> bytes:
+        with phase("serialize"):
+            return fast_dumps(content) if FAST_JSON else super().render(content)
+
+app = FastAPI(default_response_class=TimedJSONResponse)
+if FAST_JSON:
+    # Must be set before any route is declared
+    app.router.route_class = FastJSONRoute
 
 SCOPES = [
     "https://www.googleapis.com/auth/spreadsheets",
@@ -23,6 +67,8 @@ SCOPES = [
 ]
 REDIRECT_URI = "https://my-google-bridge-1b5a7ab10d6b.herokuapp.com/oauth2callback"
 TOKEN_FILE = "token.json"
+# How long an /auth link stays usable
+OAUTH_STATE_TTL = int(os.environ.get("OAUTH_STATE_TTL", "600"))
 
 
 # ----------------------------
@@ -38,45 +84,232 @@ class AppendRequest(BaseModel):
     doc_id: str
     text: str
 
+class BuildDocRequest(BaseModel):
+    doc_id: Optional[str] = None  # a new document named `name` when omitted
+    name: Optional[str] = None
+    markdown: Optional[str] = None
+    blocks: Optional[List[dict]] = None  # heading | paragraph | list | table blocks, see doc_builder
+
+class RenderRequest(BaseModel):
+    template_id: str
+    records: List[dict]  # {{key}} in the template is replaced with record[key]
+    title: Optional[str] = None  # may use placeholders too; Drive's "Copy of ..." when omitted
+    folder_id: Optional[str] = None
+
 class PopulateSheetRequest(BaseModel):
     sheet_id: str
     values: list  # 2D array of rows
+    range: str = "A1"
+    mode: str = "overwrite"  # overwrite | sync (write only what changed since the last sync)
+
+class BatchOperation(BaseModel):
+    op: str  # append_text_doc | populate_google_sheet | doc_requests
+    doc_id: Optional[str] = None
+    sheet_id: Optional[str] = None
+    text: Optional[str] = None
+    values: Optional[list] = None
+    range: str = "A1"
+    requests: Optional[list] = None  # raw Docs API requests for doc_requests
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation]
+
+class CreateSheetJobParams(SheetRequest):
+    values: list  # 2D array of rows
+    range: str = "A1"
+
+class CreateDocJobParams(DocRequest):
+    paragraphs: List[str]
+
+class JobRequest(BaseModel):
+    kind: str  # populate_google_sheet | create_sheet_and_populate | create_doc_with_text
+    params: dict  # validated against JOB_PARAMS[kind]
 
 
 # ----------------------------
 # Helpers
 # ----------------------------
-def save_credentials(creds: Credentials):
-    with open(TOKEN_FILE, "w") as f:
-        f.write(creds.to_json())
+credential_store = CredentialStore(token_store_from_env(TOKEN_FILE), SCOPES)
+sheet_syncer = SheetSyncer(SyncStore())
+write_listeners.append(read_cache.invalidate)
 
-def load_credentials() -> Credentials:
-    if not os.path.exists(TOKEN_FILE):
-        return None
+def validation_message(error: ValidationError) -> str:
+    """One line per bad field instead of pydantic's full report"""
+    return "; ".join(f"{'.'.join(str(part) for part in e['loc']) or 'body'}: {e['msg']}" for e in error.errors())
+
+async def get_tenant(request: Request) -> str:
+    """Callers identify their Google account with X-API-Key; no key means the default tenant"""
+    api_key = request.headers.get("x-api-key")
+    if not api_key:
+        return DEFAULT_TENANT
+    return "k" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:32]
+
+def _state_secret() -> bytes:
+    secret = os.environ.get("OAUTH_STATE_SECRET") or os.environ.get("GOOGLE_OAUTH_CLIENT_SECRET", "")
+    return secret.encode("utf-8")
+
+def sign_state(tenant: str, issued_at: int = None) -> str:
+    payload = base64.urlsafe_b64encode(tenant.encode("utf-8")).decode("ascii").rstrip("=")
+    payload += f".{int(time.time()) if issued_at is None else issued_at}"
+    sig = hmac.new(_state_secret(), payload.encode("ascii"), hashlib.sha256).hexdigest()[:32]
+    return f"{payload}.{sig}"
+
+def verify_state(state: str) -> str:
+    """Return the tenant an OAuth state was issued for, or None if it was tampered with or expired"""
+    payload, _, sig = state.rpartition(".")
     try:
-        creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(GoogleRequest())
-            save_credentials(creds)
-        return creds
-    except Exception as e:
-        # Scope mismatch or invalid token → reset
-        if os.path.exists(TOKEN_FILE):
-            os.remove(TOKEN_FILE)
-        print(f"⚠️ Token invalid or scope mismatch, deleted token.json: {str(e)}")
+        expected = hmac.new(_state_secret(), payload.encode("ascii"), hashlib.sha256).hexdigest()[:32]
+        if not hmac.compare_digest(sig.encode("ascii"), expected.encode("ascii")):
+            return None
+        tenant, _, issued_at = payload.partition(".")
+        if time.time() - int(issued_at) > OAUTH_STATE_TTL:
+            return None
+        padded = tenant + "=" * (-len(tenant) % 4)
+        return base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8")
+    except ValueError:
         return None
 
-def get_docs_service():
-    creds = load_credentials()
-    if not creds:
-        return None
-    return build("docs", "v1", credentials=creds)
+def save_credentials(creds: Credentials, tenant: str = DEFAULT_TENANT):
+    credential_store.save(tenant, creds)
 
-def get_sheets_service():
-    creds = load_credentials()
+def load_credentials(tenant: str = DEFAULT_TENANT) -> Credentials:
+    return credential_store.get(tenant)
+
+async def get_google_client(tenant: str = DEFAULT_TENANT):
+    # Cached, unexpired credentials need no I/O; anything else may hit the
+    # token backend or refresh, so it goes to the threadpool
+    with phase("creds"):
+        creds = credential_store.peek(tenant)
+        if creds is None:
+            creds = await run_in_threadpool(load_credentials, tenant)
     if not creds:
         return None
-    return build("sheets", "v4", credentials=creds)
+    if use_async_backend():
+        return AsyncGoogleClient(creds, app.state.http, user=tenant)
+    return ThreadedGoogleClient(creds, user=tenant)
+
+def append_text_requests(text: str) -> list:
+    # endOfSegmentLocation appends without needing to know where the body ends
+    return [{
+        "insertText": {
+            "endOfSegmentLocation": {},
+            "text": text + "\n"
+        }
+    }]
+
+async def cached_read(request: Request, client, key: tuple, file_id: str, fetch, render):
+    """
+    Serve a read from read_cache: 304 when the client's ETag is still current,
+    otherwise render(body) from the cached or freshly fetched body
+    """
+    # Another worker's writes reach this one's feed only on its next poll, so
+    # with several workers every read is checked against Drive
+    trusted_since = None if shared_state.multi_process else change_feed.trusted_since(key[0])
+    version = await read_cache.version(key, lambda: drive_version(client, file_id), trusted_since=trusted_since)
+    etag = make_etag(file_id, version, repr(key[2:]))
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        read_cache.not_modified += 1
+        return Response(status_code=304, headers=headers)
+    body = await read_cache.get(key, file_id, version, fetch)
+    # Returned as a response so large bodies skip jsonable_encoder
+    return TimedJSONResponse(render(body, version), headers=headers)
+
+async def sync_sheet(client, tenant: str, sheet_id: str, start: str, values: list) -> dict:
+    """
+    sheet_syncer.sync; for a watched tenant the version the sync left the sheet
+    at is recorded, so the changes feed keeps its fingerprints
+    """
+    result = await sheet_syncer.sync(client, tenant, sheet_id, start, values)
+    wrote = result["ranges_written"] or result["rows_deleted"] or result["rows_cleared"]
+    if wrote and change_feed.watching(tenant):
+        try:
+            await change_feed.record_own_write(tenant, sheet_id, await drive_version(client, sheet_id))
+        except (GoogleAPIError, DeadlineExceeded) as e:
+            # Unrecorded, the change counts as an outside edit and the next sync rewrites the sheet
+            print(f"⚠️ Could not record the version of {sheet_id} after a sync: {e}")
+    return result
+
+@contextlib.asynccontextmanager
+async def overwriting_sheet(tenant: str, sheet_id: str):
+    """
+    Any write other than a sync leaves the sync fingerprints describing cells
+    that may have changed; drop them however the write ends
+    """
+    try:
+        yield
+    finally:
+        await sheet_syncer.forget(tenant, sheet_id)
+
+def auth_error():
+    return {"status": "error", "auth_url": f"{REDIRECT_URI.replace('/oauth2callback','/auth')}"}
+
+async def run_idempotent(response: Response, key: Optional[str], tenant: str, endpoint: str,
+                         payload: dict, produce):
+    """Serve retries that carry the same Idempotency-Key from the first successful response"""
+    if not key:
+        return await produce()
+    try:
+        body, replayed = await idempotency_cache.run(
+            f"{tenant}:{endpoint}:{key}", request_fingerprint(payload), produce,
+            cacheable=lambda body: body.get("status") in ("success", "accepted"),
+        )
+    except IdempotencyConflict:
+        return JSONResponse(status_code=422, content={
+            "status": "error", "message": "Idempotency-Key was already used with a different request body"
+        })
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return body
+
+
+# ----------------------------
+# Lifecycle
+# ----------------------------
+@app.on_event("startup")
+async def startup():
+    # Parse the bundled discovery documents once instead of on every request
+    load_discovery_docs()
+    app.state.http = open_http_client() if use_async_backend() else None
+    app.state.token_refresher = asyncio.create_task(credential_store.refresh_forever())
+    await job_runner.start()
+    await change_feed.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.token_refresher.cancel()
+    await job_runner.stop()
+    await change_feed.stop()
+    if app.state.http is not None:
+        await app.state.http.aclose()
+    await shared_state.close()
+
+# Innermost: handlers read decompressed bodies, and responses are compressed
+# before the deadline middleware re-streams them
+app.add_middleware(CompressionMiddleware)
+
+@app.middleware("http")
+async def google_deadline(request: Request, call_next):
+    # Google calls made while handling this request share one deadline
+    token = start_request_deadline()
+    try:
+        return await call_next(request)
+    finally:
+        deadline_var.reset(token)
+
+# Outermost, so its timings include the other middleware
+app.add_middleware(MetricsMiddleware)
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"status": "error", "message": exc.message})
+
+@app.exception_handler(GoogleAPIError)
+async def google_api_error(request: Request, exc: GoogleAPIError):
+    return JSONResponse(
+        status_code=exc.status if exc.status >= 400 else 502,
+        content={"status": "error", "message": exc.message, "google_status": exc.status},
+    )
 
 
 # ----------------------------
@@ -92,12 +325,81 @@ def root():
             "create_doc_chat": "POST /create_doc_chat",
             "append_text_doc": "POST /append_text_doc",
             "create_sheet_chat": "POST /create_sheet_chat",
-            "populate_google_sheet": "POST /populate_google_sheet"
+            "populate_google_sheet": "POST /populate_google_sheet",
+            "populate_google_sheet_stream": "POST /populate_google_sheet/stream",
+            "populate_google_sheet_columns": "POST /populate_google_sheet/columns",
+            "build_doc": "POST /build_doc",
+            "render_docs": "POST /docs/render",
+            "read_doc": "GET /docs/{doc_id}",
+            "read_sheet_values": "GET /sheets/{sheet_id}/values?range=",
+            "drive_changes": "POST /changes/watch, GET /changes/events, POST /changes/poll",
+            "upload_progress": "GET /uploads/{upload_id}",
+            "batch": "POST /batch",
+            "jobs": "POST /jobs",
+            "job_status": "GET /jobs/{job_id}",
+            "job_events": "GET /jobs/{job_id}/events",
+            "stats": "GET /stats",
+            "metrics": "GET /metrics"
         }
     }
 
+@app.get("/stats")
+def stats():
+    return {
+        "service_cache": service_cache.stats(),
+        "credential_cache": {
+            "hits": credential_store.hits,
+            "misses": credential_store.misses,
+            "tenants": len(credential_store.tenants()),
+        },
+        "token_refreshes": credential_store.refreshes,
+        "coalescer": coalescer.stats(),
+        "outbound": scheduler.stats(),
+        "idempotency": idempotency_cache.stats(),
+        "doc_index_cache": doc_index_cache.stats(),
+        "sheet_sync": sheet_syncer.stats(),
+        "read_cache": read_cache.stats(),
+        "drive_changes": change_feed.stats(),
+        # Counters above are this worker's; each process keeps its own
+        "worker": {"pid": os.getpid(), "shared_state": shared_state.name},
+    }
+
+def threadpool_usage() -> dict:
+    # The limiter is per event loop, so this must be read from the loop thread
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    return {"busy": limiter.borrowed_tokens, "capacity": limiter.total_tokens}
+
+def cache_counts() -> dict:
+    counts = {}
+    for name, cache_stats in (
+        ("service", service_cache.stats()),
+        ("credential", {"hits": credential_store.hits, "misses": credential_store.misses}),
+        ("doc_index", doc_index_cache.stats()),
+        ("idempotency", idempotency_cache.stats()),
+        ("read", read_cache.stats()),
+    ):
+        counts[(name, "hit")] = cache_stats["hits"]
+        counts[(name, "miss")] = cache_stats["misses"]
+    return counts
+
+registry.callback("bridge_threadpool_threads", "Starlette threadpool tokens in use and available",
+                  "gauge", threadpool_usage, ("state",))
+registry.callback("bridge_token_refreshes_total", "OAuth token refreshes",
+                  "counter", lambda: credential_store.refreshes)
+registry.callback("bridge_cache_lookups_total", "Cache lookups by cache and result",
+                  "counter", cache_counts, ("cache", "result"))
+registry.callback("bridge_google_calls_total", "Google calls, retries and throttles seen by the scheduler",
+                  "counter", lambda: {k: v for k, v in scheduler.stats().items() if not k.endswith("_seconds")},
+                  ("kind",))
+registry.callback("bridge_coalesced_writes_total", "Write operations and the Google calls they were merged into",
+                  "counter", lambda: {"ops": coalescer.ops, "calls": coalescer.calls}, ("kind",))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/auth")
-def auth():
+def auth(tenant: str = Depends(get_tenant)):
     # Use Heroku environment variables for OAuth credentials
     client_id = os.environ.get('GOOGLE_OAUTH_CLIENT_ID')
     client_secret = os.environ.get('GOOGLE_OAUTH_CLIENT_SECRET')
@@ -121,12 +423,20 @@ def auth():
     auth_url, _ = flow.authorization_url(
         prompt="consent",
         access_type="offline",
-        include_granted_scopes="true"
+        include_granted_scopes="true",
+        state=sign_state(tenant)
     )
     return {"auth_url": auth_url}
 
 @app.get("/oauth2callback")
 def oauth2callback(request: Request):
+    tenant = DEFAULT_TENANT
+    state = request.query_params.get("state")
+    if state:
+        tenant = verify_state(state)
+        if tenant is None:
+            return {"status": "error", "message": "Invalid OAuth state",
+                    "next_step": "Visit /auth again to re-authorize"}
     try:
         client_id = os.environ.get('GOOGLE_OAUTH_CLIENT_ID')
         client_secret = os.environ.get('GOOGLE_OAUTH_CLIENT_SECRET')
@@ -150,14 +460,13 @@ def oauth2callback(request: Request):
         flow.fetch_token(authorization_response=str(request.url))
 
         creds = flow.credentials
-        save_credentials(creds)
+        save_credentials(creds, tenant)
 
         return {"status": "ok", "message": "Authentication successful! Tokens saved."}
         
     except Exception as e:
         # If scope mismatch or invalid grant → force reset
-        if os.path.exists(TOKEN_FILE):
-            os.remove(TOKEN_FILE)
+        credential_store.clear(tenant)
         return {
             "status": "error",
             "message": f"Authentication failed: {str(e)}",
@@ -169,60 +478,476 @@ def oauth2callback(request: Request):
 # Docs
 # ----------------------------
 @app.post("/create_doc_chat")
-def create_doc_chat(req: DocRequest):
-    service = get_docs_service()
-    if not service:
-        return {"status": "error", "auth_url": f"{REDIRECT_URI.replace('/oauth2callback','/auth')}"}
+async def create_doc_chat(req: DocRequest, response: Response, tenant: str = Depends(get_tenant),
+                          idempotency_key: Optional[str] = Header(None)):
+    client = await get_google_client(tenant)
+    if not client:
+        return auth_error()
+
+    async def create():
+        doc = await client.call("docs", "documents.create", body={"title": req.name})
+        doc_id = doc.get("documentId")
+        if doc.get("revisionId"):
+            doc_index_cache.set((tenant, doc_id), NEW_DOC_END_INDEX, doc["revisionId"])
+        return {"status": "success", "doc_id": doc_id,
+                "link": f"https://docs.google.com/document/d/{doc_id}"}
 
-    doc = service.documents().create(body={"title": req.name}).execute()
-    doc_id = doc.get("documentId")
-    return {"status": "success", "doc_id": doc_id,
-            "link": f"https://docs.google.com/document/d/{doc_id}"}
+    return await run_idempotent(response, idempotency_key, tenant, "create_doc_chat", req.dict(), create)
 
 @app.post("/append_text_doc")
-def append_text_doc(req: AppendRequest):
-    service = get_docs_service()
-    if not service:
-        return {"status": "error", "auth_url": f"{REDIRECT_URI.replace('/oauth2callback','/auth')}"}
+async def append_text_doc(req: AppendRequest, tenant: str = Depends(get_tenant)):
+    client = await get_google_client(tenant)
+    if not client:
+        return auth_error()
 
-    requests_body = [{
-        "insertText": {
-            "location": {"index": 1},
-            "text": req.text + "\n"
-        }
-    }]
-    service.documents().batchUpdate(
-        documentId=req.doc_id, body={"requests": requests_body}
-    ).execute()
+    await submit_doc_requests(client, tenant, req.doc_id, append_text_requests(req.text),
+                              delta=utf16_len(req.text + "\n"))
     return {"status": "success", "doc_id": req.doc_id, "appended_text": req.text}
 
+@app.post("/build_doc")
+async def build_doc(req: BuildDocRequest, tenant: str = Depends(get_tenant)):
+    """Append Markdown or a block tree with headings, lists and tables in a single batchUpdate"""
+    if (req.markdown is None) == (req.blocks is None):
+        return JSONResponse(status_code=400, content={
+            "status": "error", "message": "Send exactly one of markdown or blocks"
+        })
+    try:
+        blocks = validate_blocks(parse_markdown(req.markdown) if req.markdown is not None else req.blocks)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"status": "error", "message": str(e)})
+
+    client = await get_google_client(tenant)
+    if not client:
+        return auth_error()
+
+    doc_id = req.doc_id
+    if not doc_id:
+        doc = await client.call("docs", "documents.create", body={"title": req.name or "Untitled document"})
+        doc_id = doc["documentId"]
+        if doc.get("revisionId"):
+            doc_index_cache.set((tenant, doc_id), NEW_DOC_END_INDEX, doc["revisionId"])
+
+    compiled = await write_blocks(client, tenant, doc_id, blocks, inline=req.markdown is not None)
+    return {"status": "success", "doc_id": doc_id, "link": f"https://docs.google.com/document/d/{doc_id}",
+            "blocks": len(blocks), "requests": len(compiled.requests), "characters_added": compiled.length}
+
+@app.post("/docs/render")
+async def render_docs(request: Request, tenant: str = Depends(get_tenant)):
+    """
+    One document per record from a template. The body is a RenderRequest, or
+    NDJSON records with template_id, title and folder_id as query params. The
+    response streams one NDJSON result line per record as each finishes.
+    """
+    client = await get_google_client(tenant)
+    if not client:
+        return auth_error()
+
+    # Read all records before streaming starts, so a bad body is still a 400
+    chunks = capped(request.stream(), DOC_RENDER_MAX_BYTES)
+    try:
+        if "ndjson" in request.headers.get("content-type", ""):
+            req = RenderRequest(**{**request.query_params, "records": await read_ndjson_records(chunks)})
+        else:
+            body = b"".join([chunk async for chunk in chunks])
+            try:
+                doc = json.loads(body)
+            except ValueError as e:
+                raise ValueError(f"Body is not valid JSON: {e}")
+            if not isinstance(doc, dict):
+                raise ValueError("Body must be a JSON object")
+            req = RenderRequest(**doc)
+    except BodyTooLarge as e:
+        return JSONResponse(status_code=413, content={"status": "error", "message": str(e)})
+    except ValidationError as e:
+        return JSONResponse(status_code=400, content={"status": "error", "message": validation_message(e)})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"status": "error", "message": str(e)})
+
+    async def stream():
+        rendered = failed = 0
+        async for result in render_all(client, req.template_id, req.records, req.title, req.folder_id):
+            if result["status"] == "success":
+                rendered += 1
+            else:
+                failed += 1
+            yield json.dumps(result) + "\n"
+        yield json.dumps({"status": "done", "rendered": rendered, "failed": failed}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.get("/docs/{doc_id}")
+async def read_doc(doc_id: str, request: Request, format: str = "text", tenant: str = Depends(get_tenant)):
+    """Document as plain text (format=text) or the full Docs API structure (format=json)"""
+    client = await get_google_client(tenant)
+    if not client:
+        return auth_error()
+
+    def render(doc, version):
+        content = {"status": "success", "doc_id": doc_id, "title": doc.get("title"),
+                   "revision_id": doc.get("revisionId"), "version": version}
+        if format == "json":
+            content["document"] = doc
+        else:
+            content["text"] = document_text(doc)
+        return content
+
+    return await cached_read(request, client, (tenant, "doc", doc_id, format), doc_id,
+                             lambda: client.call("docs", "documents.get", documentId=doc_id), render)
+
 
 # ----------------------------
 # Sheets
 # ----------------------------
 @app.post("/create_sheet_chat")
-def create_sheet_chat(req: SheetRequest):
-    service = get_sheets_service()
-    if not service:
-        return {"status": "error", "auth_url": f"{REDIRECT_URI.replace('/oauth2callback','/auth')}"}
+async def create_sheet_chat(req: SheetRequest, response: Response, tenant: str = Depends(get_tenant),
+                            idempotency_key: Optional[str] = Header(None)):
+    client = await get_google_client(tenant)
+    if not client:
+        return auth_error()
 
-    sheet = service.spreadsheets().create(body={"properties": {"title": req.name}}).execute()
-    sheet_id = sheet.get("spreadsheetId")
-    return {"status": "success", "sheet_id": sheet_id,
-            "link": f"https://docs.google.com/spreadsheets/d/{sheet_id}"}
+    async def create():
+        sheet = await client.call("sheets", "spreadsheets.create", body={"properties": {"title": req.name}})
+        sheet_id = sheet.get("spreadsheetId")
+        return {"status": "success", "sheet_id": sheet_id,
+                "link": f"https://docs.google.com/spreadsheets/d/{sheet_id}"}
+
+    return await run_idempotent(response, idempotency_key, tenant, "create_sheet_chat", req.dict(), create)
 
 @app.post("/populate_google_sheet")
-def populate_google_sheet(req: PopulateSheetRequest):
-    service = get_sheets_service()
-    if not service:
-        return {"status": "error", "auth_url": f"{REDIRECT_URI.replace('/oauth2callback','/auth')}"}
-
-    body = {"values": req.values}
-    service.spreadsheets().values().update(
-        spreadsheetId=req.sheet_id,
-        range="A1",
-        valueInputOption="RAW",
-        body=body
-    ).execute()
+async def populate_google_sheet(req: PopulateSheetRequest, tenant: str = Depends(get_tenant)):
+    client = await get_google_client(tenant)
+    if not client:
+        return auth_error()
+
+    if req.mode == "sync":
+        try:
+            result = await sync_sheet(client, tenant, req.sheet_id, req.range, req.values)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"status": "error", "message": str(e)})
+        return {"status": "success", "sheet_id": req.sheet_id, "mode": "sync", **result}
+    if req.mode != "overwrite":
+        return JSONResponse(status_code=400, content={
+            "status": "error", "message": f"Unknown mode: {req.mode}", "modes": ["overwrite", "sync"]
+        })
+
+    async with overwriting_sheet(tenant, req.sheet_id):
+        await submit_values(client, tenant, req.sheet_id, req.range, req.values)
 
     return {"status": "success", "sheet_id": req.sheet_id, "rows_added": len(req.values)}
+
+@app.post("/populate_google_sheet/stream")
+async def populate_google_sheet_stream(request: Request, sheet_id: str, start: str = "A1",
+                                       upload_id: str = None, tenant: str = Depends(get_tenant)):
+    """Bulk import from an NDJSON (one JSON array per line) or text/csv body"""
+    client = await get_google_client(tenant)
+    if not client:
+        return auth_error()
+
+    if "csv" in request.headers.get("content-type", ""):
+        rows = iter_csv_rows(request.stream())
+    else:
+        rows = iter_ndjson_rows(request.stream())
+
+    progress = uploads.start(tenant, sheet_id, upload_id)
+    try:
+        async with overwriting_sheet(tenant, sheet_id):
+            loader = SheetLoader(client, sheet_id, start, progress=progress)
+            await loader.load(chunk_rows(rows))
+    except ValueError as e:
+        progress.state, progress.error = "failed", str(e)
+        return JSONResponse(status_code=400, content={
+            "status": "error", "message": str(e), "upload": progress.to_dict()
+        })
+
+    return {"status": "success", "sheet_id": sheet_id, "rows_added": progress.rows_written,
+            "chunks": progress.chunks_written, "upload_id": progress.upload_id}
+
+@app.post("/populate_google_sheet/columns")
+async def populate_google_sheet_columns(request: Request, sheet_id: str, start: str = "A1",
+                                        header: bool = True, upload_id: str = None,
+                                        tenant: str = Depends(get_tenant)):
+    """Bulk import of typed columns: column JSON, or an Arrow IPC stream/file body"""
+    client = await get_google_client(tenant)
+    if not client:
+        return auth_error()
+
+    body = await request.body()
+    try:
+        table = await run_in_threadpool(decode_columns, body, request.headers.get("content-type", ""))
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"status": "error", "message": str(e)})
+    del body
+
+    progress = uploads.start(tenant, sheet_id, upload_id)
+    try:
+        async with overwriting_sheet(tenant, sheet_id):
+            loader = ColumnLoader(client, sheet_id, start, progress=progress)
+            await loader.load_table(table, header=header)
+    except ValueError as e:
+        progress.state, progress.error = "failed", str(e)
+        return JSONResponse(status_code=400, content={
+            "status": "error", "message": str(e), "upload": progress.to_dict()
+        })
+
+    return {"status": "success", "sheet_id": sheet_id, "rows_added": progress.rows_written,
+            "columns": len(table.columns), "chunks": progress.chunks_written,
+            "upload_id": progress.upload_id}
+
+@app.get("/sheets/{sheet_id}/values")
+async def read_sheet_values(sheet_id: str, range: str, request: Request, tenant: str = Depends(get_tenant)):
+    client = await get_google_client(tenant)
+    if not client:
+        return auth_error()
+
+    def render(values, version):
+        return {"status": "success", "sheet_id": sheet_id, "range": values.get("range", range),
+                "values": values.get("values", []), "version": version}
+
+    return await cached_read(
+        request, client, (tenant, "values", sheet_id, range), sheet_id,
+        lambda: client.call("sheets", "spreadsheets.values.get", spreadsheetId=sheet_id, range=range),
+        render,
+    )
+
+@app.get("/uploads/{upload_id}")
+async def upload_progress(upload_id: str, tenant: str = Depends(get_tenant)):
+    progress = uploads.get(tenant, upload_id)
+    if progress is None:
+        return JSONResponse(status_code=404, content={"status": "error", "message": "Unknown upload_id"})
+    return {"status": "ok", "upload": progress.to_dict()}
+
+
+# ----------------------------
+# Batch
+# ----------------------------
+async def run_batch_operation(client, tenant: str, op: BatchOperation) -> dict:
+    if op.op == "append_text_doc":
+        if not op.doc_id or op.text is None:
+            raise ValueError("append_text_doc needs doc_id and text")
+        await submit_doc_requests(client, tenant, op.doc_id, append_text_requests(op.text),
+                                  delta=utf16_len(op.text + "\n"))
+        return {"doc_id": op.doc_id, "appended_text": op.text}
+    if op.op == "doc_requests":
+        if not op.doc_id or not op.requests:
+            raise ValueError("doc_requests needs doc_id and requests")
+        result = await submit_doc_requests(client, tenant, op.doc_id, op.requests)
+        return {"doc_id": op.doc_id, "replies": result["replies"]}
+    if op.op == "populate_google_sheet":
+        if not op.sheet_id or op.values is None:
+            raise ValueError("populate_google_sheet needs sheet_id and values")
+        async with overwriting_sheet(tenant, op.sheet_id):
+            result = await submit_values(client, tenant, op.sheet_id, op.range, op.values)
+        return {"sheet_id": op.sheet_id, "rows_added": len(op.values),
+                "updated_range": result.get("updatedRange")}
+    raise ValueError(f"Unknown op: {op.op}")
+
+@app.post("/batch")
+async def batch(req: BatchRequest, tenant: str = Depends(get_tenant)):
+    """Run many writes at once; writes to the same file share one batchUpdate"""
+    client = await get_google_client(tenant)
+    if not client:
+        return auth_error()
+
+    outcomes = await asyncio.gather(
+        *(run_batch_operation(client, tenant, op) for op in req.operations),
+        return_exceptions=True,
+    )
+    results = []
+    for index, outcome in enumerate(outcomes):
+        if isinstance(outcome, GoogleAPIError):
+            results.append({"index": index, "status": "error", "message": outcome.message,
+                            "google_status": outcome.status})
+        elif isinstance(outcome, ValueError):
+            results.append({"index": index, "status": "error", "message": str(outcome)})
+        elif isinstance(outcome, BaseException):
+            raise outcome
+        else:
+            results.append({"index": index, "status": "success", **outcome})
+    return {"status": "success", "results": results}
+
+
+# ----------------------------
+# Jobs
+# ----------------------------
+JOB_PARAMS = {
+    "populate_google_sheet": PopulateSheetRequest,
+    "create_sheet_and_populate": CreateSheetJobParams,
+    "create_doc_with_text": CreateDocJobParams,
+}
+DOC_PARAGRAPHS_PER_WRITE = 50
+
+async def job_client(job):
+    client = await get_google_client(job.tenant)
+    if not client:
+        raise RuntimeError("Not authorized with Google; visit /auth first")
+    return client
+
+async def populate_from_checkpoint(client, job, report, sheet_id: str, values: list, start: str) -> int:
+    """Write values[rows_committed:], checkpointing the contiguous prefix as chunks land"""
+    sheet, row, col = parse_a1(start)
+    done = job.progress.get("rows_committed", 0)
+    loader = SheetLoader(
+        client, sheet_id, a1_cell(row + done, col, sheet),
+        on_progress=lambda p: report(rows_committed=done + p.rows_committed, rows_total=len(values)),
+    )
+    await loader.load(chunk_rows(iter_rows(values[done:])))
+    return done + loader.progress.rows_written
+
+async def run_populate_job(job, report):
+    p = job.params
+    client = await job_client(job)
+    if p.get("mode") == "sync":
+        # A sync is cheap to redo, so a resumed job simply runs it again
+        result = await sync_sheet(client, job.tenant, p["sheet_id"], p.get("range", "A1"), p["values"])
+        return {"sheet_id": p["sheet_id"], **result}
+    async with overwriting_sheet(job.tenant, p["sheet_id"]):
+        rows = await populate_from_checkpoint(client, job, report, p["sheet_id"], p["values"], p.get("range", "A1"))
+    return {"sheet_id": p["sheet_id"], "rows_added": rows}
+
+async def run_create_sheet_job(job, report):
+    p = job.params
+    client = await job_client(job)
+    sheet_id = job.progress.get("sheet_id")
+    if not sheet_id:
+        sheet = await client.call("sheets", "spreadsheets.create", body={"properties": {"title": p["name"]}})
+        sheet_id = sheet["spreadsheetId"]
+        report(sheet_id=sheet_id)
+    rows = await populate_from_checkpoint(client, job, report, sheet_id, p["values"], p.get("range", "A1"))
+    return {"sheet_id": sheet_id, "link": f"https://docs.google.com/spreadsheets/d/{sheet_id}",
+            "rows_added": rows}
+
+async def run_create_doc_job(job, report):
+    p = job.params
+    client = await job_client(job)
+    doc_id = job.progress.get("doc_id")
+    if not doc_id:
+        doc = await client.call("docs", "documents.create", body={"title": p["name"]})
+        doc_id = doc["documentId"]
+        if doc.get("revisionId"):
+            doc_index_cache.set((job.tenant, doc_id), NEW_DOC_END_INDEX, doc["revisionId"])
+        report(doc_id=doc_id, paragraphs_written=0)
+
+    paragraphs = p["paragraphs"]
+    done = job.progress.get("paragraphs_written", 0)
+    while done < len(paragraphs):
+        text = "\n".join(paragraphs[done:done + DOC_PARAGRAPHS_PER_WRITE])
+        await submit_doc_requests(client, job.tenant, doc_id, append_text_requests(text),
+                                  delta=utf16_len(text + "\n"))
+        done = min(done + DOC_PARAGRAPHS_PER_WRITE, len(paragraphs))
+        report(paragraphs_written=done, paragraphs_total=len(paragraphs))
+    return {"doc_id": doc_id, "link": f"https://docs.google.com/document/d/{doc_id}",
+            "paragraphs_added": len(paragraphs)}
+
+job_runner = JobRunner(JobStore(), {
+    "populate_google_sheet": run_populate_job,
+    "create_sheet_and_populate": run_create_sheet_job,
+    "create_doc_with_text": run_create_doc_job,
+}, state=shared_state)
+
+def find_job(job_id: str, tenant: str):
+    job = job_runner.get(job_id)
+    if job is None or job.tenant != tenant:
+        return None
+    return job
+
+@app.post("/jobs", status_code=202)
+async def create_job(req: JobRequest, response: Response, tenant: str = Depends(get_tenant),
+                     idempotency_key: Optional[str] = Header(None)):
+    """Start long-running work in the background; poll /jobs/{job_id} or follow /jobs/{job_id}/events"""
+    model = JOB_PARAMS.get(req.kind)
+    if model is None:
+        return JSONResponse(status_code=400, content={
+            "status": "error", "message": f"Unknown job kind: {req.kind}", "kinds": list(JOB_PARAMS)
+        })
+    # Checked now: a job that would fail on its first write is never enqueued
+    try:
+        params = model(**req.params).dict()
+    except ValidationError as e:
+        return JSONResponse(status_code=400, content={
+            "status": "error", "message": f"Invalid params: {validation_message(e)}"
+        })
+
+    async def submit():
+        job = job_runner.submit(tenant, req.kind, params)
+        return {"status": "accepted", "job_id": job.id, "status_url": f"/jobs/{job.id}",
+                "events_url": f"/jobs/{job.id}/events"}
+
+    return await run_idempotent(response, idempotency_key, tenant, "jobs", req.dict(), submit)
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, tenant: str = Depends(get_tenant)):
+    job = find_job(job_id, tenant)
+    if job is None:
+        return JSONResponse(status_code=404, content={"status": "error", "message": "Unknown job_id"})
+    return {"status": "ok", "job": job.to_dict()}
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, tenant: str = Depends(get_tenant)):
+    """Server-sent events with a job snapshot on every change, ending when the job finishes"""
+    if find_job(job_id, tenant) is None:
+        return JSONResponse(status_code=404, content={"status": "error", "message": "Unknown job_id"})
+
+    async def stream():
+        async for snapshot in job_runner.events(job_id):
+            yield f"event: {snapshot['state']}\ndata: {json.dumps(snapshot)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+# ----------------------------
+# Drive changes
+# ----------------------------
+change_feed = ChangeFeed(ChangeTokenStore(), get_google_client, state=shared_state)
+
+async def on_drive_change(tenant: str, event: dict):
+    file_id = event["file_id"]
+    read_cache.invalidate(file_id)
+    if not event["modified_by_me"]:
+        # Doc writes carry requiredRevisionId, so an end index the tenant's own
+        # UI edits made stale is refused by Google and re-read; only other
+        # people's edits are worth dropping it for
+        doc_index_cache.invalidate((tenant, file_id))
+    if not event["by_bridge"]:
+        # Any change but a recorded sync (the owner's UI edits included)
+        # leaves the fingerprints describing stale cells
+        await sheet_syncer.forget(tenant, file_id)
+
+change_feed.listeners.append(on_drive_change)
+
+@app.post("/changes/watch")
+async def watch_changes(tenant: str = Depends(get_tenant)):
+    """Follow the tenant's Drive changes feed in the background; the page token survives restarts"""
+    if not await get_google_client(tenant):
+        return auth_error()
+    change_feed.watch(tenant)
+    return {"status": "success", "watching": True, "poll_seconds": change_feed.poll_seconds}
+
+@app.delete("/changes/watch")
+async def unwatch_changes(tenant: str = Depends(get_tenant)):
+    await change_feed.unwatch(tenant)
+    return {"status": "success", "watching": False}
+
+@app.post("/changes/poll")
+async def poll_changes(tenant: str = Depends(get_tenant)):
+    """Run one incremental pass now instead of waiting for the next interval"""
+    if not await get_google_client(tenant):
+        return auth_error()
+    changes = await change_feed.poll(tenant)
+    return {"status": "success", "changes": changes}
+
+@app.get("/changes/events")
+async def change_events(file_id: Optional[List[str]] = Query(None), tenant: str = Depends(get_tenant)):
+    """Server-sent events for Drive changes, optionally only for the given file_id values"""
+    if not await get_google_client(tenant):
+        return auth_error()
+
+    async def stream():
+        async for event in change_feed.events(tenant, set(file_id or ())):
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: change\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
@@ -1,14 +1,25 @@
+import asyncio
 import os
 import json
-import requests
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI
+
+from bridge_client import AsyncBridgeClient, BRIDGE_URL
+from completion_cache import cached_create, cached_stream_text, completion_cache
+from row_stream import RowStreamParser
 
 # 🔑 API key - Import from config file
 from config import OPENAI_API_KEY
 os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
-client = OpenAI()
+client = AsyncOpenAI()
 
-BRIDGE_URL = "https://my-google-bridge-1b5a7ab10d6b.herokuapp.com"
+MODEL = "gpt-4o-mini"
+# 0 keeps answers repeatable, so the completion cache may replay them
+TEMPERATURE = 0
+# Model ↔ bridge round-trips allowed per user message before giving up
+MAX_TOOL_ROUNDS = 5
+# Upper bound on rows per populate_google_sheet call while streaming a plan
+ROWS_PER_WRITE = 10
 
 # -------------------------------
 # Function schemas
@@ -40,111 +51,165 @@ functions = [
                     "type": "array",
                     "items": {"type": "array", "items": {"type": "string"}},
                 },
+                "range": {"type": "string", "description": "Top-left cell to write from, e.g. A1 or Sheet1!B2"},
             },
             "required": ["sheet_id","values"],
         },
     }
 ]
+tools = [{"type": "function", "function": f} for f in functions]
+
+TOOL_ENDPOINTS = {
+    "create_google_doc": "create_doc_chat",
+    "append_text_doc": "append_text_doc",
+    "create_google_sheet": "create_sheet_chat",
+    "populate_google_sheet": "populate_google_sheet",
+}
 
 # -------------------------------
 # Helper for bridge calls
 # -------------------------------
-def call_bridge(endpoint, payload):
-    url = f"{BRIDGE_URL}/{endpoint}"
-    r = requests.post(url, json=payload)
-    return r.json()
+def open_bridge():
+    """One keep-alive connection pool reused for every bridge call"""
+    return AsyncBridgeClient(BRIDGE_URL)
+
+async def call_bridge(http, endpoint, payload):
+    return await http.call(endpoint, payload)
+
+def parse_arguments(raw):
+    """Tool arguments must be a JSON object; anything else is reported back to the model"""
+    args = json.loads(raw or "{}")
+    if not isinstance(args, dict):
+        raise ValueError("arguments must be a JSON object")
+    return args
+
+async def run_tool_call(http, call):
+    endpoint = TOOL_ENDPOINTS.get(call.function.name)
+    try:
+        if endpoint is None:
+            raise ValueError(f"unknown function {call.function.name}")
+        result = await call_bridge(http, endpoint, parse_arguments(call.function.arguments))
+    except (ValueError, httpx.HTTPError) as e:
+        result = {"status": "error", "message": f"{type(e).__name__}: {e}"}
+    return {"role": "tool", "tool_call_id": call.id, "content": json.dumps(result)}
 
 # -------------------------------
 # Generate structured 30-day content plan
 # -------------------------------
-def generate_content_plan():
-    plan_prompt = """
-    Generate a 30-day Instagram parenting content plan.
-    Format the response as valid JSON ONLY.
-    JSON structure: [["Day","Format","Caption","Image Idea","Tool"], [...next rows...]]
-    Do not include text outside of the JSON.
+PLAN_PROMPT = """
+Generate a 30-day Instagram parenting content plan.
+Format the response as valid JSON ONLY.
+JSON structure: [["Day","Format","Caption","Image Idea","Tool"], [...next rows...]]
+Do not include text outside of the JSON.
+"""
+
+async def stream_content_plan():
+    """Yield content plan rows (header first) while the model is still generating"""
+    parser = RowStreamParser()
+    # A repeated plan request is replayed from the completion cache in one piece
+    async for text in cached_stream_text(client, model=MODEL, temperature=TEMPERATURE,
+                                         messages=[{"role": "user", "content": PLAN_PROMPT}]):
+        for row in parser.feed(text):
+            yield [str(cell) for cell in row]
+
+async def write_rows_streaming(http, sheet_id, rows, max_batch=ROWS_PER_WRITE):
+    """
+    Append rows to the sheet as they arrive. The first row is written right
+    away; rows that arrive while a write is in flight go out together in the next one.
     """
+    queue = asyncio.Queue()
 
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": plan_prompt}],
-    )
-    raw = completion.choices[0].message.content.strip()
+    async def produce():
+        try:
+            async for row in rows:
+                queue.put_nowait(row)
+        finally:
+            queue.put_nowait(None)
 
+    producer = asyncio.create_task(produce())
+    written, finished = 0, False
     try:
-        values = json.loads(raw)
-    except json.JSONDecodeError:
-        # fallback: wrap manually if GPT outputs something odd
-        cleaned = raw.strip().replace("```json","").replace("```","")
-        values = json.loads(cleaned)
-
-    return values
+        while not finished:
+            batch = [await queue.get()]
+            while len(batch) < max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+            if batch[-1] is None:
+                finished = True
+                batch.pop()
+            if not batch:
+                continue
+            result = await call_bridge(http, "populate_google_sheet", {
+                "sheet_id": sheet_id, "values": batch, "range": f"A{written + 1}",
+            })
+            if result.get("status") != "success":
+                raise RuntimeError(f"populate_google_sheet failed: {result}")
+            written += len(batch)
+            print(f"📝 {written} rows written")
+        await producer  # surfaces generation errors
+    finally:
+        producer.cancel()
+    return written
 
 # -------------------------------
 # Main agent loop
 # -------------------------------
-def chat_with_agent(user_message: str):
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": user_message}],
-        functions=functions,
-    )
-
-    msg = response.choices[0].message
-
-    if msg.function_call:
-        func_name = msg.function_call.name
-        args = eval(msg.function_call.arguments)
-
-        if func_name == "create_google_sheet":
-            result = call_bridge("create_sheet_chat", args)
-            return result
-
-        elif func_name == "populate_google_sheet":
-            result = call_bridge("populate_google_sheet", args)
-            return result
-
-        elif func_name == "create_google_doc":
-            result = call_bridge("create_doc_chat", args)
-            return result
+async def chat_with_agent(http, user_message: str):
+    """
+    Every tool call the model asks for in a turn runs concurrently against the
+    bridge, and all of their results go back in the next turn
+    """
+    messages = [{"role": "user", "content": user_message}]
+    for _ in range(MAX_TOOL_ROUNDS):
+        response = await cached_create(client, model=MODEL, temperature=TEMPERATURE, messages=messages,
+                                       tools=tools)
+        msg = response.choices[0].message
+        if not msg.tool_calls:
+            return msg.content
 
-        elif func_name == "append_text_doc":
-            result = call_bridge("append_text_doc", args)
-            return result
+        messages.append(msg.model_dump(exclude_none=True))
+        messages.extend(await asyncio.gather(*(run_tool_call(http, call) for call in msg.tool_calls)))
 
-    return msg.content
+    return "⚠️ Stopped after too many tool calls"
 
 # -------------------------------
 # Custom flow for content plan
 # -------------------------------
+async def content_plan_flow(http):
+    # Step 1: create sheet
+    sheet = await call_bridge(http, "create_sheet_chat", {"name": "Content Plan"})
+    print("Assistant:", sheet)
+    if sheet.get("status") != "success":
+        return
+    sheet_id = sheet["sheet_id"]
+
+    print("🔗 Watch it fill in:", sheet["link"])
+
+    # Steps 2 & 3: generate the plan and write each row as soon as it is complete;
+    # every write is a small call, well inside Heroku's 30s router timeout
+    written = await write_rows_streaming(http, sheet_id, stream_content_plan())
+    print(f"✅ Content Plan created & filled ({written} rows):", sheet["link"])
+
+async def main():
+    async with open_bridge() as http:
+        while True:
+            user_input = await asyncio.to_thread(input, "You: ")
+
+            if user_input.strip().lower() == "cache stats":
+                print("📊", completion_cache.stats())
+            elif "content plan" in user_input.lower() and "sheet" in user_input.lower():
+                await content_plan_flow(http)
+            else:
+                result = await chat_with_agent(http, user_input)
+                print("Assistant:", result)
+
 if __name__ == "__main__":
     print("🤖 Enhanced Google Drive Bridge Agent")
     print("=" * 50)
     print("💡 Try: 'Create a Google Doc called Meeting Notes'")
     print("💡 Try: 'Make me a spreadsheet for Budget 2024'")
+    print("💡 Try: 'Create 5 sheets called Q1 through Q5'")
     print("💡 Try: 'Generate a 30-day content plan for my parenting Instagram'")
+    print("💡 Type 'cache stats' to see completion cache hits")
     print("=" * 50)
-    
-    while True:
-        user_input = input("You: ")
-
-        if "content plan" in user_input.lower() and "sheet" in user_input.lower():
-            # Step 1: create sheet
-            sheet = chat_with_agent("Create a Google Sheet called Content Plan")
-            print("Assistant:", sheet)
-
-            if sheet.get("status") == "success":
-                sheet_id = sheet["sheet_id"]
-
-                # Step 2: generate structured plan
-                rows = generate_content_plan()
-
-                # Step 3: populate sheet
-                payload = {"sheet_id": sheet_id, "values": rows}
-                filled = call_bridge("populate_google_sheet", payload)
-                print("Assistant:", filled)
-                print("✅ Content Plan created & filled:", sheet["link"])
-
-        else:
-            result = chat_with_agent(user_input)
-            print("Assistant:", result)
+
+    asyncio.run(main())
@@ -1,15 +1,19 @@
+import json
 import os
-import requests
 from openai import OpenAI
+from bridge_client import BridgeClient
+from completion_cache import cached_create_sync
 from config_new import OPENAI_API_KEY, BRIDGE_URL, MODEL
 
 # 🔑 Set your OpenAI API key
 os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
 
 client = OpenAI()
+# 0 keeps answers repeatable, so the completion cache may replay them
+TEMPERATURE = 0
 
-# Create a session to maintain cookies
-session = requests.Session()
+# One pooled keep-alive client (it also keeps cookies) for every bridge call
+session = BridgeClient(BRIDGE_URL)
 
 # Define functions ChatGPT can call
 functions = [
@@ -39,9 +43,7 @@ functions = [
 
 def call_bridge(endpoint: str, payload: dict):
     """Helper to call your bridge endpoints with session cookies"""
-    url = f"{BRIDGE_URL}/{endpoint}"
-    r = session.post(url, json=payload)
-    return r.json()
+    return session.call(endpoint, payload)
 
 def check_auth_status():
     """Check if we're authenticated by trying to create a test document"""
@@ -52,8 +54,10 @@ def check_auth_status():
         return False
 
 def chat_with_gpt(user_message: str):
-    response = client.chat.completions.create(
+    response = cached_create_sync(
+        client,
         model=MODEL,
+        temperature=TEMPERATURE,
         messages=[{"role": "user", "content": user_message}],
         functions=functions,
     )
@@ -63,7 +67,7 @@ def chat_with_gpt(user_message: str):
     # Case 1: GPT wants to call a function
     if msg.function_call:
         func_name = msg.function_call.name
-        args = eval(msg.function_call.arguments)
+        args = json.loads(msg.function_call.arguments)
 
         if func_name == "create_google_doc":
             result = call_bridge("create_doc_chat", args)
@@ -0,0 +1,148 @@
+"""
+Outbound scheduler for Google API calls
+Token buckets per API and per user sized from Google's published per-minute
+quotas, decorrelated-jitter retries that honor Retry-After, and a per-request deadline.
+The buckets live in shared_state so every worker process spends the same quota.
+"""
+
+import asyncio
+import contextvars
+import json
+import os
+import random
+import time
+
+from metrics import record_phase
+from shared_state import MemoryState, SharedState, shared_state
+
+# Requests per minute: (per project, per user)
+QUOTAS = {
+    ("sheets", "read"): (300, 60),
+    ("sheets", "write"): (300, 60),
+    ("docs", "read"): (3000, 300),
+    ("docs", "write"): (600, 60),
+    ("drive", "read"): (12000, 12000),
+    ("drive", "write"): (12000, 12000),
+}
+
+# e.g. GOOGLE_QUOTA_OVERRIDES='{"sheets.write.user": 120, "sheets.write.project": 600}'
+for _name, _limit in json.loads(os.environ.get("GOOGLE_QUOTA_OVERRIDES", "{}")).items():
+    _api, _kind, _scope = _name.split(".")
+    _project, _user = QUOTAS[(_api, _kind)]
+    QUOTAS[(_api, _kind)] = (_limit, _user) if _scope == "project" else (_project, _limit)
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# POST methods that are safe to repeat after an ambiguous 5xx or dropped connection
+IDEMPOTENT_POSTS = {"spreadsheets.values.batchUpdate", "spreadsheets.values.batchClear",
+                    "spreadsheets.values.clear", "changes.getStartPageToken"}
+
+BACKOFF_BASE = float(os.environ.get("GOOGLE_BACKOFF_BASE", "0.5"))
+BACKOFF_CAP = float(os.environ.get("GOOGLE_BACKOFF_CAP", "32"))
+MAX_ATTEMPTS = int(os.environ.get("GOOGLE_MAX_ATTEMPTS", "6"))
+# Budget for one incoming request's Google calls; stays under Heroku's 30s router timeout
+REQUEST_DEADLINE = float(os.environ.get("GOOGLE_REQUEST_DEADLINE", "25"))
+
+# Absolute time.monotonic() deadline for the current request (None: no deadline)
+deadline_var = contextvars.ContextVar("google_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    status = 504
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+def is_idempotent(method: str, http_method: str) -> bool:
+    return http_method in ("GET", "PUT", "DELETE") or method in IDEMPOTENT_POSTS
+
+
+def next_backoff(previous: float) -> float:
+    """Decorrelated jitter: sleep = min(cap, uniform(base, previous * 3))"""
+    return min(BACKOFF_CAP, random.uniform(BACKOFF_BASE, max(BACKOFF_BASE, previous * 3)))
+
+
+class OutboundScheduler:
+    def __init__(self, state: SharedState = None):
+        self.state = state if state is not None else MemoryState()
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.deadline_exceeded = 0
+        self.queued_seconds = 0.0
+        self.retry_seconds = 0.0
+
+    async def acquire(self, api: str, kind: str, user: str, deadline: float = None):
+        key = (api, kind)
+        if key not in QUOTAS:
+            return
+        project, per_user = QUOTAS[key]
+        max_wait = None if deadline is None else deadline - time.monotonic()
+        # Nothing is taken when the wait would run past the deadline
+        wait = await self.state.reserve([(f"quota:{api}.{kind}", project),
+                                         (f"quota:{api}.{kind}:{user}", per_user)], max_wait)
+        if wait is None:
+            self.deadline_exceeded += 1
+            raise DeadlineExceeded(f"{api} {kind} quota would not free up before the request deadline")
+        if wait <= 0:
+            return
+        self.throttled += 1
+        self.queued_seconds += wait
+        record_phase("quota_wait", wait)
+        await asyncio.sleep(wait)
+
+    async def run(self, api: str, method: str, http_method: str, user: str, send):
+        """
+        send(timeout) performs one attempt. Errors it raises are retried when
+        they carry a retryable .status, or .sent is False (never reached Google).
+        """
+        deadline = deadline_var.get()
+        kind = "read" if http_method == "GET" else "write"
+        idempotent = is_idempotent(method, http_method)
+        backoff = BACKOFF_BASE
+        attempt = 0
+        self.calls += 1
+
+        while True:
+            attempt += 1
+            await self.acquire(api, kind, user, deadline)
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0.001)
+            try:
+                return await send(timeout)
+            except Exception as e:
+                status = getattr(e, "status", None)
+                sent = getattr(e, "sent", True)
+                # 429 and unsent requests never ran; other failures only repeat safely if idempotent
+                retryable = (status == 429 or not sent
+                             or (status in RETRYABLE_STATUSES and idempotent))
+                if not retryable or attempt >= MAX_ATTEMPTS:
+                    raise
+
+                backoff = next_backoff(backoff)
+                delay = max(backoff, getattr(e, "retry_after", None) or 0)
+                if deadline is not None and time.monotonic() + delay > deadline:
+                    self.deadline_exceeded += 1
+                    raise
+                self.retries += 1
+                self.retry_seconds += delay
+                record_phase("retry_wait", delay)
+                await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "deadline_exceeded": self.deadline_exceeded,
+            "queued_seconds": round(self.queued_seconds, 3),
+            "retry_seconds": round(self.retry_seconds, 3),
+        }
+
+
+scheduler = OutboundScheduler(shared_state)
+
+
+def start_request_deadline(seconds: float = REQUEST_DEADLINE):
+    """Set the deadline for the current task's Google calls; returns a token for reset"""
+    return deadline_var.set(time.monotonic() + seconds if seconds else None)
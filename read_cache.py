@@ -0,0 +1,166 @@
+"""
+Cache for reads of Docs and Sheets content
+Bodies are kept per (tenant, kind, file, range) together with the Drive version
+they were read at; a repeat read costs one files.get metadata call (or nothing
+within READ_CACHE_FRESH_SECONDS, or while the Drive changes feed is watching
+the tenant) unless the file changed
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+READ_CACHE_MAX_ENTRIES = int(os.environ.get("READ_CACHE_MAX_ENTRIES", "1000"))
+READ_CACHE_MAX_BYTES = int(os.environ.get("READ_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Serve cached versions without asking Drive for this long; 0 always revalidates
+READ_CACHE_FRESH_SECONDS = float(os.environ.get("READ_CACHE_FRESH_SECONDS", "0"))
+
+
+class CachedRead:
+    __slots__ = ("file_id", "version", "body", "size", "checked_at")
+
+    def __init__(self, file_id: str, version: str, body, size: int):
+        self.file_id = file_id
+        self.version = version
+        self.body = body
+        self.size = size
+        self.checked_at = time.monotonic()
+
+
+class ReadCache:
+    def __init__(self, max_entries: int = READ_CACHE_MAX_ENTRIES, max_bytes: int = READ_CACHE_MAX_BYTES,
+                 fresh_seconds: float = READ_CACHE_FRESH_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.fresh_seconds = fresh_seconds
+        self._entries = OrderedDict()  # key -> CachedRead
+        self._by_file = {}  # file_id -> keys
+        self._inflight = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.version_checks = 0
+        self.not_modified = 0
+        self.invalidations = 0
+
+    async def version(self, key: tuple, get_version, trusted_since: float = None) -> str:
+        """
+        The file's current version. A recently checked entry answers without
+        calling Drive, as does one checked after trusted_since: from then on
+        any change to the file invalidates it.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            if time.monotonic() - entry.checked_at < self.fresh_seconds:
+                return entry.version
+            if trusted_since is not None and entry.checked_at >= trusted_since:
+                return entry.version
+        self.version_checks += 1
+        return await get_version()
+
+    async def get(self, key: tuple, file_id: str, version: str, fetch):
+        """Body for `version`, downloading it with fetch() only if the cached one is older"""
+        entry = self._entries.get(key)
+        if entry is not None and entry.version == version:
+            entry.checked_at = time.monotonic()
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.body
+
+        self.misses += 1
+        inflight = self._inflight.get((key, version))
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[(key, version)] = future
+        try:
+            body = await fetch()
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        else:
+            future.set_result(body)
+            self._store(key, CachedRead(file_id, version, body, len(json.dumps(body, separators=(",", ":")))))
+            return body
+        finally:
+            del self._inflight[(key, version)]
+
+    def _store(self, key: tuple, entry: CachedRead):
+        self._remove(key)
+        if entry.size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._by_file.setdefault(entry.file_id, set()).add(key)
+        self._bytes += entry.size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        keys = self._by_file.get(entry.file_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_file[entry.file_id]
+
+    def invalidate(self, file_id: str):
+        """Drop every cached read of a file, e.g. after the bridge or someone else wrote to it"""
+        keys = self._by_file.get(file_id)
+        if keys:
+            self.invalidations += 1
+            for key in list(keys):
+                self._remove(key)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "version_checks": self.version_checks,
+                "not_modified": self.not_modified, "invalidations": self.invalidations,
+                "size": len(self._entries), "bytes": self._bytes}
+
+
+read_cache = ReadCache()
+
+
+async def drive_version(client, file_id: str) -> str:
+    """Drive's version number increases on every change to the file"""
+    meta = await client.call("drive", "files.get", fileId=file_id, fields="version,modifiedTime",
+                             supportsAllDrives=True)
+    return str(meta.get("version") or meta.get("modifiedTime") or "")
+
+
+def make_etag(file_id: str, version: str, variant: str = "") -> str:
+    digest = hashlib.sha1(f"{file_id}\0{version}\0{variant}".encode("utf-8")).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(
+        (tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates
+    )
+
+
+def document_text(doc: dict) -> str:
+    """Plain text of a Docs document body, including table cells"""
+    parts = []
+
+    def walk(content):
+        for element in content:
+            if "paragraph" in element:
+                for run in element["paragraph"].get("elements", []):
+                    parts.append(run.get("textRun", {}).get("content", ""))
+            elif "table" in element:
+                for row in element["table"].get("tableRows", []):
+                    for cell in row.get("tableCells", []):
+                        walk(cell.get("content", []))
+
+    walk(doc.get("body", {}).get("content", []))
+    return "".join(parts)
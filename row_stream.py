@@ -0,0 +1,53 @@
+"""
+Incremental parser for a JSON table streamed by the model
+"""
+
+import json
+
+
+class RowStreamParser:
+    """
+    Pulls complete rows out of a [[...],[...]] JSON array as it streams in, so
+    each row can be used as soon as its closing bracket arrives. Anything
+    before the outer array (e.g. a ```json fence) is ignored.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._row_start = None
+
+    def feed(self, text: str) -> list:
+        self._buffer += text
+        buf, rows = self._buffer, []
+        for i in range(self._pos, len(buf)):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"' and self._depth > 0:
+                self._in_string = True
+            elif ch == "[":
+                self._depth += 1
+                if self._depth == 2:
+                    self._row_start = i
+            elif ch == "]" and self._depth > 0:
+                if self._depth == 2:
+                    rows.append(json.loads(buf[self._row_start:i + 1]))
+                    self._row_start = None
+                self._depth -= 1
+
+        # Only the unfinished row needs to be kept
+        keep = self._row_start if self._row_start is not None else len(buf)
+        self._buffer = buf[keep:]
+        self._pos = len(buf) - keep
+        if self._row_start is not None:
+            self._row_start = 0
+        return rows
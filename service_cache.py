@@ -0,0 +1,105 @@
+"""
+Process-wide cache of built Google API service clients
+Discovery documents are loaded once and services are rebuilt only when credentials rotate
+"""
+
+import hashlib
+import threading
+
+import httplib2
+import google_auth_httplib2
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import HttpRequest
+
+# (api, version) pairs the bridge talks to
+APIS = [("docs", "v1"), ("sheets", "v4"), ("drive", "v3")]
+
+_discovery_docs = {}
+_discovery_lock = threading.Lock()
+
+
+def load_discovery_docs():
+    """Load the discovery documents bundled with google-api-python-client"""
+    with _discovery_lock:
+        for api, version in APIS:
+            if (api, version) in _discovery_docs:
+                continue
+            doc = get_static_doc(api, version)
+            if doc is None:
+                raise RuntimeError(f"No static discovery document for {api} {version}")
+            _discovery_docs[(api, version)] = doc
+    return _discovery_docs
+
+
+def get_discovery_doc(api: str, version: str) -> str:
+    doc = _discovery_docs.get((api, version))
+    if doc is None:
+        load_discovery_docs()
+        doc = _discovery_docs[(api, version)]
+    return doc
+
+
+def _fingerprint(*parts) -> str:
+    return hashlib.sha256("|".join(p or "" for p in parts).encode("utf-8")).hexdigest()
+
+
+def credential_identity(creds) -> tuple:
+    """(account, token) fingerprints; the token part changes whenever the access token rotates"""
+    account = _fingerprint(creds.client_id, creds.refresh_token)
+    return account, _fingerprint(account, creds.token)
+
+
+class ServiceCache:
+    """
+    Thread-safe cache of discovery services keyed by (api, version, credential identity).
+
+    httplib2.Http is not thread-safe, so each cached service builds a fresh
+    authorized Http per request instead of sharing the one it was built with.
+    """
+
+    def __init__(self):
+        self._services = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, api: str, version: str, creds):
+        account, token = credential_identity(creds)
+        key = (api, version, account, token)
+        with self._lock:
+            service = self._services.get(key)
+            if service is not None:
+                self.hits += 1
+                return service
+            self.misses += 1
+
+        service = self._build(api, version, creds)
+        with self._lock:
+            # Drop services built for tokens that have since rotated
+            for stale in [k for k in self._services if k[:3] == key[:3]]:
+                del self._services[stale]
+            self._services[key] = service
+        return service
+
+    def _build(self, api: str, version: str, creds):
+        def request_builder(http, *args, **kwargs):
+            authed = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http())
+            return HttpRequest(authed, *args, **kwargs)
+
+        return build_from_document(
+            get_discovery_doc(api, version),
+            credentials=creds,
+            requestBuilder=request_builder,
+        )
+
+    def clear(self):
+        with self._lock:
+            self._services.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._services)}
+
+
+service_cache = ServiceCache()
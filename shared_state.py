@@ -0,0 +1,353 @@
+"""
+State shared by every worker process
+Idempotency entries, Google quota buckets and job leases live in one backend
+so several workers (gunicorn processes or dynos) neither repeat a create nor
+overspend a quota. SHARED_STATE picks it: memory (one process, tests),
+sqlite:<path> (workers on one host) or redis://... (any Redis-compatible
+server, needs the optional redis package). Unset, it is memory for one
+worker and sqlite:shared_state.db when WEB_CONCURRENCY asks for more.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # memory and sqlite only
+    aioredis = None
+
+# Worker processes gunicorn starts (the Procfile); Heroku sets it from the dyno size
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+SHARED_STATE = os.environ.get("SHARED_STATE") or ("sqlite:shared_state.db" if WEB_CONCURRENCY > 1 else "memory")
+# Keys and buckets the memory backend keeps before dropping the least recently used
+SHARED_STATE_MAX_KEYS = int(os.environ.get("SHARED_STATE_MAX_KEYS", "100000"))
+# SQLite rows are purged of expired keys and idle buckets every this many writes
+SQLITE_PURGE_EVERY = 1000
+
+
+def take_token(tokens, updated: float, per_minute: float, now: float):
+    """
+    Reservation-style bucket: refill since `updated`, take one token and return
+    (tokens left, seconds to wait). The balance may go negative and callers
+    sleep off the debt. tokens=None is a new, full bucket.
+    """
+    rate = per_minute / 60.0
+    if tokens is None:
+        tokens = float(per_minute)
+    else:
+        tokens = min(float(per_minute), tokens + (now - updated) * rate)
+    tokens -= 1
+    return tokens, (0.0 if tokens >= 0 else -tokens / rate)
+
+
+class SharedState(ABC):
+    """
+    Values are strings and ttl is in seconds. reserve() takes one token from
+    each (key, per_minute) bucket atomically and returns the seconds to wait
+    for them, or None without taking anything when that wait exceeds max_wait.
+    """
+
+    name = "base"
+    # False only when every worker sees the same process memory
+    multi_process = True
+
+    @abstractmethod
+    async def get(self, key: str):
+        """The key's value, or None if it is absent or expired"""
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: float):
+        """Set the key, replacing any value it holds"""
+
+    @abstractmethod
+    async def add(self, key: str, value: str, ttl: float) -> bool:
+        """Set the key only if it is absent (or expired); True if this call set it"""
+
+    @abstractmethod
+    async def delete(self, key: str, value: str = None):
+        """Delete the key; with value, only while it still holds that value"""
+
+    @abstractmethod
+    async def reserve(self, buckets: list, max_wait: float = None):
+        """Seconds to wait for one token from every bucket, or None if over max_wait"""
+
+    async def close(self):
+        pass
+
+
+class MemoryState(SharedState):
+    """Plain dicts; correct for a single worker process only"""
+
+    name = "memory"
+    multi_process = False
+
+    def __init__(self, max_keys: int = SHARED_STATE_MAX_KEYS):
+        self.max_keys = max_keys
+        self._values = OrderedDict()  # key -> (expires_at, value)
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+
+    def _live(self, key: str):
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._values[key]
+            return None
+        return entry[1]
+
+    def _put(self, key: str, value: str, ttl: float):
+        self._values[key] = (time.monotonic() + ttl, value)
+        self._values.move_to_end(key)
+        while len(self._values) > self.max_keys:
+            self._values.popitem(last=False)
+
+    async def get(self, key: str):
+        return self._live(key)
+
+    async def set(self, key: str, value: str, ttl: float):
+        self._put(key, value, ttl)
+
+    async def add(self, key: str, value: str, ttl: float) -> bool:
+        if self._live(key) is not None:
+            return False
+        self._put(key, value, ttl)
+        return True
+
+    async def delete(self, key: str, value: str = None):
+        if value is None or self._live(key) == value:
+            self._values.pop(key, None)
+
+    async def reserve(self, buckets: list, max_wait: float = None):
+        now = time.monotonic()
+        taken, wait = [], 0.0
+        for key, per_minute in buckets:
+            tokens, updated = self._buckets.get(key, (None, now))
+            tokens, bucket_wait = take_token(tokens, updated, per_minute, now)
+            taken.append((key, tokens))
+            wait = max(wait, bucket_wait)
+        if wait > 0 and max_wait is not None and wait > max_wait:
+            return None
+        for key, tokens in taken:
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class SQLiteState(SharedState):
+    """One SQLite database in WAL mode, shared by the worker processes on a host"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = "shared_state.db"):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_values ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _wrote(self, conn: sqlite3.Connection):
+        self._writes += 1
+        if self._writes % SQLITE_PURGE_EVERY == 0:
+            now = time.time()
+            with conn:
+                conn.execute("DELETE FROM shared_values WHERE expires_at <= ?", (now,))
+                # A bucket untouched for an hour has long refilled; a missing one starts full
+                conn.execute("DELETE FROM shared_buckets WHERE updated < ?", (now - 3600,))
+
+    def _get(self, key: str):
+        row = self._conn().execute(
+            "SELECT value FROM shared_values WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key: str, value: str, ttl: float):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO shared_values (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl),
+            )
+        self._wrote(conn)
+
+    def _add(self, key: str, value: str, ttl: float) -> bool:
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            added = conn.execute(
+                "INSERT INTO shared_values (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+                "WHERE shared_values.expires_at <= ?",
+                (key, value, now + ttl, now),
+            ).rowcount
+        self._wrote(conn)
+        return added == 1
+
+    def _delete(self, key: str, value: str = None):
+        conn = self._conn()
+        with conn:
+            if value is None:
+                conn.execute("DELETE FROM shared_values WHERE key = ?", (key,))
+            else:
+                conn.execute("DELETE FROM shared_values WHERE key = ? AND value = ?", (key, value))
+
+    def _reserve(self, buckets: list, max_wait: float = None):
+        conn = self._conn()
+        # Take the write lock before reading so two processes can't spend the same tokens
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            taken, wait = [], 0.0
+            for key, per_minute in buckets:
+                row = conn.execute("SELECT tokens, updated FROM shared_buckets WHERE key = ?", (key,)).fetchone()
+                tokens, bucket_wait = take_token(row[0] if row else None, row[1] if row else now, per_minute, now)
+                taken.append((key, tokens, now))
+                wait = max(wait, bucket_wait)
+            if wait > 0 and max_wait is not None and wait > max_wait:
+                conn.rollback()
+                return None
+            conn.executemany("INSERT OR REPLACE INTO shared_buckets (key, tokens, updated) VALUES (?, ?, ?)", taken)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        self._wrote(conn)
+        return wait
+
+    async def get(self, key: str):
+        return await run_in_threadpool(self._get, key)
+
+    async def set(self, key: str, value: str, ttl: float):
+        await run_in_threadpool(self._set, key, value, ttl)
+
+    async def add(self, key: str, value: str, ttl: float) -> bool:
+        return await run_in_threadpool(self._add, key, value, ttl)
+
+    async def delete(self, key: str, value: str = None):
+        await run_in_threadpool(self._delete, key, value)
+
+    async def reserve(self, buckets: list, max_wait: float = None):
+        return await run_in_threadpool(self._reserve, buckets, max_wait)
+
+
+# Runs on the server, so the buckets use its clock rather than each dyno's.
+# ARGV[1] is max_wait (-1: none), ARGV[2..] the per-minute rate of each key.
+_RESERVE = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local max_wait = tonumber(ARGV[1])
+local wait = 0
+local left = {}
+for i, key in ipairs(KEYS) do
+  local per_minute = tonumber(ARGV[i + 1])
+  local rate = per_minute / 60
+  local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+  local tokens = per_minute
+  if bucket[1] then
+    tokens = math.min(per_minute, tonumber(bucket[1]) + (now - tonumber(bucket[2])) * rate)
+  end
+  tokens = tokens - 1
+  left[i] = tokens
+  if tokens < 0 then wait = math.max(wait, -tokens / rate) end
+end
+if wait > 0 and max_wait >= 0 and wait > max_wait then
+  return false
+end
+for i, key in ipairs(KEYS) do
+  local per_minute = tonumber(ARGV[i + 1])
+  redis.call('HSET', key, 'tokens', tostring(left[i]), 'updated', tostring(now))
+  -- Once refilled the bucket is the same as a missing one
+  redis.call('EXPIRE', key, math.ceil((per_minute - left[i]) * 60 / per_minute) + 1)
+end
+return tostring(wait)
+"""
+
+_DELETE_IF = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisState(SharedState):
+    """Any Redis-compatible server; shared by workers on every host"""
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = "bridge:"):
+        if aioredis is None:
+            raise RuntimeError("SHARED_STATE=redis needs the redis package: pip install redis")
+        self.prefix = prefix
+        self.client = aioredis.from_url(url, decode_responses=True)
+        self._reserve = self.client.register_script(_RESERVE)
+        self._delete_if = self.client.register_script(_DELETE_IF)
+
+    async def get(self, key: str):
+        return await self.client.get(self.prefix + key)
+
+    async def set(self, key: str, value: str, ttl: float):
+        await self.client.set(self.prefix + key, value, px=max(int(ttl * 1000), 1))
+
+    async def add(self, key: str, value: str, ttl: float) -> bool:
+        return bool(await self.client.set(self.prefix + key, value, px=max(int(ttl * 1000), 1), nx=True))
+
+    async def delete(self, key: str, value: str = None):
+        if value is None:
+            await self.client.delete(self.prefix + key)
+        else:
+            await self._delete_if(keys=[self.prefix + key], args=[value])
+
+    async def reserve(self, buckets: list, max_wait: float = None):
+        wait = await self._reserve(
+            keys=[self.prefix + key for key, _ in buckets],
+            args=[-1 if max_wait is None else max(max_wait, 0.0)] + [per_minute for _, per_minute in buckets],
+        )
+        return None if wait is None else float(wait)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def state_from_env(spec: str = SHARED_STATE, workers: int = WEB_CONCURRENCY) -> SharedState:
+    """SHARED_STATE=memory (default), sqlite:<path> or redis://host:port/db (rediss:// for TLS)"""
+    if spec.startswith("sqlite:"):
+        return SQLiteState(spec[len("sqlite:"):] or "shared_state.db")
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisState(spec)
+    if spec != "memory":
+        raise ValueError(f"Unknown SHARED_STATE {spec!r}; use memory, sqlite:<path> or redis://...")
+    if workers > 1:
+        # Each worker would keep its own idempotency entries and quota buckets
+        raise RuntimeError(
+            f"SHARED_STATE=memory can't be shared by WEB_CONCURRENCY={workers} workers; "
+            "use sqlite:<path> or redis://..., or leave SHARED_STATE unset"
+        )
+    return MemoryState()
+
+
+shared_state = state_from_env()
@@ -0,0 +1,241 @@
+"""
+Incremental sheet sync for populate_google_sheet mode="sync"
+Keeps a fingerprint of what was last written to each sheet (an 8-byte digest per
+cell, stored per row in SQLite) so a resend only writes the rows and cells that
+changed, in one values.batchUpdate, and deletes rows the table no longer has
+"""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+
+from starlette.concurrency import run_in_threadpool
+
+from bulk_loader import MAX_CHUNK_BYTES, MAX_CHUNK_ROWS, _estimate_size, a1_cell, a1_range, parse_a1
+
+SHEET_SYNC_DB = os.environ.get("SHEET_SYNC_DB", "sheet_sync.db")
+DIGEST_SIZE = 8
+
+
+def cell_digests(row) -> bytes:
+    # repr keeps 1, "1" and True apart, so a type change counts as a change
+    return b"".join(
+        hashlib.blake2b(repr(cell).encode("utf-8"), digest_size=DIGEST_SIZE).digest() for cell in row
+    )
+
+
+def _changed_span(new: bytes, old: bytes):
+    """First and last cell index that differ between two digest strings"""
+    width = max(len(new), len(old)) // DIGEST_SIZE
+    cells = [c for c in range(width)
+             if new[c * DIGEST_SIZE:(c + 1) * DIGEST_SIZE] != old[c * DIGEST_SIZE:(c + 1) * DIGEST_SIZE]]
+    return cells[0], cells[-1]
+
+
+class SyncPlan:
+    __slots__ = ("data", "fingerprints", "old_rows", "new_rows", "rows_changed", "cells_sent", "surplus_cols")
+
+    def __init__(self):
+        self.data = []  # values.batchUpdate ValueRange entries
+        self.fingerprints = {}  # table row -> digests, for rows that changed
+        self.old_rows = 0
+        self.new_rows = 0
+        self.rows_changed = 0
+        self.cells_sent = 0
+        self.surplus_cols = 0  # widest row past the end of the new table
+
+
+def plan_sync(old: dict, values: list, row0: int, col0: int, sheet: str = None) -> SyncPlan:
+    """
+    Compare the new table with the stored fingerprint row by row. Runs of
+    consecutive changed rows become one range covering the union of their
+    changed columns; cells that disappeared are overwritten with "".
+    """
+    plan = SyncPlan()
+    plan.old_rows = len(old)
+    plan.new_rows = len(values)
+    plan.surplus_cols = max((len(cells) // DIGEST_SIZE for r, cells in old.items() if r >= len(values)),
+                            default=0)
+    run = None  # [first_row, last_row, first_col, last_col]
+    runs = []
+
+    for r, row in enumerate(values):
+        digests = cell_digests(row)
+        previous = old.get(r, b"")
+        if digests == previous and r in old:
+            run = None
+            continue
+        plan.fingerprints[r] = digests
+        plan.rows_changed += 1
+        if not digests and not previous:
+            # New empty row; nothing to write
+            run = None
+            continue
+        first, last = _changed_span(digests, previous)
+        if run is not None and run[1] == r - 1:
+            run[1] = r
+            run[2] = min(run[2], first)
+            run[3] = max(run[3], last)
+        else:
+            run = [r, r, first, last]
+            runs.append(run)
+
+    for first_row, last_row, first_col, last_col in runs:
+        width = last_col - first_col + 1
+        for start in range(first_row, last_row + 1, MAX_CHUNK_ROWS):
+            end = min(start + MAX_CHUNK_ROWS, last_row + 1)
+            block = []
+            for row in values[start:end]:
+                cells = list(row[first_col:last_col + 1])
+                block.append(cells + [""] * (width - len(cells)))
+            plan.cells_sent += width * len(block)
+            plan.data.append({
+                "range": a1_range(row0 + start, col0 + first_col, len(block), width, sheet),
+                "values": block,
+            })
+    return plan
+
+
+class SyncStore:
+    def __init__(self, path: str = SHEET_SYNC_DB):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sheet_rows ("
+            "tenant TEXT NOT NULL, sheet_id TEXT NOT NULL, anchor TEXT NOT NULL, "
+            "row INTEGER NOT NULL, cells BLOB NOT NULL, "
+            "PRIMARY KEY (tenant, sheet_id, anchor, row)) WITHOUT ROWID"
+        )
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, tenant: str, sheet_id: str, anchor: str) -> dict:
+        rows = self._conn().execute(
+            "SELECT row, cells FROM sheet_rows WHERE tenant = ? AND sheet_id = ? AND anchor = ?",
+            (tenant, sheet_id, anchor),
+        )
+        return {row: bytes(cells) for row, cells in rows}
+
+    def save(self, tenant: str, sheet_id: str, anchor: str, fingerprints: dict, rows: int):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "DELETE FROM sheet_rows WHERE tenant = ? AND sheet_id = ? AND anchor = ? AND row >= ?",
+                (tenant, sheet_id, anchor, rows),
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO sheet_rows (tenant, sheet_id, anchor, row, cells) VALUES (?, ?, ?, ?, ?)",
+                [(tenant, sheet_id, anchor, r, cells) for r, cells in fingerprints.items()],
+            )
+
+    def forget(self, tenant: str, sheet_id: str) -> int:
+        conn = self._conn()
+        with conn:
+            return conn.execute(
+                "DELETE FROM sheet_rows WHERE tenant = ? AND sheet_id = ?", (tenant, sheet_id)
+            ).rowcount
+
+
+async def sheet_tab_id(client, sheet_id: str, title: str = None) -> int:
+    """Numeric sheetId of a tab by title; the first tab when title is None"""
+    spreadsheet = await client.call(
+        "sheets", "spreadsheets.get", spreadsheetId=sheet_id, fields="sheets.properties(sheetId,title)"
+    )
+    tabs = [s["properties"] for s in spreadsheet.get("sheets", [])]
+    for tab in tabs:
+        if title is None or tab.get("title") == title:
+            return tab.get("sheetId", 0)
+    raise ValueError(f"Sheet has no tab named {title!r}")
+
+
+class SheetSyncer:
+    def __init__(self, store: SyncStore):
+        self.store = store
+        self._locks = {}
+        self.syncs = 0
+        self.rows_skipped = 0
+        self.cells_sent = 0
+        self.forgotten = 0
+
+    def _lock(self, key) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    async def sync(self, client, tenant: str, sheet_id: str, start: str, values: list) -> dict:
+        sheet, row0, col0 = parse_a1(start)
+        anchor = a1_cell(row0, col0, sheet)
+        # One sync per sheet region at a time, or two could diff against the same fingerprint
+        async with self._lock((tenant, sheet_id, anchor)):
+            old = await run_in_threadpool(self.store.load, tenant, sheet_id, anchor)
+            plan = await run_in_threadpool(plan_sync, old, values, row0, col0, sheet)
+
+            for body in self._request_bodies(plan.data):
+                await client.call("sheets", "spreadsheets.values.batchUpdate", spreadsheetId=sheet_id, body=body)
+
+            rows_deleted = rows_cleared = 0
+            if plan.new_rows < plan.old_rows and col0 > 0:
+                # Whole-row deletes would take cells left of the region with them
+                if plan.surplus_cols:
+                    rows_cleared = plan.old_rows - plan.new_rows
+                    surplus = a1_range(row0 + plan.new_rows, col0, rows_cleared, plan.surplus_cols, sheet)
+                    await client.call("sheets", "spreadsheets.values.batchClear", spreadsheetId=sheet_id,
+                                      body={"ranges": [surplus]})
+            elif plan.new_rows < plan.old_rows:
+                rows_deleted = plan.old_rows - plan.new_rows
+                tab_id = await sheet_tab_id(client, sheet_id, sheet)
+                await client.call("sheets", "spreadsheets.batchUpdate", spreadsheetId=sheet_id, body={
+                    "requests": [{"deleteDimension": {"range": {
+                        "sheetId": tab_id, "dimension": "ROWS",
+                        "startIndex": row0 + plan.new_rows, "endIndex": row0 + plan.old_rows,
+                    }}}],
+                })
+
+            await run_in_threadpool(self.store.save, tenant, sheet_id, anchor, plan.fingerprints, plan.new_rows)
+
+        self.syncs += 1
+        self.rows_skipped += plan.new_rows - plan.rows_changed
+        self.cells_sent += plan.cells_sent
+        return {
+            "rows": plan.new_rows,
+            "rows_changed": plan.rows_changed,
+            "rows_deleted": rows_deleted,  # removed from the sheet, rows below moved up
+            "rows_cleared": rows_cleared,  # blanked in place, beside data left of the region
+            "ranges_written": len(plan.data),
+            "cells_sent": plan.cells_sent,
+        }
+
+    async def forget(self, tenant: str, sheet_id: str):
+        """Drop the fingerprints after any other write to the sheet; the next sync rewrites everything"""
+        if await run_in_threadpool(self.store.forget, tenant, sheet_id):
+            self.forgotten += 1
+
+    @staticmethod
+    def _request_bodies(data: list):
+        """Usually a single batchUpdate; very large deltas are split by approximate size"""
+        batch, size = [], 0
+        for entry in data:
+            entry_size = sum(_estimate_size(row) for row in entry["values"])
+            if batch and size + entry_size > MAX_CHUNK_BYTES:
+                yield {"valueInputOption": "RAW", "data": batch}
+                batch, size = [], 0
+            batch.append(entry)
+            size += entry_size
+        if batch:
+            yield {"valueInputOption": "RAW", "data": batch}
+
+    def stats(self) -> dict:
+        return {"syncs": self.syncs, "rows_skipped": self.rows_skipped, "cells_sent": self.cells_sent,
+                "forgotten": self.forgotten}
@@ -3,9 +3,9 @@
 Test script to verify authentication and test authenticated endpoints
 """
 
-import requests
+from bridge_client import BridgeClient, BRIDGE_URL
 
-BRIDGE_URL = "https://my-google-bridge-1b5a7ab10d6b.herokuapp.com"
+bridge = BridgeClient(BRIDGE_URL)
 
 def test_endpoints():
     """Test various endpoints to see authentication status"""
@@ -16,7 +16,7 @@ def test_endpoints():
     # Test 1: Health check
     print("\n📋 Test 1: Health Check")
     try:
-        response = requests.get(f"{BRIDGE_URL}/")
+        response = bridge.get("/")
         print(f"Status: {response.status_code}")
         print(f"Response: {response.json()}")
     except Exception as e:
@@ -25,8 +25,8 @@ def test_endpoints():
     # Test 2: Try to create document (should show auth status)
     print("\n📝 Test 2: Create Document (ChatGPT endpoint)")
     try:
-        response = requests.post(
-            f"{BRIDGE_URL}/create_doc_chat",
+        response = bridge.post(
+            "/create_doc_chat",
             json={"name": "Test Document"}
         )
         print(f"Status: {response.status_code}")
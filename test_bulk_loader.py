@@ -0,0 +1,85 @@
+"""
+Streaming bulk loader: CSV and NDJSON bodies arriving in arbitrary chunks, and
+chunked writes against the fake Google server
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from bulk_loader import SheetLoader, UploadRegistry, chunk_rows, iter_csv_rows, iter_ndjson_rows
+
+
+async def chunked(body: bytes, size: int):
+    for i in range(0, len(body), size):
+        yield body[i:i + size]
+
+
+def collect(rows) -> list:
+    async def drain():
+        return [row async for row in rows]
+    return asyncio.run(drain())
+
+
+CSV = (b'name,note\r\n'
+       b'plain,one line\r\n'
+       b'quoted,"two\r\nlines"\r\n'
+       b'blank,"before\n\nafter"\n'
+       b'escaped,"say ""hi"",\nthen go"\n'
+       b'last,no newline at the end')
+
+CSV_ROWS = [
+    ["name", "note"],
+    ["plain", "one line"],
+    ["quoted", "two\nlines"],
+    ["blank", "before\n\nafter"],
+    ["escaped", 'say "hi",\nthen go'],
+    ["last", "no newline at the end"],
+]
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, len(CSV)])
+def test_csv_quoted_fields_may_span_lines_and_chunks(size):
+    assert collect(iter_csv_rows(chunked(CSV, size))) == CSV_ROWS
+
+
+@pytest.mark.parametrize("size", [1, 5, 1024])
+def test_ndjson_escaped_newlines_stay_inside_their_cell(size):
+    rows = [["a\nb", 1], [], ["é", None, True]]
+    body = b"\n".join(json.dumps(row).encode("utf-8") for row in rows) + b"\r\n\n"
+    # Blank lines are skipped; an empty array is still a row
+    assert collect(iter_ndjson_rows(chunked(body, size))) == rows
+
+
+def test_ndjson_rows_must_be_arrays():
+    with pytest.raises(ValueError):
+        collect(iter_ndjson_rows(chunked(b'["ok"]\n{"not": "a row"}\n', 4)))
+
+
+def test_loader_writes_every_chunk_at_its_row(fake, google):
+    body = "".join(f'{i},"cell\n{i}"\n' for i in range(25)).encode("utf-8")
+
+    async def scenario():
+        async with google() as client:
+            sheet_id = (await client.call("sheets", "spreadsheets.create", body={}))["spreadsheetId"]
+            loader = SheetLoader(client, sheet_id, "B2", max_in_flight=3)
+            progress = await loader.load(chunk_rows(iter_csv_rows(chunked(body, 10)), max_rows=4))
+            return sheet_id, progress
+
+    sheet_id, progress = asyncio.run(scenario())
+    assert progress.state == "done"
+    assert progress.rows_written == progress.rows_committed == 25
+    assert progress.chunks_written == 7
+    cells = fake.sheets[sheet_id].cells
+    assert cells == {key: value for i in range(25)
+                     for key, value in ((("Sheet1", 1 + i, 1), str(i)), (("Sheet1", 1 + i, 2), f"cell\n{i}"))}
+
+
+def test_upload_progress_is_kept_per_tenant():
+    uploads = UploadRegistry()
+    mine = uploads.start("alice", "sheet1", "chosen-id")
+    theirs = uploads.start("bob", "sheet2", "chosen-id")
+    assert uploads.get("alice", "chosen-id") is mine
+    assert uploads.get("bob", "chosen-id") is theirs
+    assert uploads.get("carol", "chosen-id") is None
@@ -4,11 +4,13 @@ Test script for the new ChatGPT-friendly endpoints
 Tests /create_doc_chat and /create_sheet_chat
 """
 
-import requests
 import json
 
+from bridge_client import BridgeClient
+
 # Your Heroku app URL
 HEROKU_URL = "https://my-google-bridge-1b5a7ab10d6b.herokuapp.com"
+bridge = BridgeClient(HEROKU_URL)
 
 def test_chatgpt_endpoints():
     """Test the new ChatGPT-friendly endpoints"""
@@ -19,8 +21,8 @@ def test_chatgpt_endpoints():
     # Test 1: Create Document (should return auth error)
     print("\n📝 Testing /create_doc_chat...")
     try:
-        response = requests.post(
-            f"{HEROKU_URL}/create_doc_chat",
+        response = bridge.post(
+            "/create_doc_chat",
             json={"name": "Test Document from ChatGPT"},
             headers={"Content-Type": "application/json"}
         )
@@ -44,8 +46,8 @@ def test_chatgpt_endpoints():
     # Test 2: Create Sheet (should return auth error)
     print("\n📊 Testing /create_sheet_chat...")
     try:
-        response = requests.post(
-            f"{HEROKU_URL}/create_sheet_chat",
+        response = bridge.post(
+            "/create_sheet_chat",
             json={"name": "Test Sheet from ChatGPT"},
             headers={"Content-Type": "application/json"}
         )
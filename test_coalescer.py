@@ -0,0 +1,118 @@
+"""
+Write coalescer against the fake Google server
+Batching, splitting a rejected batch and retrying a doc write whose cached
+revision went stale.
+"""
+
+import asyncio
+
+from coalescer import WriteCoalescer
+from doc_index import doc_index_cache
+from google_client import GoogleAPIError
+
+
+def insert(text: str) -> dict:
+    return {"insertText": {"endOfSegmentLocation": {}, "text": text}}
+
+
+def test_concurrent_writes_share_one_call(fake, google):
+    coalescer = WriteCoalescer()
+
+    async def scenario():
+        async with google() as client:
+            sheet_id = (await client.call("sheets", "spreadsheets.create", body={}))["spreadsheetId"]
+            key = ("sheets", client.user, sheet_id, "RAW")
+            results = await asyncio.gather(*(
+                coalescer.submit(key, client, {"range": f"A{i + 1}", "values": [[i]]}) for i in range(5)
+            ))
+            return sheet_id, results
+
+    sheet_id, results = asyncio.run(scenario())
+    assert coalescer.calls == 1
+    assert [result["updatedRange"] for result in results] == ["A1", "A2", "A3", "A4", "A5"]
+    assert fake.sheets[sheet_id].cells == {("Sheet1", i, 0): i for i in range(5)}
+
+
+def test_rejected_batch_is_retried_op_by_op(fake, google):
+    coalescer = WriteCoalescer()
+    ranges = ["A1", "not a range", "A3"]
+
+    async def scenario():
+        async with google() as client:
+            sheet_id = (await client.call("sheets", "spreadsheets.create", body={}))["spreadsheetId"]
+            key = ("sheets", client.user, sheet_id, "RAW")
+            results = await asyncio.gather(*(
+                coalescer.submit(key, client, {"range": range_, "values": [["x"]]}) for range_ in ranges
+            ), return_exceptions=True)
+            return sheet_id, results
+
+    sheet_id, results = asyncio.run(scenario())
+    # The whole batch, then each op on its own
+    assert coalescer.calls == 4
+    assert isinstance(results[1], GoogleAPIError) and results[1].status == 400
+    assert results[0]["updatedRange"] == "A1" and results[2]["updatedRange"] == "A3"
+    assert fake.sheets[sheet_id].cells == {("Sheet1", 0, 0): "x", ("Sheet1", 2, 0): "x"}
+
+
+def test_rejected_doc_batch_is_applied_once(fake, google):
+    coalescer = WriteCoalescer()
+
+    async def scenario():
+        async with google() as client:
+            doc_id = (await client.call("docs", "documents.create", body={"title": "t"}))["documentId"]
+            key = ("docs", client.user, doc_id)
+            bad = {"insertText": {"location": {"index": 99}, "text": "nowhere"}}
+            results = await asyncio.gather(
+                coalescer.submit(key, client, {"requests": [insert("one ")], "delta": 4}),
+                coalescer.submit(key, client, {"requests": [bad], "delta": 7}),
+                coalescer.submit(key, client, {"requests": [insert("two")], "delta": 3}),
+                return_exceptions=True,
+            )
+            return doc_id, results
+
+    doc_id, results = asyncio.run(scenario())
+    assert isinstance(results[1], GoogleAPIError) and results[1].status == 400
+    assert fake.docs[doc_id].text == "one two\n"
+
+
+def test_cached_end_index_advances_with_each_batch(fake, google):
+    coalescer = WriteCoalescer()
+
+    async def scenario():
+        async with google() as client:
+            doc = await client.call("docs", "documents.create", body={"title": "t"})
+            doc_id = doc["documentId"]
+            doc_index_cache.set((client.user, doc_id), 2, doc["revisionId"])
+            key = ("docs", client.user, doc_id)
+            await asyncio.gather(
+                coalescer.submit(key, client, {"requests": [insert("abc")], "delta": 3}),
+                coalescer.submit(key, client, {"requests": [insert("défg")], "delta": 4}),
+            )
+            return doc_id, doc_index_cache.get((client.user, doc_id))
+
+    doc_id, cached = asyncio.run(scenario())
+    assert coalescer.calls == 1
+    assert cached.end_index == fake.docs[doc_id].end_index() == 9
+    assert cached.revision_id == fake.docs[doc_id].revision_id
+
+
+def test_stale_revision_is_dropped_and_the_write_retried(fake, google):
+    coalescer = WriteCoalescer()
+
+    async def scenario():
+        async with google() as client:
+            doc = await client.call("docs", "documents.create", body={"title": "t"})
+            doc_id = doc["documentId"]
+            doc_index_cache.set((client.user, doc_id), 2, doc["revisionId"])
+            # Written elsewhere, so the cached revision no longer matches
+            await client.call("docs", "documents.batchUpdate", documentId=doc_id,
+                              body={"requests": [insert("theirs ")]})
+            await coalescer.submit(("docs", client.user, doc_id), client, {"requests": [insert("mine")], "delta": 4})
+            return doc_id, doc_index_cache.get((client.user, doc_id))
+
+    doc_id, cached = asyncio.run(scenario())
+    assert fake.docs[doc_id].text == "theirs mine\n"
+    # create, their write, the rejected batch and its retry without writeControl
+    assert fake.calls["POST docs"] == 4
+    # The end index is unknown again until the next read
+    assert cached is None
@@ -0,0 +1,49 @@
+"""
+Columnar uploads: malformed column JSON is a 400, not a crash
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from columnar import decode_column_json
+
+MALFORMED = [
+    {"columns": [1, 2]},
+    {"columns": [{"dtype": "float64", "values": "oops"}]},
+    {"columns": [{"dtype": "float64", "values": [[1, 2]]}]},
+    {"columns": [{"dtype": "int64", "values": [1, None]}]},
+    {"columns": [{"dtype": "float64", "data": 12}]},
+    {"columns": [{"dtype": "float64", "data": "not base64!"}]},
+    {"columns": [{"dtype": "string", "values": {"a": 1}}]},
+    {"columns": [{"dtype": "float64", "values": [1, 2]}, {"dtype": "float64", "values": [1]}]},
+]
+
+
+@pytest.mark.parametrize("doc", MALFORMED)
+def test_malformed_columns_are_rejected(doc):
+    with pytest.raises(ValueError):
+        decode_column_json(json.dumps(doc).encode())
+
+
+def test_column_json_is_decoded():
+    table = decode_column_json(json.dumps({"columns": [
+        {"name": "city", "values": ["Oslo", "Rome"]},
+        {"dtype": "float64", "values": [1.5, 2]},
+    ]}).encode())
+    assert table.names == ["city", "column_2"]
+    assert table.rows == 2
+    assert table.columns[1].tolist() == [1.5, 2.0]
+
+
+def test_malformed_upload_is_a_400(fake, bridge):
+    async def scenario():
+        async with bridge() as (_, client):
+            return await client.post("/populate_google_sheet/columns", params={"sheet_id": "sheet000001"},
+                                     json={"columns": [1, 2]})
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 400
+    assert response.json() == {"status": "error", "message": "Each column must be an object, got int"}
+    assert fake.calls["PUT sheets"] == 0
@@ -0,0 +1,114 @@
+"""
+Completion cache: mode gating, the in-memory LRU and the SQLite store behind it
+"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from completion_cache import CompletionCache, SQLiteCompletionStore, cached_stream_text
+
+PROMPT = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "plan"}]}
+
+
+@pytest.mark.parametrize("mode, params, cached", [
+    ("deterministic", {**PROMPT, "temperature": 0}, True),
+    ("deterministic", {**PROMPT, "temperature": 0.7}, False),
+    # OpenAI samples at temperature 1 when none is given
+    ("deterministic", PROMPT, False),
+    ("all", {**PROMPT, "temperature": 0.7}, True),
+    ("off", {**PROMPT, "temperature": 0}, False),
+])
+def test_mode_decides_what_is_cached(mode, params, cached):
+    cache = CompletionCache(mode=mode)
+    assert (cache.key_for("completion", params) is not None) == cached
+    assert cache.stats()["bypassed"] == (0 if cached else 1)
+
+
+def test_default_mode_is_deterministic():
+    assert CompletionCache().mode == "deterministic"
+
+
+def test_key_covers_every_parameter():
+    cache = CompletionCache(mode="all")
+    key = cache.key_for("completion", {**PROMPT, "temperature": 0})
+    assert key == cache.key_for("completion", {"temperature": 0, **PROMPT})
+    assert key != cache.key_for("completion", {**PROMPT, "temperature": 0, "tools": []})
+    assert key != cache.key_for("stream_text", {**PROMPT, "temperature": 0})
+
+
+def test_lru_drops_the_least_recently_used():
+    cache = CompletionCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["memory_hits"] == 3 and cache.stats()["size"] == 2
+
+
+def test_sqlite_store_outlives_the_process_cache(tmp_path):
+    path = str(tmp_path / "completions.db")
+    CompletionCache(SQLiteCompletionStore(path)).put("a", {"text": "hello"})
+    restarted = CompletionCache(SQLiteCompletionStore(path))
+    assert restarted.get("a") == {"text": "hello"}
+    assert restarted.get("a") == {"text": "hello"}
+    assert (restarted.disk_hits, restarted.memory_hits) == (1, 1)
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = CompletionCache(SQLiteCompletionStore(str(tmp_path / "completions.db")), ttl=0.05)
+    cache.put("a", 1)
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert cache.misses == 1
+
+
+class StreamingClient:
+    """Stands in for AsyncOpenAI: streams `parts`, failing after `fail_after` of them"""
+
+    def __init__(self, parts, fail_after=None):
+        self.parts = parts
+        self.fail_after = fail_after
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **params):
+        self.calls += 1
+        return self.stream()
+
+    async def stream(self):
+        for i, part in enumerate(self.parts):
+            if i == self.fail_after:
+                raise ConnectionError("stream dropped")
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=part))])
+
+
+def collect(client, cache, **params) -> list:
+    async def scenario():
+        return [text async for text in cached_stream_text(client, cache, **params)]
+
+    return asyncio.run(scenario())
+
+
+def test_finished_stream_is_replayed_in_one_piece():
+    cache, client = CompletionCache(), StreamingClient(["[[", "1]", "]"])
+    assert collect(client, cache, **PROMPT, temperature=0) == ["[[", "1]", "]"]
+    assert collect(client, cache, **PROMPT, temperature=0) == ["[[1]]"]
+    assert client.calls == 1
+
+
+def test_sampled_or_broken_streams_are_not_stored():
+    cache = CompletionCache()
+    sampled = StreamingClient(["a", "b"])
+    collect(sampled, cache, **PROMPT, temperature=0.7)
+    collect(sampled, cache, **PROMPT, temperature=0.7)
+    assert sampled.calls == 2
+
+    broken = StreamingClient(["a", "b"], fail_after=1)
+    with pytest.raises(ConnectionError):
+        collect(broken, cache, **PROMPT, temperature=0)
+    assert cache.stats()["size"] == 0
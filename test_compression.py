@@ -0,0 +1,96 @@
+"""
+Compression middleware: compressed request bodies and compressed responses
+"""
+
+import asyncio
+import gzip
+import zlib
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+from compression import CompressionMiddleware
+
+LIMIT = 10_000
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware, minimum_size=100, max_body=LIMIT)
+
+
+@app.post("/echo")
+async def echo(request: Request):
+    body = b""
+    async for chunk in request.stream():
+        body += chunk
+    return PlainTextResponse(body.decode("utf-8"))
+
+
+@app.get("/text")
+async def text(size: int):
+    return PlainTextResponse("x" * size)
+
+
+@app.get("/ndjson")
+async def ndjson():
+    return StreamingResponse(iter(['{"n": 1}\n' * 50]), media_type="application/x-ndjson")
+
+
+def request(method: str, url: str, **kwargs) -> httpx.Response:
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.request(method, url, **kwargs)
+
+    return asyncio.run(scenario())
+
+
+def post(body: bytes, encoding: str) -> httpx.Response:
+    return request("POST", "/echo", content=body, headers={"Content-Encoding": encoding})
+
+
+def test_gzip_and_deflate_bodies_are_decompressed():
+    text = "hello " * 500
+    assert post(gzip.compress(text.encode()), "gzip").text == text
+    assert post(zlib.compress(text.encode()), "deflate").text == text
+
+
+def test_body_over_the_limit_is_a_413():
+    response = post(gzip.compress(b"x" * (LIMIT + 1)), "gzip")
+    assert response.status_code == 413
+    assert str(LIMIT) in response.json()["detail"]
+
+
+def test_unsupported_encoding_is_a_415():
+    response = post(b"whatever", "br")
+    assert response.status_code == 415
+    assert response.json()["status"] == "error"
+    assert "gzip" in response.json()["message"]
+
+
+def test_truncated_gzip_is_a_400():
+    body = gzip.compress(b"hello " * 500)
+    response = post(body[:len(body) // 2], "gzip")
+    assert response.status_code == 400
+    assert "truncated" in response.json()["detail"]
+
+
+def test_corrupt_gzip_is_a_400():
+    response = post(b"\x1f\x8b" + b"not gzip at all", "gzip")
+    assert response.status_code == 400
+
+
+def test_large_responses_are_compressed():
+    response = request("GET", "/text", params={"size": 5000}, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert int(response.headers["content-length"]) < 5000
+    assert response.text == "x" * 5000
+    assert "Accept-Encoding" in response.headers["vary"]
+
+
+def test_small_responses_and_streams_are_not():
+    small = request("GET", "/text", params={"size": 50}, headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+    stream = request("GET", "/ndjson", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in stream.headers
+    refused = request("GET", "/text", params={"size": 5000}, headers={"Accept-Encoding": "gzip;q=0"})
+    assert "content-encoding" not in refused.headers
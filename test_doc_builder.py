@@ -0,0 +1,127 @@
+"""
+Document builder: compile_blocks' index arithmetic, checked by applying the
+requests to the fake Google server and reading the ranges back
+"""
+
+import asyncio
+
+import pytest
+
+from doc_builder import compile_blocks, parse_markdown, validate_blocks, write_blocks
+from doc_index import NEW_DOC_END_INDEX, doc_index_cache
+from fake_google import CELL_START, ROW_START, TABLE_START
+
+REPORT = """# Weekly report
+
+Sales were **up** this week, see [the sheet](https://example.com).
+
+- first point
+- second point
+
+| Region | Total |
+|--------|-------|
+| North  | 12    |
+| South  |       |
+
+Thanks"""
+
+
+def build(google, *appends, inline=True):
+    """Create a doc and write_blocks each list of blocks in turn; returns the doc id and compiled docs"""
+    async def scenario():
+        async with google() as client:
+            doc_id = (await client.call("docs", "documents.create", body={"title": "t"}))["documentId"]
+            compiled = [await write_blocks(client, client.user, doc_id, blocks, inline) for blocks in appends]
+            return doc_id, compiled, doc_index_cache.get((client.user, doc_id))
+
+    return asyncio.run(scenario())
+
+
+def text_at(doc, start: int, end: int) -> str:
+    # Body index i is text[i - 1]; the fake counts characters, so tests stay in the BMP
+    return doc.text[start - 1:end - 1]
+
+
+def ranges(compiled, kind: str) -> list:
+    return [(r[kind]["range"]["startIndex"], r[kind]["range"]["endIndex"], r[kind])
+            for r in compiled.requests if kind in r]
+
+
+def test_length_matches_what_the_fake_ends_up_with(fake, google):
+    doc_id, (compiled,), cached = build(google, parse_markdown(REPORT))
+    doc = fake.docs[doc_id]
+    assert NEW_DOC_END_INDEX + compiled.length == doc.end_index()
+    assert cached.end_index == doc.end_index()
+
+
+def test_style_ranges_cover_their_text(fake, google):
+    doc_id, (compiled,), _ = build(google, parse_markdown(REPORT))
+    doc = fake.docs[doc_id]
+    headings = [text_at(doc, s, e) for s, e, r in ranges(compiled, "updateParagraphStyle")
+                if r["paragraphStyle"]["namedStyleType"] == "HEADING_1"]
+    assert headings == ["Weekly report"]
+    styled = {text_at(doc, s, e): r["textStyle"] for s, e, r in ranges(compiled, "updateTextStyle")}
+    assert styled == {
+        "up": {"bold": True},
+        "the sheet": {"link": {"url": "https://example.com"}},
+        "Region": {"bold": True},
+        "Total": {"bold": True},
+    }
+    (start, end, _), = ranges(compiled, "createParagraphBullets")
+    assert text_at(doc, start, end) == "first point\nsecond point"
+
+
+def test_table_cells_land_in_their_cells(fake, google):
+    doc_id, _, _ = build(google, parse_markdown(REPORT))
+    text = fake.docs[doc_id].text
+    before, table = text.split(TABLE_START)
+    assert before.endswith("second point\n")
+    # Each cell is its text and the newline ending its paragraph
+    rows = [[cell.split("\n", 1)[0] for cell in row.split(CELL_START)[1:]] for row in table.split(ROW_START)[1:]]
+    assert rows == [["Region", "Total"], ["North", "12"], ["South", ""]]
+    # The paragraph after a table is written into the empty one the table leaves
+    assert table.rsplit(CELL_START, 1)[1].split("\n", 1)[1] == "Thanks\n"
+
+
+def test_appending_to_a_written_doc_starts_a_new_paragraph(fake, google):
+    first = [{"type": "heading", "level": 2, "text": "Title"}, {"type": "paragraph", "text": "one"}]
+    second = [{"type": "paragraph", "text": "two"}, {"type": "heading", "level": 3, "text": "Next"}]
+    doc_id, (_, compiled), cached = build(google, first, second)
+    doc = fake.docs[doc_id]
+    assert doc.text == "Title\none\ntwo\nNext\n"
+    assert cached.end_index == doc.end_index()
+    # The appended range is reset to normal text before its own styles apply
+    (start, end, reset), *styles = ranges(compiled, "updateParagraphStyle")
+    assert reset["paragraphStyle"]["namedStyleType"] == "NORMAL_TEXT"
+    assert text_at(doc, start, end) == "two\nNext"
+    assert [text_at(doc, s, e) for s, e, _ in styles] == ["Next"]
+
+
+def test_lengths_count_utf16_units():
+    assert compile_blocks([{"type": "paragraph", "text": "😀"}]).length == 2
+
+
+def test_table_of_separators_only_is_rejected():
+    with pytest.raises(ValueError):
+        validate_blocks(parse_markdown("|---|---|\n|---|"))
+
+
+@pytest.mark.parametrize("cell", [{"a": 1}, ["a", "b"]])
+def test_table_cells_must_be_scalars(cell):
+    with pytest.raises(ValueError, match=r"cell \[1\]\[0\]"):
+        validate_blocks([{"type": "table", "rows": [["name", "qty"], [cell, 1]]}])
+    # Numbers, booleans and null are written as text
+    validate_blocks([{"type": "table", "rows": [["name", "qty"], ["apples", 3], [None, True]]}])
+
+
+def test_bad_blocks_are_a_400(fake, bridge):
+    async def scenario():
+        async with bridge() as (_, client):
+            return await client.post("/build_doc", json={"name": "report", "blocks": [
+                {"type": "table", "rows": [["name"], [{"nested": "object"}]]},
+            ]})
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 400
+    assert response.json()["message"].startswith("Block 0: table cell [1][0]")
+    assert fake.docs == {}
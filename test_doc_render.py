@@ -0,0 +1,76 @@
+"""
+Bulk rendering from a template: records are read line by line, within a size
+cap, and a bad body is a short 400
+"""
+
+import asyncio
+import json
+
+import pytest
+
+import main
+from doc_render import read_ndjson_records
+
+
+async def chunked(data: bytes, size: int = 5):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def test_render_records_keep_escaped_newlines():
+    def parse(body: bytes) -> list:
+        return asyncio.run(read_ndjson_records(chunked(body)))
+
+    assert parse(b'{"text": "one\\ntwo"}\r\n\r\n{"text": "three"}') == [{"text": "one\ntwo"}, {"text": "three"}]
+    with pytest.raises(ValueError, match="Line 2"):
+        parse(b'{"ok": 1}\n{"broken"\n')
+    with pytest.raises(ValueError, match="Line 1 must be a JSON object"):
+        parse(b'[1, 2]\n')
+
+
+def render(bridge, fake, body: bytes, content_type: str = "application/x-ndjson", with_template: bool = True):
+    """POST body to /docs/render against a template reading "Dear {{name}}"; returns the response and lines"""
+    async def scenario():
+        async with bridge() as (_, client):
+            params = {}
+            if with_template:
+                template_id = (await client.post("/create_doc_chat", json={"name": "letter"})).json()["doc_id"]
+                await client.post("/append_text_doc", json={"doc_id": template_id, "text": "Dear {{name}}"})
+                params = {"template_id": template_id, "title": "Letter to {{name}}"}
+            response = await client.post("/docs/render", params=params, content=body,
+                                         headers={"Content-Type": content_type})
+            return response, [json.loads(line) for line in response.text.splitlines() if line.startswith("{")]
+
+    return asyncio.run(scenario())
+
+
+def test_ndjson_records_are_rendered(fake, bridge):
+    response, lines = render(bridge, fake, b'{"name": "Ada"}\n{"name": "Grace"}\n')
+    assert response.status_code == 200
+    assert lines[-1] == {"status": "done", "rendered": 2, "failed": 0}
+    titles = sorted(doc.title for doc in fake.docs.values() if doc.title.startswith("Letter to"))
+    assert titles == ["Letter to Ada", "Letter to Grace"]
+    texts = sorted(fake.docs[line["doc_id"]].text.split("\n")[0] for line in lines[:-1])
+    assert texts == ["Dear Ada", "Dear Grace"]
+
+
+def test_oversized_body_is_a_413(fake, bridge, monkeypatch):
+    monkeypatch.setattr(main, "DOC_RENDER_MAX_BYTES", 100)
+    response, _ = render(bridge, fake, b'{"name": "Ada"}\n' * 20)
+    assert response.status_code == 413
+    assert response.json() == {"status": "error", "message": "Body exceeds 100 bytes"}
+    assert not any(doc.title.startswith("Letter to") for doc in fake.docs.values())
+
+
+@pytest.mark.parametrize("body, content_type, message", [
+    (b'{"name": "Ada"}\n{"name": \n', "application/x-ndjson", "Line 2 is not valid JSON: "),
+    (b'{"records": [{"name": "Ada"}]}', "application/json", "template_id: Field required"),
+    (b'{"template_id": "t", "records": "Ada"}', "application/json", "records: Input should be a valid list"),
+    (b'[]', "application/json", "Body must be a JSON object"),
+    (b'{"template_id": ', "application/json", "Body is not valid JSON: "),
+])
+def test_bad_bodies_get_a_short_message(fake, bridge, body, content_type, message):
+    response, _ = render(bridge, fake, body, content_type, with_template=False)
+    assert response.status_code == 400
+    assert response.json()["message"].startswith(message)
+    assert "\n" not in response.json()["message"]
@@ -0,0 +1,111 @@
+"""
+Drive changes feed: the bridge's syncs, the owner's UI edits and other people's
+edits each reset only what they made stale
+"""
+
+import asyncio
+import time
+
+import main
+from doc_index import doc_index_cache
+
+TABLE = [["name", "qty"], ["apples", 3], ["pears", 5]]
+
+
+def edit_in_google(fake, sheet_id: str, token: str):
+    """An edit made in the Sheets UI by the account holding `token`"""
+    sheet = fake.sheets[sheet_id]
+    sheet.cells[("Sheet1", 5, 0)] = "note"
+    sheet.version += 1
+    sheet.modified_by = f"Bearer {token}"
+    fake.changes.append({"fileId": sheet_id, "time": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())})
+
+
+def run(bridge, steps):
+    """Watch the default tenant, then run each async step(main, client); returns their results"""
+    async def scenario():
+        async with bridge() as (main, client):
+            await client.post("/changes/watch")
+            await client.post("/changes/poll")
+            results = [await step(main, client) for step in steps]
+            await client.delete("/changes/watch")
+            return results
+
+    return asyncio.run(scenario())
+
+
+async def create_sheet(main, client):
+    return (await client.post("/create_sheet_chat", json={"name": "stock"})).json()["sheet_id"]
+
+
+def sync(sheet_id: dict):
+    async def step(main, client):
+        response = await client.post("/populate_google_sheet", json={
+            "sheet_id": sheet_id["id"], "values": TABLE, "mode": "sync"})
+        return response.json()["cells_sent"]
+    return step
+
+
+def poll():
+    async def step(main, client):
+        return (await client.post("/changes/poll")).json()["changes"]
+    return step
+
+
+def test_own_sync_keeps_its_fingerprints(fake, bridge):
+    sheet = {}
+
+    async def created(main, client):
+        sheet["id"] = await create_sheet(main, client)
+
+    _, first, events, second = run(bridge, [created, sync(sheet), poll(), sync(sheet)])
+    assert first == 6
+    synced = [event for event in events if event["version"] == str(fake.sheets[sheet["id"]].version)]
+    assert synced and all(event["modified_by_me"] and event["by_bridge"] for event in synced)
+    # Nothing changed since the recorded sync, so nothing is sent again
+    assert second == 0
+
+
+def test_owner_ui_edit_drops_the_fingerprints(fake, bridge):
+    sheet = {}
+
+    async def created(main, client):
+        sheet["id"] = await create_sheet(main, client)
+
+    async def owner_edit(main, client):
+        edit_in_google(fake, sheet["id"], "bench-token")
+
+    _, first, _, _, events, second = run(bridge, [created, sync(sheet), poll(), owner_edit, poll(), sync(sheet)])
+    assert [(e["modified_by_me"], e["by_bridge"]) for e in events] == [(True, False)]
+    # The fingerprints were dropped, so the whole table is written again
+    assert second == first == 6
+
+
+def test_doc_index_is_kept_for_own_edits_and_dropped_for_others(fake, bridge, monkeypatch):
+    doc, version_reads = {}, []
+    real_drive_version = main.drive_version
+
+    async def drive_version(client, file_id):
+        version_reads.append(file_id)
+        return await real_drive_version(client, file_id)
+
+    monkeypatch.setattr(main, "drive_version", drive_version)
+
+    async def created(main, client):
+        doc["id"] = (await client.post("/create_doc_chat", json={"name": "notes"})).json()["doc_id"]
+        await client.post("/append_text_doc", json={"doc_id": doc["id"], "text": "hello"})
+
+    async def cached(main, client):
+        return doc_index_cache.get((main.DEFAULT_TENANT, doc["id"])) is not None
+
+    async def someone_else_edits(main, client):
+        fake.docs[doc["id"]].modified_by = "Bearer someone-else"
+        fake.changes.append({"fileId": doc["id"], "time": "2026-01-01T00:00:00.000Z"})
+
+    _, own, kept, _, others, dropped = run(bridge, [created, poll(), cached, someone_else_edits, poll(), cached])
+    # The bridge's doc writes cost no files.get of their own
+    assert version_reads == []
+    assert own and all(e["modified_by_me"] and not e["by_bridge"] for e in own)
+    assert kept is True
+    assert [e["modified_by_me"] for e in others] == [False]
+    assert dropped is False
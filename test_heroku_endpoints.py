@@ -4,11 +4,14 @@ Simple script to test individual API endpoints on Heroku
 Update the HEROKU_URL variable with your actual Heroku app URL
 """
 
-import requests
+import httpx
 import json
 
+from bridge_client import BridgeClient
+
 # Your Heroku app URL
 HEROKU_URL = "https://my-google-bridge-1b5a7ab10d6b.herokuapp.com"
+bridge = BridgeClient(HEROKU_URL)
 
 def test_endpoint(endpoint, method="GET", data=None):
     """Test a specific API endpoint"""
@@ -19,9 +22,9 @@ def test_endpoint(endpoint, method="GET", data=None):
     
     try:
         if method == "GET":
-            response = requests.get(url)
+            response = bridge.get(endpoint)
         elif method == "POST":
-            response = requests.post(url, json=data, headers={"Content-Type": "application/json"})
+            response = bridge.post(endpoint, json=data, headers={"Content-Type": "application/json"})
         else:
             print(f"❌ Unsupported method: {method}")
             return
@@ -43,7 +46,7 @@ def test_endpoint(endpoint, method="GET", data=None):
             except:
                 print(f"🚨 Error: {response.text}")
                 
-    except requests.exceptions.ConnectionError:
+    except httpx.ConnectError:
         print("❌ Connection Error: Cannot reach the API")
     except Exception as e:
         print(f"❌ Unexpected Error: {e}")
@@ -0,0 +1,64 @@
+"""
+Idempotency-Key on the create endpoints: retries are replayed, never repeated
+"""
+
+import asyncio
+
+
+def create_docs(bridge, *attempts, concurrent=False):
+    """POST /create_doc_chat once per (key, name); returns the responses"""
+    async def scenario():
+        async with bridge() as (_, client):
+            requests = [client.post("/create_doc_chat", json={"name": name}, headers={"Idempotency-Key": key})
+                        for key, name in attempts]
+            if concurrent:
+                return await asyncio.gather(*requests)
+            return [await request for request in requests]
+
+    return asyncio.run(scenario())
+
+
+def test_retry_is_replayed(fake, bridge):
+    first, retry = create_docs(bridge, ("replay-1", "report"), ("replay-1", "report"))
+    assert first.json()["status"] == "success"
+    assert retry.json() == first.json()
+    assert "idempotent-replayed" not in first.headers
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert len(fake.docs) == 1
+
+
+def test_concurrent_duplicates_create_one_doc(fake, bridge):
+    responses = create_docs(bridge, *[("concurrent-1", "report")] * 5, concurrent=True)
+    assert {response.json()["doc_id"] for response in responses} == {responses[0].json()["doc_id"]}
+    assert len(fake.docs) == 1
+
+
+def test_key_reused_with_another_body_is_a_422(fake, bridge):
+    first, reused = create_docs(bridge, ("reuse-1", "report"), ("reuse-1", "other report"))
+    assert first.status_code == 200
+    assert reused.status_code == 422
+    assert reused.json()["status"] == "error"
+    assert len(fake.docs) == 1
+
+
+def test_different_keys_are_independent(fake, bridge):
+    first, second = create_docs(bridge, ("independent-1", "report"), ("independent-2", "report"))
+    assert first.json()["doc_id"] != second.json()["doc_id"]
+    assert len(fake.docs) == 2
+
+
+def test_failure_is_not_replayed(fake, bridge):
+    async def scenario():
+        async with bridge() as (_, client):
+            headers = {"Idempotency-Key": "failure-1"}
+            fake.config.update({"error_rate": 1})
+            failed = await client.post("/create_doc_chat", json={"name": "report"}, headers=headers)
+            fake.config.update({"error_rate": 0})
+            retried = await client.post("/create_doc_chat", json={"name": "report"}, headers=headers)
+            return failed, retried
+
+    failed, retried = asyncio.run(scenario())
+    assert failed.json()["status"] == "error"
+    assert retried.json()["status"] == "success"
+    assert "idempotent-replayed" not in retried.headers
+    assert len(fake.docs) == 1
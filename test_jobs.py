@@ -0,0 +1,62 @@
+"""
+Background jobs: params are validated before a job is enqueued
+"""
+
+import asyncio
+import json
+
+import pytest
+
+
+async def finished(client, job_id: str) -> dict:
+    async with client.stream("GET", f"/jobs/{job_id}/events") as events:
+        async for line in events.aiter_lines():
+            if line.startswith("data: "):
+                snapshot = json.loads(line[len("data: "):])
+    return snapshot
+
+
+@pytest.mark.parametrize("kind, params, field", [
+    ("populate_google_sheet", {"sheet_id": "sheet000001", "values": "oops"}, "values"),
+    ("populate_google_sheet", {"values": [["a"]]}, "sheet_id"),
+    ("create_sheet_and_populate", {"name": "t", "values": [["a"]], "range": ["A1"]}, "range"),
+    ("create_doc_with_text", {"name": "t", "paragraphs": [{"text": "one"}]}, "paragraphs.0"),
+])
+def test_bad_params_are_rejected_before_enqueueing(fake, bridge, kind, params, field):
+    async def scenario():
+        async with bridge() as (main, client):
+            response = await client.post("/jobs", json={"kind": kind, "params": params})
+            return response, main.job_runner.store.unfinished()
+
+    response, queued = asyncio.run(scenario())
+    assert response.status_code == 400
+    assert response.json()["message"].startswith(f"Invalid params: {field}: ")
+    assert queued == []
+
+
+def test_unknown_kind_is_rejected(fake, bridge):
+    async def scenario():
+        async with bridge() as (_, client):
+            return await client.post("/jobs", json={"kind": "nope", "params": {}})
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 400
+    assert "populate_google_sheet" in response.json()["kinds"]
+
+
+def test_valid_job_runs_with_defaults_filled_in(fake, bridge):
+    async def scenario():
+        async with bridge() as (main, client):
+            sheet = await client.post("/create_sheet_chat", json={"name": "t"})
+            sheet_id = sheet.json()["sheet_id"]
+            accepted = await client.post("/jobs", json={"kind": "populate_google_sheet", "params": {
+                "sheet_id": sheet_id, "values": [["a", 1], ["b", 2]],
+            }})
+            job = await finished(client, accepted.json()["job_id"])
+            return sheet_id, accepted, job, main.job_runner.get(job["job_id"]).params
+
+    sheet_id, accepted, job, params = asyncio.run(scenario())
+    assert accepted.status_code == 202
+    assert job["state"] == "done", job
+    assert params["range"] == "A1"
+    assert fake.sheets[sheet_id].cells[("Sheet1", 1, 1)] == 2
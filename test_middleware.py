@@ -4,6 +4,7 @@ Test script for the ChatGPT Middleware
 Tests the function calling without requiring interactive input
 """
 
+import asyncio
 import os
 import sys
 
@@ -27,11 +28,15 @@ print("🔑 Testing middleware functionality...")
 
 # Test the bridge connection first
 try:
-    from middleware import call_bridge, BRIDGE_URL
+    from middleware import call_bridge, open_bridge, BRIDGE_URL
     print(f"✅ Bridge URL configured: {BRIDGE_URL}")
-    
+
+    async def check_bridge():
+        async with open_bridge() as http:
+            return await call_bridge(http, "create_doc_chat", {"name": "Test Document"})
+
     # Test bridge connection
-    result = call_bridge("create_doc_chat", {"name": "Test Document"})
+    result = asyncio.run(check_bridge())
     print("✅ Bridge connection successful")
     print(f"📋 Response: {result}")
     
@@ -0,0 +1,104 @@
+"""
+Outbound scheduler against the fake Google server
+Retries, Retry-After and the per-request deadline.
+"""
+
+import asyncio
+import time
+
+import pytest
+
+import outbound
+from google_client import GoogleAPIError
+from outbound import DeadlineExceeded, start_request_deadline
+
+
+def test_retry_after_is_honored(fake, google, scheduler, monkeypatch):
+    # The second request is over quota and told to come back in a second
+    answers = iter([None, 1.0])
+    monkeypatch.setattr(fake, "check_quota", lambda api, kind, token: next(answers, None))
+
+    async def scenario():
+        async with google() as client:
+            sheet = await client.call("sheets", "spreadsheets.create", body={"properties": {"title": "t"}})
+            started = time.monotonic()
+            await client.call("sheets", "spreadsheets.get", spreadsheetId=sheet["spreadsheetId"])
+            return time.monotonic() - started
+
+    elapsed = asyncio.run(scenario())
+    assert fake.calls["429"] == 1
+    assert scheduler.retries == 1
+    # Backoff alone sleeps at most GOOGLE_BACKOFF_CAP (0.05s here)
+    assert elapsed >= 1.0
+
+
+def test_retry_after_past_the_deadline_fails_fast(fake, google, scheduler, monkeypatch):
+    monkeypatch.setattr(fake, "check_quota", lambda api, kind, token: 30.0)
+
+    async def scenario():
+        start_request_deadline(2)
+        async with google() as client:
+            started = time.monotonic()
+            with pytest.raises(GoogleAPIError) as raised:
+                await client.call("sheets", "spreadsheets.create", body={})
+            return raised.value, time.monotonic() - started
+
+    error, elapsed = asyncio.run(scenario())
+    assert error.status == 429
+    assert error.retry_after == 30
+    assert elapsed < 1
+    assert scheduler.retries == 0
+    assert scheduler.deadline_exceeded == 1
+
+
+def test_quota_wait_past_the_deadline_sends_nothing(fake, google, scheduler, monkeypatch):
+    # One write per minute per user: the second one would wait a minute
+    monkeypatch.setitem(outbound.QUOTAS, ("sheets", "write"), (600, 1))
+
+    async def scenario():
+        start_request_deadline(2)
+        async with google() as client:
+            await client.call("sheets", "spreadsheets.create", body={})
+            with pytest.raises(DeadlineExceeded):
+                await client.call("sheets", "spreadsheets.create", body={})
+
+    asyncio.run(scenario())
+    assert fake.calls["POST sheets"] == 1
+    assert scheduler.deadline_exceeded == 1
+
+
+def test_quota_wait_within_the_deadline_is_slept_off(fake, google, scheduler, monkeypatch):
+    # 120 per minute: once the bucket is drained a token comes every half second
+    monkeypatch.setitem(outbound.QUOTAS, ("sheets", "read"), (600, 120))
+
+    async def scenario():
+        start_request_deadline(5)
+        async with google() as client:
+            sheet = await client.call("sheets", "spreadsheets.create", body={})
+            for _ in range(120):
+                await scheduler.acquire("sheets", "read", client.user)
+            started = time.monotonic()
+            await client.call("sheets", "spreadsheets.get", spreadsheetId=sheet["spreadsheetId"])
+            return time.monotonic() - started
+
+    elapsed = asyncio.run(scenario())
+    assert scheduler.throttled >= 1
+    assert 0.4 <= elapsed < 5
+
+
+def test_unavailable_is_retried_only_when_safe(fake, google, scheduler):
+    fake.config.update({"error_rate": 1})
+
+    async def scenario():
+        async with google() as client:
+            with pytest.raises(GoogleAPIError) as read_error:
+                await client.call("sheets", "spreadsheets.get", spreadsheetId="sheet000001")
+            with pytest.raises(GoogleAPIError) as write_error:
+                await client.call("docs", "documents.batchUpdate", documentId="doc000001", body={"requests": []})
+            return read_error.value, write_error.value
+
+    read_error, write_error = asyncio.run(scenario())
+    assert read_error.status == write_error.status == 503
+    assert fake.calls["GET sheets"] == outbound.MAX_ATTEMPTS
+    # A POST that may already have been applied is not repeated
+    assert fake.calls["POST docs"] == 1
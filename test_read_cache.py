@@ -0,0 +1,92 @@
+"""
+Read cache: ETags, 304s and the Drive version check in front of every read
+"""
+
+import asyncio
+
+import main
+from read_cache import ReadCache, etag_matches, make_etag
+
+
+def read_doc_twice(fake, bridge, between=None):
+    """Create a doc with text, read it, run between(main, client, doc_id), then read it again with the ETag"""
+    async def scenario():
+        async with bridge() as (main, client):
+            doc_id = (await client.post("/create_doc_chat", json={"name": "report"})).json()["doc_id"]
+            await client.post("/append_text_doc", json={"doc_id": doc_id, "text": "first"})
+            first = await client.get(f"/docs/{doc_id}")
+            calls = dict(fake.calls)
+            if between is not None:
+                await between(main, client, doc_id)
+            second = await client.get(f"/docs/{doc_id}", headers={"If-None-Match": first.headers["etag"]})
+            return doc_id, first, second, {k: n - calls.get(k, 0) for k, n in fake.calls.items() if n > calls.get(k, 0)}
+
+    return asyncio.run(scenario())
+
+
+def test_unchanged_doc_is_a_304(fake, bridge):
+    _, first, second, calls = read_doc_twice(fake, bridge)
+    assert first.status_code == 200 and first.json()["text"].startswith("first")
+    assert second.status_code == 304
+    assert second.headers["etag"] == first.headers["etag"]
+    # Only the version check went to Google
+    assert calls == {"GET drive": 1}
+
+
+def test_bridge_write_changes_the_etag(fake, bridge):
+    async def append(main, client, doc_id):
+        await client.post("/append_text_doc", json={"doc_id": doc_id, "text": "second"})
+
+    _, first, second, _ = read_doc_twice(fake, bridge, append)
+    assert second.status_code == 200
+    assert second.headers["etag"] != first.headers["etag"]
+    assert "second" in second.json()["text"]
+
+
+def test_outside_edit_is_seen_through_the_drive_version(fake, bridge):
+    async def edit_in_google(main, client, doc_id):
+        doc = fake.docs[doc_id]
+        doc.text = "edited elsewhere\n"
+        doc.revision += 1
+
+    _, first, second, calls = read_doc_twice(fake, bridge, edit_in_google)
+    assert second.status_code == 200
+    assert second.json()["text"] == "edited elsewhere\n"
+    assert calls["GET drive"] == 1 and calls["GET docs"] == 1
+
+
+def test_cached_body_is_reused_without_an_etag(fake, bridge):
+    async def scenario():
+        async with bridge() as (_, client):
+            doc_id = (await client.post("/create_doc_chat", json={"name": "report"})).json()["doc_id"]
+            for _ in range(3):
+                await client.get(f"/docs/{doc_id}")
+
+    hits = main.read_cache.hits
+    asyncio.run(scenario())
+    assert main.read_cache.hits - hits == 2
+    assert fake.calls["GET docs"] == 1
+
+
+def test_etag_matching():
+    etag = make_etag("doc1", "7")
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches(make_etag("doc1", "8"), etag)
+    assert make_etag("doc1", "7", "text") != make_etag("doc1", "7", "json")
+
+
+def test_cache_evicts_the_least_recently_used():
+    cache = ReadCache(max_entries=2, max_bytes=1000)
+
+    async def scenario():
+        for name in ("a", "b", "a", "c"):
+            await cache.get((name,), name, "1", lambda: asyncio.sleep(0, {"text": name}))
+        return cache.stats()
+
+    stats = asyncio.run(scenario())
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 3, 2)
+    cache.invalidate("a")
+    assert cache.stats()["size"] == 1 and cache.stats()["invalidations"] == 1
@@ -0,0 +1,26 @@
+"""
+RowStreamParser: rows of a JSON table come out as soon as they close
+"""
+
+import pytest
+
+from row_stream import RowStreamParser
+
+
+PLAN = '```json\n[["Day", "Caption"], [1, "Use [brackets] and \\"quotes\\""], [2, "back\\\\slash ]"]]\n```'
+
+
+@pytest.mark.parametrize("size", [1, 2, 5, len(PLAN)])
+def test_row_stream_parser_yields_complete_rows(size):
+    parser = RowStreamParser()
+    rows = []
+    for i in range(0, len(PLAN), size):
+        rows.extend(parser.feed(PLAN[i:i + size]))
+    assert rows == [["Day", "Caption"], [1, 'Use [brackets] and "quotes"'], [2, "back\\slash ]"]]
+
+
+def test_row_stream_parser_returns_a_row_as_soon_as_it_closes():
+    parser = RowStreamParser()
+    assert parser.feed('[["a", 1], ["b", "x') == [["a", 1]]
+    assert parser.feed('y"') == []
+    assert parser.feed(']]') == [["b", "xy"]]
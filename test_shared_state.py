@@ -0,0 +1,151 @@
+"""
+Shared state: claims, quota buckets and job leases hold across worker processes
+Separate SQLiteState instances on one file stand in for workers, and one test
+races real processes.
+"""
+
+import asyncio
+import multiprocessing
+import time
+
+import pytest
+
+from idempotency import IdempotencyCache
+from jobs import Job, JobRunner, JobStore
+from shared_state import MemoryState, SQLiteState, state_from_env
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def state(request, tmp_path):
+    return MemoryState() if request.param == "memory" else SQLiteState(str(tmp_path / "state.db"))
+
+
+def test_add_claims_a_key_once(state):
+    async def scenario():
+        first = await state.add("k", "one", 60)
+        second = await state.add("k", "two", 60)
+        return first, second, await state.get("k")
+
+    assert asyncio.run(scenario()) == (True, False, "one")
+
+
+def test_expired_key_can_be_claimed_again(state):
+    async def scenario():
+        await state.add("k", "one", 0.05)
+        await asyncio.sleep(0.1)
+        return await state.get("k"), await state.add("k", "two", 60), await state.get("k")
+
+    assert asyncio.run(scenario()) == (None, True, "two")
+
+
+def test_delete_with_a_value_only_releases_your_own_claim(state):
+    async def scenario():
+        await state.add("k", "mine", 60)
+        await state.delete("k", "theirs")
+        kept = await state.get("k")
+        await state.delete("k", "mine")
+        return kept, await state.get("k")
+
+    assert asyncio.run(scenario()) == ("mine", None)
+
+
+def test_reserve_is_all_or_nothing(state):
+    async def scenario():
+        # 60 per minute is one token a second; the second bucket is drained first
+        for _ in range(60):
+            await state.reserve([("b", 60)])
+        refused = await state.reserve([("a", 60), ("b", 60)], max_wait=0.5)
+        # "a" must still be full: the refused reservation took nothing
+        waits = [await state.reserve([("a", 60)]) for _ in range(60)]
+        return refused, waits, await state.reserve([("a", 60), ("b", 60)])
+
+    refused, waits, wait = asyncio.run(scenario())
+    assert refused is None
+    assert waits == [0.0] * 60
+    assert 0.9 < wait <= 1.0
+
+
+def _claim(path: str, start: float, results):
+    state = SQLiteState(path)
+    time.sleep(max(0.0, start - time.time()))
+    results.put(asyncio.run(state.add("claim", str(multiprocessing.current_process().pid), 60)))
+
+
+def test_one_process_wins_a_claim(tmp_path):
+    path = str(tmp_path / "state.db")
+    SQLiteState(path)
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    start = time.time() + 0.5
+    workers = [context.Process(target=_claim, args=(path, start, results)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(10)
+    assert sorted(results.get(timeout=1) for _ in workers) == [False, False, False, True]
+
+
+def test_two_sqlite_workers_share_quota_buckets(tmp_path):
+    one, two = SQLiteState(str(tmp_path / "state.db")), SQLiteState(str(tmp_path / "state.db"))
+
+    async def scenario():
+        for i in range(60):
+            await (one if i % 2 else two).reserve([("sheets:write", 60)])
+        return await one.reserve([("sheets:write", 60)], max_wait=0.5)
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_duplicate_on_another_worker_waits_for_the_first(tmp_path):
+    one = IdempotencyCache(SQLiteState(str(tmp_path / "state.db")))
+    two = IdempotencyCache(SQLiteState(str(tmp_path / "state.db")))
+    produced = []
+
+    async def produce():
+        produced.append(1)
+        await asyncio.sleep(0.3)
+        return {"status": "success", "doc_id": "doc1"}
+
+    async def scenario():
+        first = asyncio.create_task(one.run("create:k1", "f", produce))
+        await asyncio.sleep(0.05)
+        return await asyncio.gather(first, two.run("create:k1", "f", produce))
+
+    (first, _), (second, replayed) = asyncio.run(scenario())
+    assert produced == [1]
+    assert second == first and replayed
+    assert two.joined == 1
+
+
+def test_a_job_runs_on_one_worker_only(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    runs = []
+
+    async def handler(job, report):
+        runs.append(job.id)
+        await asyncio.sleep(0.2)
+        return {"ok": True}
+
+    runners = [JobRunner(store, {"work": handler}, state=SQLiteState(str(tmp_path / "state.db")))
+               for _ in range(2)]
+
+    async def scenario():
+        # Left behind by a restart: both workers find it on startup
+        store.insert(Job("job1", "tenant", "work", {}))
+        for runner in runners:
+            await runner.start()
+        while store.get("job1").state != "done":
+            await asyncio.sleep(0.05)
+        for runner in runners:
+            await runner.stop()
+
+    asyncio.run(scenario())
+    assert runs == ["job1"]
+
+
+def test_memory_state_is_refused_for_several_workers(tmp_path):
+    with pytest.raises(RuntimeError):
+        state_from_env("memory", workers=2)
+    with pytest.raises(ValueError):
+        state_from_env("postgres://db", workers=1)
+    assert isinstance(state_from_env(f"sqlite:{tmp_path / 'state.db'}", workers=4), SQLiteState)
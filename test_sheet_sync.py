@@ -0,0 +1,113 @@
+"""
+Incremental sheet sync: plan_sync's diff and SheetSyncer against the fake Google server
+"""
+
+import asyncio
+
+from sheet_sync import SheetSyncer, SyncStore, cell_digests, plan_sync
+
+
+def fingerprint(values: list) -> dict:
+    return {r: cell_digests(row) for r, row in enumerate(values)}
+
+
+def test_first_sync_writes_the_whole_table():
+    plan = plan_sync({}, [["a", 1], ["b", 2]], 0, 0)
+    assert plan.data == [{"range": "A1:B2", "values": [["a", 1], ["b", 2]]}]
+    assert plan.rows_changed == 2
+    assert plan.cells_sent == 4
+    assert set(plan.fingerprints) == {0, 1}
+
+
+def test_unchanged_table_sends_nothing():
+    values = [["a", 1], ["b", 2]]
+    plan = plan_sync(fingerprint(values), values, 0, 0)
+    assert plan.data == []
+    assert plan.rows_changed == 0
+    assert plan.fingerprints == {}
+
+
+def test_only_the_changed_cell_is_sent():
+    old = [["a", 1, "x"], ["b", 2, "y"], ["c", 3, "z"]]
+    plan = plan_sync(fingerprint(old), [["a", 1, "x"], ["b", 2, "Y"], ["c", 3, "z"]], 0, 0)
+    assert plan.data == [{"range": "C2:C2", "values": [["Y"]]}]
+    assert plan.cells_sent == 1
+    assert set(plan.fingerprints) == {1}
+
+
+def test_adjacent_changed_rows_share_one_range():
+    old = [["a", 1, "x"], ["b", 2, "y"], ["c", 3, "z"]]
+    plan = plan_sync(fingerprint(old), [["A", 1, "x"], ["b", 2, "Y"], ["c", 3, "z"]], 0, 0)
+    # Rows 1-2 changed in columns A and C: one block covering A1:C2
+    assert plan.data == [{"range": "A1:C2", "values": [["A", 1, "x"], ["b", 2, "Y"]]}]
+    assert plan.cells_sent == 6
+
+
+def test_type_change_counts_as_a_change():
+    plan = plan_sync(fingerprint([[1, True]]), [["1", True]], 0, 0)
+    assert plan.data == [{"range": "A1:A1", "values": [["1"]]}]
+
+
+def test_cells_that_disappeared_are_blanked():
+    plan = plan_sync(fingerprint([["a", "b", "c"]]), [["a"]], 0, 0)
+    assert plan.data == [{"range": "B1:C1", "values": [["", ""]]}]
+
+
+def test_ranges_are_offset_by_the_anchor():
+    plan = plan_sync({}, [["a", "b", "c"]], 2, 1, "Data")
+    assert plan.data == [{"range": "'Data'!B3:D3", "values": [["a", "b", "c"]]}]
+
+
+def test_shrinking_reports_the_rows_and_columns_left_over():
+    old = [["a"], ["b", "c", "d"], ["e", "f"]]
+    plan = plan_sync(fingerprint(old), [["a"]], 0, 0)
+    assert (plan.old_rows, plan.new_rows) == (3, 1)
+    assert plan.surplus_cols == 3
+    assert plan.data == []
+
+
+def run_sync(google, tmp_path, steps):
+    """Create a sheet, then run sync(start, values) for each step; returns the sheet id and results"""
+    syncer = SheetSyncer(SyncStore(str(tmp_path / "sync.db")))
+
+    async def scenario():
+        async with google() as client:
+            sheet_id = (await client.call("sheets", "spreadsheets.create", body={}))["spreadsheetId"]
+            results = []
+            for start, values, before in steps:
+                if before is not None:
+                    await before(client, sheet_id)
+                results.append(await syncer.sync(client, client.user, sheet_id, start, values))
+            return sheet_id, results
+
+    return asyncio.run(scenario())
+
+
+def test_resync_only_writes_what_changed(fake, google, tmp_path):
+    table = [["name", "qty"], ["apples", 3], ["pears", 5]]
+    changed = [["name", "qty"], ["apples", 4], ["pears", 5]]
+    sheet_id, results = run_sync(google, tmp_path, [("A1", table, None), ("A1", table, None),
+                                                    ("A1", changed, None)])
+    assert [r["cells_sent"] for r in results] == [6, 0, 1]
+    # The unchanged resync made no call at all: create plus two writes
+    assert fake.calls["POST sheets"] == 3
+    assert fake.sheets[sheet_id].cells[("Sheet1", 1, 1)] == 4
+
+
+def test_shrinking_deletes_rows_from_column_a(fake, google, tmp_path):
+    sheet_id, results = run_sync(google, tmp_path, [("A1", [["a"], ["b"], ["c"]], None), ("A1", [["a"]], None)])
+    assert (results[1]["rows_deleted"], results[1]["rows_cleared"]) == (2, 0)
+    assert fake.sheets[sheet_id].cells == {("Sheet1", 0, 0): "a"}
+
+
+def test_shrinking_beside_other_data_clears_only_the_region(fake, google, tmp_path):
+    async def label_column_a(client, sheet_id):
+        await client.call("sheets", "spreadsheets.values.update", spreadsheetId=sheet_id, range="A1",
+                          valueInputOption="RAW", body={"values": [["keep"]] * 5})
+
+    sheet_id, results = run_sync(google, tmp_path, [("B1", [["a", "b"], ["c", "d"], ["e", "f"]], label_column_a),
+                                                    ("B1", [["a", "b"]], None)])
+    assert (results[1]["rows_deleted"], results[1]["rows_cleared"]) == (0, 2)
+    assert fake.sheets[sheet_id].cells == {
+        ("Sheet1", r, 0): "keep" for r in range(5)
+    } | {("Sheet1", 0, 1): "a", ("Sheet1", 0, 2): "b"}
@@ -0,0 +1,70 @@
+"""
+Tenants: signed OAuth state and per-API-key credentials
+"""
+
+import asyncio
+import datetime
+import time
+
+from google.oauth2.credentials import Credentials
+from starlette.requests import Request
+
+import main
+from main import OAUTH_STATE_TTL, sign_state, verify_state
+
+
+def test_state_round_trips_the_tenant():
+    assert verify_state(sign_state("k" + "0" * 32)) == "k" + "0" * 32
+    assert verify_state(sign_state("tenant with ünïcode")) == "tenant with ünïcode"
+
+
+def test_expired_state_is_rejected():
+    assert verify_state(sign_state("alpha", int(time.time()) - OAUTH_STATE_TTL + 5)) == "alpha"
+    assert verify_state(sign_state("alpha", int(time.time()) - OAUTH_STATE_TTL - 5)) is None
+
+
+def test_tampered_state_is_rejected():
+    state = sign_state("alpha")
+    payload, issued_at, sig = state.split(".")
+    other = sign_state("beta").split(".")[0]
+    assert verify_state(f"{other}.{issued_at}.{sig}") is None
+    # Moving the issue time forward would extend the link's life
+    assert verify_state(f"{payload}.{int(issued_at) + 3600}.{sig}") is None
+    assert verify_state(f"{payload}.{issued_at}.{'0' * 32}") is None
+    assert verify_state(f"{payload}.{issued_at}") is None
+    assert verify_state("ü.1.sig") is None
+
+
+def test_callback_refuses_a_tampered_state(bridge):
+    async def scenario():
+        async with bridge() as (_, client):
+            payload, issued_at, sig = sign_state("alpha").split(".")
+            return await client.get("/oauth2callback", params={"state": f"{payload}.{issued_at}.{sig[::-1]}",
+                                                               "code": "x"})
+
+    response = asyncio.run(scenario())
+    assert response.json()["message"] == "Invalid OAuth state"
+
+
+def test_each_api_key_is_its_own_tenant(fake, bridge):
+    async def scenario():
+        async with bridge() as (_, client):
+            alpha = await main.get_tenant(Request({"type": "http", "headers": [(b"x-api-key", b"alpha")]}))
+            main.credential_store.save(alpha, Credentials(
+                token="alpha-token", refresh_token="r", client_id="c", client_secret="s",
+                expiry=datetime.datetime.utcnow() + datetime.timedelta(days=1),
+            ))
+            results = {}
+            for name, headers in [("alpha", {"X-API-Key": "alpha"}), ("beta", {"X-API-Key": "beta"}),
+                                  ("default", {})]:
+                response = await client.post("/create_doc_chat", json={"name": name}, headers=headers)
+                results[name] = response.json()
+            return alpha, results
+
+    alpha, results = asyncio.run(scenario())
+    assert alpha.startswith("k") and alpha != main.DEFAULT_TENANT
+    assert results["alpha"]["status"] == results["default"]["status"] == "success"
+    # beta never signed in, so it must not fall back to anyone else's Google account
+    assert results["beta"]["status"] == "error" and "auth_url" in results["beta"]
+    writers = {doc.title: doc.modified_by for doc in fake.docs.values()}
+    assert writers == {"alpha": "Bearer alpha-token", "default": "Bearer bench-token"}